@@ -7,27 +7,58 @@ from fastapi.templating import Jinja2Templates
 import sys
 # Imports Locales
 from utils.database import Base, engine
-from routers import clients, metrics, users
-from utils.init_db import get_init_config, init_approved_users
+from routers import alerts, audit, clients, internal, keys, metrics, users, well_known
+from utils.init_db import get_init_config, init_approved_users, init_user_columns, init_user_indexes
+from utils.keystore import prepare_key_store
+from utils.audit import audit_log
+from utils.config import install_reload_signal
+from utils.loadshed import configure_threadpool
 from utils.scheduler import start_scheduler
+from utils.server_timing import ServerTimingMiddleware
+from utils.fastjson import FastJSONResponse
+from utils.compression import CompressionMiddleware
+from utils.ratelimit import RateLimitMiddleware
 
 
 # Verificación de configuraciones iniciales
 get_init_config()
 # Instancia la ceación de la base y sus tablas sino existen
 Base.metadata.create_all(bind=engine)
+# Columnas de versión de users (bases existentes)
+init_user_columns()
 # Verificación inicial de base de datos
 init_approved_users()
+# Índices sin distinguir mayúsculas de users y approved (bases existentes)
+init_user_indexes()
+# Llaves AES: columnas de rotación y envoltura de las llaves legacy
+prepare_key_store()
 # Instancia la aplicación de FastAPI
 app = FastAPI(
     title="FastAPI Template",
     description="Este es una plantilla de app en FastAPI",
     version="1.0.0",
+    default_response_class=FastJSONResponse,
 )
-# Limpieza programada de Nounces
+# Server-Timing por request y perfilado muestreado
+app.add_middleware(ServerTimingMiddleware)
+# Descompresión de requests y compresión de responses (gzip/zstd)
+app.add_middleware(CompressionMiddleware)
+# Rate limiting por IP y por client_id (primero: rechaza sin descomprimir ni tocar la DB)
+app.add_middleware(RateLimitMiddleware)
+# Limpieza programada de Nounces, recarga de configuración (SIGHUP / .env),
+# escritura por lotes de la auditoría y tamaño del threadpool (THREADPOOL_SIZE)
 @app.on_event("startup")
 def startup_event():
+    configure_threadpool()
+    install_reload_signal()
     start_scheduler()
+    audit_log.start()
+
+
+# Los eventos de auditoría pendientes se escriben antes de salir
+@app.on_event("shutdown")
+def shutdown_event():
+    audit_log.close()
 
 # Montar archivos estáticos (CSS/JS/Imagenes)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -39,6 +70,11 @@ templates = Jinja2Templates(directory="templates")
 app.include_router(users.router, prefix="/api/v1/users", tags=["Users"])
 app.include_router(clients.router, prefix="/api/v1/clients", tags=["Clients"])
 app.include_router(metrics.router, prefix="/api/v1/metrics", tags=["Metrics"])
+app.include_router(alerts.router, prefix="/api/v1/alerts", tags=["Alerts"])
+app.include_router(keys.router, prefix="/api/v1/keys", tags=["Keys"])
+app.include_router(audit.router, prefix="/api/v1/audit", tags=["Audit"])
+app.include_router(internal.router, prefix="/api/v1/internal", tags=["Internal"])
+app.include_router(well_known.router, prefix="/.well-known", tags=["Well-known"])
 
 
 
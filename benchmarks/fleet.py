@@ -0,0 +1,152 @@
+""" Flota sintética de agentes para los benchmarks de ingesta """
+from __future__ import annotations
+
+import base64
+import json
+import os
+import secrets
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+
+import httpx
+import msgpack
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+# ----------------------------------------------------------------------
+# Agente sintético: credenciales OAuth + llave AES compartida
+@dataclass
+class SyntheticAgent:
+    client_id: str
+    client_secret: str
+    key_id: str
+    key: bytes
+    hostname: str
+    access_token: str | None = None
+    # "json" (base64, legacy) o "msgpack" (bytes crudos)
+    envelope: str = "json"
+    # Reloj propio: (client_id, server_timestamp) es único en la tabla metrics
+    clock: datetime = field(default_factory=lambda: datetime.now(UTC))
+
+    def next_timestamp(self) -> datetime:
+        """Avanza el reloj del agente para no repetir server_timestamp"""
+        self.clock += timedelta(milliseconds=1)
+        return self.clock
+
+    def build_document(self) -> dict:
+        """Genera un documento de métricas con la forma del agente real"""
+        return {
+            "system": {
+                "hostname": self.hostname,
+                "timestamp": self.next_timestamp().isoformat(),
+                "os": "Linux",
+                "kernel": "6.8.0-bench",
+                "boot_time": "2026-01-01T00:00:00+00:00",
+            },
+            "cpu": {
+                "cpu_percent": round(secrets.randbelow(10000) / 100, 2),
+                "cpu_count": 8,
+            },
+            "memory": {
+                "total": 16 * 1024**3,
+                "percent": round(secrets.randbelow(10000) / 100, 2),
+            },
+            "disk": {
+                "total": 512 * 1024**3,
+                "percent": round(secrets.randbelow(10000) / 100, 2),
+            },
+        }
+
+    def encrypt(self, document: dict) -> tuple[bytes, str]:
+        """Cifra el documento con AES-GCM y un nonce nuevo de 12 bytes"""
+        nonce = os.urandom(12)
+        if self.envelope == "msgpack":
+            plaintext = msgpack.packb(document)
+            ciphertext = AESGCM(self.key).encrypt(nonce, plaintext, None)
+            body = msgpack.packb(
+                {"key_id": self.key_id, "nonce": nonce, "ciphertext": ciphertext}
+            )
+            return body, "application/msgpack"
+
+        plaintext = json.dumps(document).encode("utf-8")
+        ciphertext = AESGCM(self.key).encrypt(nonce, plaintext, None)
+        body = json.dumps({
+            "key_id": self.key_id,
+            "nonce": base64.b64encode(nonce).decode(),
+            "ciphertext": base64.b64encode(ciphertext).decode(),
+        })
+        return body.encode("utf-8"), "application/json"
+
+    def next_payload(self) -> tuple[bytes, str]:
+        """Cuerpo cifrado y Content-Type listos para POST /api/v1/metrics"""
+        return self.encrypt(self.build_document())
+
+    async def fetch_token(self, http: httpx.AsyncClient) -> httpx.Response:
+        """Client Credentials Flow contra /api/v1/clients/token"""
+        response = await http.post(
+            "/api/v1/clients/token",
+            data={
+                "grant_type": "client_credentials",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+            },
+        )
+        if response.status_code == 200:
+            self.access_token = response.json()["access_token"]
+        return response
+
+
+# ----------------------------------------------------------------------
+# Registra la llave AES de la flota directamente en la DB local
+def provision_aes_key(key_id: str, key: bytes | None = None) -> bytes:
+    """Crea (o reutiliza) la llave AES usada por la flota sintética"""
+    # Imports diferidos: solo se necesita acceso a la DB local
+    from models.clients import OAuthClient  # noqa: F401 (tabla referenciada por la FK)
+    from models.security import AESKey
+    from utils.crypto import unwrap_key, wrap_key
+    from utils.database import SessionLocal
+
+    with SessionLocal() as db:
+        aes_key = db.query(AESKey).filter(AESKey.key_id == key_id).first()
+        if aes_key:
+            return unwrap_key(aes_key.key_id, aes_key.key_value)
+
+        key = key or AESGCM.generate_key(bit_length=256)
+        db.add(AESKey(key_id=key_id, key_value=wrap_key(key_id, key)))
+        db.commit()
+        return key
+
+
+# ----------------------------------------------------------------------
+# Enrola N agentes usando el endpoint de admin /api/v1/clients/create
+async def enroll_fleet(
+    http: httpx.AsyncClient,
+    admin_token: str,
+    size: int,
+    key_id: str,
+    key: bytes,
+    envelope: str = "json",
+) -> list[SyntheticAgent]:
+    """Crea los clientes OAuth de la flota y obtiene su primer token"""
+    agents = []
+    for index in range(size):
+        response = await http.post(
+            "/api/v1/clients/create",
+            json={"name": f"bench-agent-{index:04d}", "role": "agent"},
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        agent = SyntheticAgent(
+            client_id=data["client_id"],
+            client_secret=data["client_secret"],
+            key_id=key_id,
+            key=key,
+            hostname=f"bench-host-{index:04d}",
+            envelope=envelope,
+        )
+        (await agent.fetch_token(http)).raise_for_status()
+        agents.append(agent)
+
+    return agents
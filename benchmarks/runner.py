@@ -0,0 +1,288 @@
+""" Runner de carga para los endpoints de ingesta y autenticación
+
+Uso (desde la raíz del repo, con el .env configurado):
+
+    python -m benchmarks.runner --target inprocess --concurrency 16 --requests 500
+    python -m benchmarks.runner --target uvicorn --spawn --workers 2
+    python -m benchmarks.runner --baseline benchmarks/results/anterior.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+import httpx
+
+from .fleet import SyntheticAgent, enroll_fleet, provision_aes_key
+
+SCENARIOS = ("metrics", "client_token", "user_token", "users_me")
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+# ----------------------------------------------------------------------
+# Percentil por rango más cercano sobre una lista ya ordenada
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+# ----------------------------------------------------------------------
+# Resume latencias (segundos) y códigos de estado de un escenario
+def summarize(latencies: list[float], statuses: dict[int, int], elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    ok = sum(count for code, count in statuses.items() if 200 <= code < 300)
+    return {
+        "requests": len(ordered),
+        "ok": ok,
+        "errors": len(ordered) - ok,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "elapsed_s": round(elapsed, 4),
+        "rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+            "p50": round(percentile(ordered, 50) * 1000, 3),
+            "p95": round(percentile(ordered, 95) * 1000, 3),
+            "p99": round(percentile(ordered, 99) * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        },
+    }
+
+
+# ----------------------------------------------------------------------
+# Ejecuta `total` requests con `concurrency` workers concurrentes
+async def run_scenario(send, total: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    remaining = iter(range(total))
+
+    async def worker():
+        for index in remaining:
+            start = time.perf_counter()
+            try:
+                status_code = (await send(index)).status_code
+            except httpx.HTTPError:
+                status_code = 599
+            latencies.append(time.perf_counter() - start)
+            statuses[status_code] = statuses.get(status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+# ----------------------------------------------------------------------
+# Constructores de cada escenario: devuelven send(index) -> Response
+def build_senders(
+    http: httpx.AsyncClient,
+    agents: list[SyntheticAgent],
+    user_form: dict,
+    user_token: str,
+) -> dict:
+    async def send_metrics(index: int) -> httpx.Response:
+        agent = agents[index % len(agents)]
+        body, content_type = agent.next_payload()
+        return await http.post(
+            "/api/v1/metrics",
+            content=body,
+            headers={
+                "Authorization": f"Bearer {agent.access_token}",
+                "Content-Type": content_type,
+            },
+        )
+
+    async def send_client_token(index: int) -> httpx.Response:
+        return await agents[index % len(agents)].fetch_token(http)
+
+    async def send_user_token(index: int) -> httpx.Response:
+        return await http.post("/api/v1/users/token", data=user_form)
+
+    async def send_users_me(index: int) -> httpx.Response:
+        return await http.get(
+            "/api/v1/users/me",
+            headers={"Authorization": f"Bearer {user_token}"},
+        )
+
+    return {
+        "metrics": send_metrics,
+        "client_token": send_client_token,
+        "user_token": send_user_token,
+        "users_me": send_users_me,
+    }
+
+
+# ----------------------------------------------------------------------
+# Cliente HTTP contra la app en proceso (ASGI) o un uvicorn local
+def build_client(args) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    if args.target == "inprocess":
+        from app.main import app
+
+        return httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://bench",
+            limits=limits,
+        )
+    return httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30)
+
+
+# ----------------------------------------------------------------------
+# Levanta uvicorn como subproceso y espera a que responda
+def spawn_uvicorn(args) -> subprocess.Popen:
+    host, _, port = args.base_url.removeprefix("http://").partition(":")
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", host, "--port", port or "8000",
+            "--workers", str(args.workers),
+            "--log-level", "warning",
+        ],
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{args.base_url}/", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("uvicorn no respondió en 30 segundos")
+
+
+# ----------------------------------------------------------------------
+# Compara los resultados actuales contra una corrida previa
+def print_report(results: dict, baseline: dict | None = None):
+    header = f"{'escenario':<14}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errores':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, stats in results["scenarios"].items():
+        latency = stats["latency_ms"]
+        print(
+            f"{name:<14}{stats['rps']:>10}{latency['p50']:>10}"
+            f"{latency['p95']:>10}{latency['p99']:>10}{stats['errors']:>9}"
+        )
+        previous = (baseline or {}).get("scenarios", {}).get(name)
+        if previous:
+            deltas = [
+                f"{key} {((stats['latency_ms'][key] / previous['latency_ms'][key]) - 1) * 100:+.1f}%"
+                for key in ("p50", "p95", "p99")
+                if previous["latency_ms"][key]
+            ]
+            if previous["rps"]:
+                deltas.insert(0, f"rps {((stats['rps'] / previous['rps']) - 1) * 100:+.1f}%")
+            print(f"{'':<14}vs baseline: {', '.join(deltas)}")
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ----------------------------------------------------------------------
+# Flujo principal del benchmark
+async def run(args) -> dict:
+    async with build_client(args) as http:
+        # Token del usuario (por defecto el admin creado por init_db)
+        user_form = {"username": args.user_email, "password": args.user_password}
+        response = await http.post("/api/v1/users/token", data=user_form)
+        response.raise_for_status()
+        user_token = response.json()["access_token"]
+
+        key = provision_aes_key(args.key_id)
+        agents = await enroll_fleet(
+            http, user_token, args.agents, args.key_id, key, args.envelope
+        )
+        senders = build_senders(http, agents, user_form, user_token)
+
+        results = {
+            "meta": {
+                "started_at": datetime.now(UTC).isoformat(),
+                "git_revision": git_revision(),
+                "python": platform.python_version(),
+                "target": args.target,
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "agents": args.agents,
+                "envelope": args.envelope,
+            },
+            "scenarios": {},
+        }
+        for name in args.scenarios:
+            send = senders[name]
+            # Argon2 domina /users/token: se limita su volumen por defecto
+            total = args.requests if name != "user_token" else min(args.requests, args.auth_requests)
+            if args.warmup:
+                await run_scenario(send, args.warmup, args.concurrency)
+            results["scenarios"][name] = await run_scenario(send, total, args.concurrency)
+        return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="Levanta uvicorn como subproceso")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--auth-requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--agents", type=int, default=8)
+    parser.add_argument("--key-id", default="bench")
+    parser.add_argument("--envelope", choices=("json", "msgpack"), default="json")
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: [name for name in value.split(",") if name],
+        default=list(SCENARIOS),
+    )
+    parser.add_argument("--user-email", default=None)
+    parser.add_argument("--user-password", default="admin")
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=None)
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+    if args.user_email is None:
+        from utils.config import get_config
+
+        args.user_email = get_config().admin
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    process = spawn_uvicorn(args) if args.target == "uvicorn" and args.spawn else None
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    output = args.output or RESULTS_DIR / f"{datetime.now(UTC):%Y%m%dT%H%M%SZ}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print_report(results, baseline)
+    print(f"\nResultados guardados en {os.path.relpath(output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+""" Modelos de alertas: reglas, estado por cliente y outbox de notificaciones """
+from __future__ import annotations
+
+from datetime import UTC, datetime
+
+from sqlalchemy import (
+    Boolean,
+    DateTime,
+    Float,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+)
+from sqlalchemy.orm import Mapped, mapped_column
+
+from utils.database import Base
+
+
+class AlertRule(Base):
+    """Regla evaluada en la ingesta sobre una métrica de cada muestra"""
+    __tablename__ = "alert_rules"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+
+    name: Mapped[str] = mapped_column(String(100), nullable=False)
+
+    # cpu_percent | memory_percent | disk_percent
+    metric: Mapped[str] = mapped_column(String(30), nullable=False)
+
+    # threshold: valor sostenido durante window_seconds
+    # rate: variación del valor dentro de window_seconds
+    # anomaly: z-score contra la media/varianza EWMA
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)
+
+    # ">" o "<" (se compara el valor, la variación o el z-score)
+    operator: Mapped[str] = mapped_column(String(1), nullable=False, default=">")
+
+    threshold: Mapped[float] = mapped_column(Float, nullable=False)
+
+    window_seconds: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    # Solo anomaly: factor de suavizado y muestras mínimas antes de evaluar
+    alpha: Mapped[float] = mapped_column(Float, nullable=False, default=0.1)
+    min_samples: Mapped[int] = mapped_column(Integer, nullable=False, default=10)
+
+    # None = todos los clientes
+    client_id: Mapped[int | None] = mapped_column(
+        ForeignKey("clients.id", ondelete="CASCADE"),
+        nullable=True,
+        index=True,
+    )
+
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(UTC),
+        nullable=False,
+    )
+
+
+class AlertState(Base):
+    """Estado de una regla para un cliente y su ventana deslizante"""
+    __tablename__ = "alert_states"
+
+    rule_id: Mapped[int] = mapped_column(
+        ForeignKey("alert_rules.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    client_id: Mapped[int] = mapped_column(
+        ForeignKey("clients.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+
+    # ok | firing
+    status: Mapped[str] = mapped_column(String(10), nullable=False, default="ok")
+
+    # Inicio del estado actual (timestamp de la muestra que lo cambió)
+    since: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    # Último valor evaluado (valor, variación o z-score según la regla)
+    value: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # Última muestra evaluada (las atrasadas se ignoran)
+    last_timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    # Ventana deslizante serializada con MessagePack
+    window: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class AlertNotification(Base):
+    """Outbox: un cambio de estado por fila, escrito en la misma transacción"""
+    __tablename__ = "alert_notifications"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+
+    rule_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+
+    client_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+
+    # firing | resolved
+    status: Mapped[str] = mapped_column(String(10), nullable=False)
+
+    # Copia de la regla al momento del cambio (la regla puede borrarse)
+    rule_name: Mapped[str] = mapped_column(String(100), nullable=False)
+    metric: Mapped[str] = mapped_column(String(30), nullable=False)
+
+    value: Mapped[float] = mapped_column(Float, nullable=False)
+
+    # Timestamp de la muestra que produjo el cambio
+    observed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(UTC),
+        nullable=False,
+    )
+
+    # Entrega (dispatcher): None = pendiente
+    delivered_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+        index=True,
+    )
+    # Reserva temporal de un worker mientras la entrega
+    claimed_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
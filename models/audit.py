@@ -0,0 +1,54 @@
+""" Registro de auditoría: tabla de solo inserción (utils/audit.py la escribe por lotes) """
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import DDL, DateTime, Index, Integer, String, event
+from sqlalchemy.orm import Mapped, mapped_column
+
+from utils.database import Base
+from utils.fastjson import FastJSON
+
+
+class AuditEvent(Base):
+    __tablename__ = "audit_events"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    # Momento del evento (no del flush del lote)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    # Usuario (username), cliente ("client:<id>") o lo enviado en un login fallido
+    actor: Mapped[str] = mapped_column(String(120), nullable=False)
+
+    # login, login_failed, token_grant, user_update, client_create, replay_rejected, ...
+    action: Mapped[str] = mapped_column(String(40), nullable=False)
+
+    # Objeto afectado (ej: "user:12")
+    target: Mapped[str | None] = mapped_column(String(120), nullable=True)
+
+    ip: Mapped[str | None] = mapped_column(String(45), nullable=True)
+
+    detail: Mapped[dict | None] = mapped_column(FastJSON, nullable=True)
+
+    # Consultas por actor / acción dentro de un rango de tiempo
+    __table_args__ = (
+        Index("ix_audit_actor_time", "actor", "created_at"),
+        Index("ix_audit_action_time", "action", "created_at"),
+        Index("ix_audit_created_at", "created_at"),
+    )
+
+
+# Solo inserción: la base rechaza UPDATE y DELETE sobre la tabla
+APPEND_ONLY_TRIGGERS = (
+    DDL(
+        "CREATE TRIGGER IF NOT EXISTS audit_events_no_update BEFORE UPDATE ON audit_events "
+        "BEGIN SELECT RAISE(ABORT, 'audit_events es de solo inserción'); END"
+    ),
+    DDL(
+        "CREATE TRIGGER IF NOT EXISTS audit_events_no_delete BEFORE DELETE ON audit_events "
+        "BEGIN SELECT RAISE(ABORT, 'audit_events es de solo inserción'); END"
+    ),
+)
+for _trigger in APPEND_ONLY_TRIGGERS:
+    event.listen(AuditEvent.__table__, "after_create", _trigger)
@@ -3,10 +3,19 @@
 from __future__ import annotations
 
 from datetime import UTC, datetime
-from sqlalchemy import DateTime, Float, ForeignKey, Integer, String, JSON, UniqueConstraint
+from sqlalchemy import (
+    DateTime,
+    Float,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    String,
+    UniqueConstraint,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from utils.database import Base
+from utils.database import PARTITION_SCHEMA, Base
+from utils.fastjson import FastJSON
 
 
 class ServerMetrics(Base):
@@ -42,7 +51,7 @@ class ServerMetrics(Base):
     disk_percent: Mapped[float] = mapped_column(Float, nullable=False)
 
     # JSON opcional completo (para debug o expansión futura)
-    raw_payload: Mapped[dict] = mapped_column(JSON, nullable=True)
+    raw_payload: Mapped[dict] = mapped_column(FastJSON, nullable=True)
 
     # Timestamp recepción en API
     created_at: Mapped[datetime] = mapped_column(
@@ -52,9 +61,93 @@ class ServerMetrics(Base):
     )
 
     # Considerar un index compuesto (client_id, server_timestamp)
+    # Único por partición: el mes sale de server_timestamp
     __table_args__ = (UniqueConstraint(
         "client_id", 
         "server_timestamp", 
         name="uq_client_srvtime",
         ),
-    )
\ No newline at end of file
+        {"schema": PARTITION_SCHEMA},
+    )
+
+
+class PayloadBlob(Base):
+    """Secciones repetidas de raw_payload, direccionadas por contenido"""
+    __tablename__ = "payload_blobs"
+
+    # sha256 (128 bits, base64url) del JSON canónico de las secciones
+    digest: Mapped[str] = mapped_column(String(32), primary_key=True)
+
+    # JSON comprimido con zstd
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(UTC),
+        nullable=False,
+    )
+
+
+class ClientLatest(Base):
+    """Última muestra de cada cliente (se actualiza en cada ingesta)"""
+    __tablename__ = "client_latest"
+
+    client_id: Mapped[int] = mapped_column(
+        ForeignKey("clients.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    # Fila de metrics de la que proviene
+    metrics_id: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    hostname: Mapped[str] = mapped_column(String(150), nullable=False)
+
+    server_timestamp: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+    )
+
+    cpu_percent: Mapped[float] = mapped_column(Float, nullable=False)
+    memory_percent: Mapped[float] = mapped_column(Float, nullable=False)
+    disk_percent: Mapped[float] = mapped_column(Float, nullable=False)
+
+    # Recepción en la API (reloj del servidor: define si el cliente está "stale")
+    received_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        index=True,
+    )
+
+
+class MetricSketch(Base):
+    """Histogramas de cpu, memoria y disco por cliente y bucket de tiempo"""
+    __tablename__ = "metric_sketches"
+
+    client_id: Mapped[int] = mapped_column(
+        ForeignKey("clients.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    # Inicio del bucket (UTC, alineado a SKETCH_BUCKET_SECONDS)
+    bucket_start: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        primary_key=True,
+        index=True,
+    )
+
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    # Histogramas serializados (utils/sketches.py)
+    cpu_percent: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    memory_percent: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    disk_percent: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class MetricSequence(Base):
+    """Ids de metrics globales entre particiones (cada una tiene su tabla)"""
+    __tablename__ = "metric_sequence"
+
+    name: Mapped[str] = mapped_column(String(30), primary_key=True)
+
+    # Último id reservado
+    value: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -44,11 +44,23 @@ class AESKey(Base):
 
     key_id: Mapped[str] = mapped_column(String(20), unique=True)
 
-    key_value: Mapped[str] = mapped_column(String(255))  # base64
+    # Envuelta con AES_SECRET_KEY ("w1:" + base64); sin prefijo = base64 plano (legacy)
+    key_value: Mapped[str] = mapped_column(String(255))
 
     is_active: Mapped[bool] = mapped_column(default=True)
 
+    # None = llave compartida (cualquier cliente puede usarla)
+    client_id: Mapped[int | None] = mapped_column(
+        ForeignKey("clients.id", ondelete="CASCADE"),
+        nullable=True,
+        index=True,
+    )
+
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         default=lambda: datetime.now(UTC),
     )
+
+    # Rotación: reemplazada por otra llave; descifra hasta decrypt_until
+    retired_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    decrypt_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
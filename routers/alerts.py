@@ -0,0 +1,147 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from models.alerts import AlertNotification, AlertRule, AlertState
+from models.clients import OAuthClient
+from models.users import User
+from routers.users import get_current_admin
+from schemas.alerts import (
+    AlertNotificationResponse,
+    AlertRuleCreate,
+    AlertRuleResponse,
+    AlertStateResponse,
+)
+from utils.alerts import invalidate_rules
+from utils.database import get_db
+from utils.fastjson import model_response
+from utils.server_timing import TimedRoute
+
+router = APIRouter(route_class=TimedRoute)
+
+
+# ----------------------------------------------------------------------
+# Crea una regla (se evalúa desde la próxima muestra de cada cliente)
+@router.post(
+    "/rules",
+    response_model=AlertRuleResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+def create_alert_rule(
+    rule_data: AlertRuleCreate,
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+):
+    """Crea una regla de alerta (solo admin)"""
+    if rule_data.client_id is not None and db.get(OAuthClient, rule_data.client_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Client not found",
+        )
+
+    rule = AlertRule(**rule_data.model_dump())
+    db.add(rule)
+    db.commit()
+    db.refresh(rule)
+    invalidate_rules()
+
+    return model_response(rule, AlertRuleResponse, status_code=status.HTTP_201_CREATED)
+
+
+# ----------------------------------------------------------------------
+# Lista las reglas
+@router.get(
+    "/rules",
+    response_model=list[AlertRuleResponse],
+    status_code=status.HTTP_200_OK,
+)
+def list_alert_rules(
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+):
+    """Lista las reglas de alerta (solo admin)"""
+    rules = db.scalars(select(AlertRule).order_by(AlertRule.id)).all()
+    return model_response(rules, list[AlertRuleResponse])
+
+
+# ----------------------------------------------------------------------
+# Elimina una regla y su estado por cliente (el outbox se conserva)
+@router.delete("/rules/{rule_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_alert_rule(
+    rule_id: int,
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+):
+    rule = db.get(AlertRule, rule_id)
+    if rule is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Alert rule not found",
+        )
+
+    db.execute(delete(AlertState).where(AlertState.rule_id == rule_id))
+    db.delete(rule)
+    db.commit()
+    invalidate_rules()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+# ----------------------------------------------------------------------
+# Alertas activas (estado firing) de toda la flota
+@router.get(
+    "/active",
+    response_model=list[AlertStateResponse],
+    status_code=status.HTTP_200_OK,
+)
+def list_active_alerts(
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+):
+    """Alertas en estado firing (solo admin)"""
+    rows = db.execute(
+        select(
+            AlertState.rule_id,
+            AlertRule.name.label("rule_name"),
+            AlertState.client_id,
+            OAuthClient.name.label("client_name"),
+            AlertRule.metric,
+            AlertState.status,
+            AlertState.since,
+            AlertState.value,
+            AlertState.last_timestamp,
+        )
+        .join(AlertRule, AlertRule.id == AlertState.rule_id)
+        .join(OAuthClient, OAuthClient.id == AlertState.client_id)
+        .where(AlertState.status == "firing")
+        .order_by(AlertState.since)
+    ).all()
+    return model_response(rows, list[AlertStateResponse])
+
+
+# ----------------------------------------------------------------------
+# Outbox de notificaciones (cambios de estado), más recientes primero
+@router.get(
+    "/notifications",
+    response_model=list[AlertNotificationResponse],
+    status_code=status.HTTP_200_OK,
+)
+def list_alert_notifications(
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+    pending: bool | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Notificaciones de alertas; `pending` filtra por entregadas o no (solo admin)"""
+    query = select(AlertNotification)
+    if pending is not None:
+        query = query.where(
+            AlertNotification.delivered_at.is_(None)
+            if pending
+            else AlertNotification.delivered_at.is_not(None)
+        )
+    notifications = db.scalars(
+        query.order_by(AlertNotification.id.desc()).limit(limit)
+    ).all()
+    return model_response(notifications, list[AlertNotificationResponse])
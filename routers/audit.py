@@ -0,0 +1,37 @@
+from datetime import datetime
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Query, status
+from sqlalchemy.orm import Session
+
+from models.users import User
+from routers.users import get_current_admin
+from schemas.audit import AuditEventResponse
+from utils.audit import query_events
+from utils.database import get_db
+from utils.fastjson import model_response
+from utils.server_timing import TimedRoute
+
+router = APIRouter(route_class=TimedRoute)
+
+
+# ----------------------------------------------------------------------
+# Eventos por actor y/o acción en [start, end), más recientes primero.
+# Página siguiente: end=created_at y before_id=id del último evento recibido.
+@router.get(
+    "",
+    response_model=list[AuditEventResponse],
+    status_code=status.HTTP_200_OK,
+)
+def get_audit_events(
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+    actor: str | None = None,
+    action: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    before_id: int | None = Query(default=None, ge=1),
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    events = query_events(db, actor, action, start, end, before_id, limit)
+    return model_response(events, list[AuditEventResponse])
@@ -1,8 +1,7 @@
 from typing import Annotated
-from datetime import timedelta
 import secrets
 
-from fastapi import APIRouter, Depends, Form, HTTPException, status
+from fastapi import APIRouter, Depends, Form, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 
@@ -12,14 +11,19 @@ from schemas.clients import (
     ClientCreateResponse,
     ClientTokenResponse,
 )
+from utils.audit import audit_log, client_ip
 from utils.database import get_db
 from utils.auth import hash_password, create_access_token, verify_password
-from utils.config import settings
+from utils.config import get_config
+from utils.loadshed import concurrency_group
+from utils.ratelimit import rate_limiter, split_scopes
+from utils.server_timing import TimedRoute
 from routers.users import get_current_admin
+from utils.fastjson import model_response
 from models.users import User
 
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 # ----------------------------------------------------------------------
@@ -56,17 +60,26 @@ def create_oauth_client(
     db.add(new_client)
     db.commit()
     db.refresh(new_client)
+    audit_log.record(
+        "client_create",
+        admin_user.username,
+        target=f"client:{new_client.id}",
+        detail={"client_id": new_client.client_id, "role": new_client.role},
+    )
 
     # 4️⃣ Responder mostrando secret SOLO UNA VEZ
-    return ClientCreateResponse(
-        id=new_client.id,
-        client_id=new_client.client_id,
-        client_secret=client_secret,
-        name=new_client.name,
-        role=new_client.role,
-        scopes=new_client.scopes,
-        is_active=new_client.is_active,
-        created_at=new_client.created_at,
+    return model_response(
+        ClientCreateResponse(
+            id=new_client.id,
+            client_id=new_client.client_id,
+            client_secret=client_secret,
+            name=new_client.name,
+            role=new_client.role,
+            scopes=new_client.scopes,
+            is_active=new_client.is_active,
+            created_at=new_client.created_at,
+        ),
+        status_code=status.HTTP_201_CREATED,
     )
 
 
@@ -77,7 +90,9 @@ def create_oauth_client(
     response_model=ClientTokenResponse,
     status_code=status.HTTP_200_OK,
 )
+@concurrency_group("auth")
 def client_credentials_token(
+    request: Request,
     db: Annotated[Session, Depends(get_db)],
     grant_type: str = Form(...),
     client_id: str = Form(...),
@@ -93,12 +108,21 @@ def client_credentials_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Intentos por client_id (el middleware solo limita la IP: el client_id viene en el form)
+    rate_limiter.check_token_request(client_id)
+
     # 2️⃣ Buscar cliente
     result = db.execute(select(OAuthClient).where(OAuthClient.client_id == client_id))
     client = result.scalars().first()
 
     # 3️⃣ Verificar si existe y Verificar secret (Argon2)
     if not client or not verify_password(client_secret, client.client_secret_hash):
+        audit_log.record(
+            "token_denied",
+            client_id,
+            ip=client_ip(request),
+            detail={"reason": "credentials"},
+        )
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Credenciales de cliente Inválidas",
@@ -107,6 +131,12 @@ def client_credentials_token(
 
     # 4️⃣ Verificar si está activo
     if not client.is_active:
+        audit_log.record(
+            "token_denied",
+            f"client:{client.id}",
+            ip=client_ip(request),
+            detail={"reason": "inactive"},
+        )
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Error: Cliente inactivo",
@@ -114,9 +144,7 @@ def client_credentials_token(
         )
 
     # 5️⃣ Definir expiración
-    access_token_expires = timedelta(
-        minutes=int(settings.ACCESS_TOKEN_EXPIRE_MINUTES.get_secret_value())
-    )
+    access_token_expires = get_config().access_token_expire
 
     # 6️⃣ Crear JWT
     access_token = create_access_token(
@@ -124,12 +152,18 @@ def client_credentials_token(
             "sub": str(client.client_id),
             "type": "client",
             "role": str(client.role),
+            # Scopes OAuth (separados por espacio): los usa el rate limiting
+            "scope": " ".join(split_scopes(client.scopes)),
         },
         expires_delta=access_token_expires,
     )
 
-    return ClientTokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        expires_in=access_token_expires,
+    audit_log.record("token_grant", f"client:{client.id}", ip=client_ip(request))
+
+    return model_response(
+        ClientTokenResponse(
+            access_token=access_token,
+            token_type="bearer",
+            expires_in=int(access_token_expires.total_seconds()),
+        )
     )
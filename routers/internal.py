@@ -0,0 +1,102 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import FileResponse, PlainTextResponse
+from anyio import to_thread
+
+from models.users import User
+from routers.users import get_current_admin
+
+from utils.config import get_config
+from utils.database import engine
+from utils.server_timing import TimedRoute
+from utils.profiling import list_profiles, profile_path
+from utils.stats import register_gauge, render_prometheus
+
+router = APIRouter(route_class=TimedRoute)
+
+# ----------------------------------------------------------------------
+# Restringe el acceso a las IPs internas configuradas (ej: Prometheus local)
+def require_internal_access(request: Request):
+    if request.client is None or request.client.host not in get_config().internal_allowed_ips:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acceso denegado",
+        )
+
+
+# ----------------------------------------------------------------------
+# Gauges del pool de la DB (QueuePool expone size/checkedout/overflow)
+def _db_pool_stats() -> dict[str, float]:
+    pool = engine.pool
+    stats = {}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if method is not None:
+            stats[name] = method()
+    return stats
+
+
+# ----------------------------------------------------------------------
+# Gauges del threadpool de anyio donde corren los handlers sync
+def _threadpool_stats() -> dict[str, float]:
+    limiter = to_thread.current_default_thread_limiter()
+    return {
+        "total": limiter.total_tokens,
+        "borrowed": limiter.borrowed_tokens,
+    }
+
+
+def _threadpool_queue() -> float:
+    limiter = to_thread.current_default_thread_limiter()
+    return limiter.statistics().tasks_waiting
+
+
+register_gauge("db_pool_connections", "Estado del pool de conexiones", _db_pool_stats)
+register_gauge("threadpool_tokens", "Uso del threadpool de handlers sync", _threadpool_stats)
+register_gauge(
+    "queue_depth_threadpool_waiting",
+    "Tareas esperando un hilo del threadpool",
+    _threadpool_queue,
+)
+
+
+# ----------------------------------------------------------------------
+# Exporta histogramas del hot path y gauges en formato Prometheus
+# async: los gauges del threadpool deben leerse desde el event loop
+@router.get(
+    "/stats",
+    response_class=PlainTextResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_internal_access)],
+)
+async def get_internal_stats():
+    """Histogramas por etapa, threadpool, pool de DB y colas"""
+    return PlainTextResponse(
+        render_prometheus(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+# ----------------------------------------------------------------------
+# Lista los perfiles de stacks guardados (solo admin)
+@router.get("/profiles", status_code=status.HTTP_200_OK)
+def get_profiles(admin_user: Annotated[User, Depends(get_current_admin)]):
+    """Perfiles muestreados, del más reciente al más antiguo"""
+    return list_profiles()
+
+
+# ----------------------------------------------------------------------
+# Descarga un perfil en formato collapsed (flamegraph.pl / speedscope)
+@router.get("/profiles/{name}", status_code=status.HTTP_200_OK)
+def download_profile(
+    name: str,
+    admin_user: Annotated[User, Depends(get_current_admin)],
+):
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Este perfil no existe",
+        )
+    return FileResponse(path, media_type="text/plain", filename=name)
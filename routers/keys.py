@@ -0,0 +1,121 @@
+from datetime import timedelta
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models.clients import OAuthClient
+from models.security import AESKey
+from models.users import User
+from routers.users import get_current_admin
+from schemas.keys import (
+    AESKeyResponse,
+    IssuedKeyResponse,
+    KeyProvisionRequest,
+    KeyRotateRequest,
+)
+from utils.database import get_db
+from utils.fastjson import model_response
+from utils.keystore import provision_keys, revoke_key, rotate_key
+from utils.server_timing import TimedRoute
+
+router = APIRouter(route_class=TimedRoute)
+
+
+def _grace(seconds: int | None) -> timedelta | None:
+    return None if seconds is None else timedelta(seconds=seconds)
+
+
+def _get_key(db: Session, key_id: str) -> AESKey:
+    aes_key = db.scalar(select(AESKey).where(AESKey.key_id == key_id))
+    if aes_key is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Key not found",
+        )
+    return aes_key
+
+
+# ----------------------------------------------------------------------
+# Lista las llaves (sin material), más recientes primero
+@router.get(
+    "",
+    response_model=list[AESKeyResponse],
+    status_code=status.HTTP_200_OK,
+)
+def list_keys(
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+    client_id: int | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Llaves AES; `client_id` filtra por cliente (solo admin)"""
+    query = select(AESKey)
+    if client_id is not None:
+        query = query.where(AESKey.client_id == client_id)
+    keys = db.scalars(query.order_by(AESKey.id.desc()).limit(limit)).all()
+    return model_response(keys, list[AESKeyResponse])
+
+
+# ----------------------------------------------------------------------
+# Provisión masiva: una llave nueva por cliente (rota las vigentes)
+@router.post(
+    "/provision",
+    response_model=list[IssuedKeyResponse],
+    status_code=status.HTTP_201_CREATED,
+)
+def provision_client_keys(
+    request: KeyProvisionRequest,
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+):
+    """Crea una llave por cliente; las anteriores descifran hasta el corte (solo admin)"""
+    client_ids = list(dict.fromkeys(request.client_ids))
+    found = set(db.scalars(select(OAuthClient.id).where(OAuthClient.id.in_(client_ids))))
+    missing = [client_id for client_id in client_ids if client_id not in found]
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Clients not found: {missing}",
+        )
+
+    issued = provision_keys(db, client_ids, _grace(request.grace_seconds))
+    return model_response(issued, list[IssuedKeyResponse], status_code=status.HTTP_201_CREATED)
+
+
+# ----------------------------------------------------------------------
+# Rota una llave: la nueva tiene el mismo dueño; la anterior descifra hasta el corte
+@router.post(
+    "/{key_id}/rotate",
+    response_model=IssuedKeyResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+def rotate_aes_key(
+    key_id: str,
+    request: KeyRotateRequest,
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+):
+    """Rota una llave vigente (solo admin)"""
+    aes_key = _get_key(db, key_id)
+    if not aes_key.is_active or aes_key.retired_at is not None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Key already retired",
+        )
+
+    issued = rotate_key(db, aes_key, _grace(request.grace_seconds))
+    return model_response(issued, IssuedKeyResponse, status_code=status.HTTP_201_CREATED)
+
+
+# ----------------------------------------------------------------------
+# Revoca una llave de inmediato (sin margen)
+@router.delete("/{key_id}", status_code=status.HTTP_204_NO_CONTENT)
+def revoke_aes_key(
+    key_id: str,
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+):
+    revoke_key(db, _get_key(db, key_id))
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,19 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, WebSocket, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from typing import Annotated
-from datetime import datetime
+from datetime import UTC, datetime, timedelta
+from typing import Literal
 
-from utils.database import get_db
-from utils.auth import get_current_client
+from utils.database import SessionLocal, get_db
+from utils.auth import get_current_client, get_current_user, oauth2_user_scheme
+from utils.analytics import fleet_growth, fleet_stats
 from utils.crypto import decrypt_payload
+from utils.envelope import Envelope, read_envelope
+from utils.compression import ZSTD_DICT
+from utils.config import get_config
 from models.clients import OAuthClient
-from models.metrics import ServerMetrics
+from models.metrics import ClientLatest, ServerMetrics
 from models.security import UsedNonce
+from models.users import User
+from routers.users import get_current_admin
+from schemas.metrics import (
+    ClientLatestResponse,
+    FleetGrowthResponse,
+    FleetStatsResponse,
+    MetricSampleResponse,
+    PercentileResponse,
+)
+from utils.fastjson import model_response
+from utils.ingest import (
+    build_sample,
+    commit_error,
+    expired_error,
+    replay_error,
+    store_samples,
+)
+from utils.partitions import is_retained, prepare, read_partitions, routed
+from utils.ingest_stream import IngestStream
+from utils.live import LIVE_HISTORY_SIZE, live_hub
+from utils.loadshed import concurrency_group
+from utils.payload_store import expand_payloads
+from utils.stats import stage_timer
+from utils.server_timing import TimedRoute
+from utils.sketches import merge_sketches
 
-from dateutil.parser import isoparse
+router = APIRouter(route_class=TimedRoute)
 
-router = APIRouter()
+# Comentario SSE periódico: mantiene viva la conexión y detecta desconexiones
+LIVE_HEARTBEAT_SECONDS = 15
 
 
 # ----------------------------------------------------------------------
@@ -21,9 +56,30 @@ router = APIRouter()
 @router.post(
     "",
     status_code=status.HTTP_200_OK,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "object",
+                        "description": "key_id, nonce y ciphertext en base64",
+                    },
+                },
+                "application/msgpack": {
+                    "schema": {
+                        "type": "object",
+                        "description": "key_id, nonce y ciphertext como bytes crudos; "
+                        "plaintext en MessagePack (o JSON con format='json')",
+                    },
+                },
+            },
+        },
+    },
 )
+@concurrency_group("ingest")
 def receive_metrics(
-    encrypted_payload: dict,
+    envelope: Annotated[Envelope, Depends(read_envelope)],
     db: Annotated[Session, Depends(get_db)],
     current_client: OAuthClient = Depends(get_current_client),
 ):
@@ -36,71 +92,317 @@ def receive_metrics(
             detail="Permiso Denegado",
         )
 
-    # Validación anti-Replay
-    nonce_value = encrypted_payload.get("nonce")
-
-    if not nonce_value:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Nonce missing",
-        )
+    # 🔓 Descifrar y validar el documento antes de consumir el nonce: un
+    # payload inválido responde 400 sin dejar el nonce registrado
+    document = decrypt_payload(envelope, db, current_client.id)
+    if not is_retained(document.system.timestamp):
+        raise expired_error()
+    # Partición del mes de la muestra (se adjunta antes de la primera escritura)
+    prepare(db, [document.system.timestamp])
 
+    # Validación anti-Replay (el nonce se guarda en base64 para ambos formatos)
     new_nonce = UsedNonce(
         client_id=current_client.id,
-        nonce=nonce_value,
+        nonce=envelope.nonce_key,
     )
 
     try:
-        db.add(new_nonce)
-        db.commit()
-        db.refresh(new_nonce)
+        with stage_timer("nonce_insert"):
+            db.add(new_nonce)
+            db.flush()
     except IntegrityError:
         db.rollback()
+        raise replay_error(current_client.id, envelope.nonce_key)
+
+    # 💾 Guardar en DB (nonce y métrica en la misma transacción)
+    new_metrics = build_sample(db, current_client.id, document)
+
+    try:
+        store_samples(db, current_client.id, [new_metrics])
+    except IntegrityError as exc:
+        db.rollback()
+        raise commit_error(current_client.id, exc)
+
+    return {
+        "message": "Metrics stored successfully",
+        "client": current_client.client_id,
+    }
+
+
+# ----------------------------------------------------------------------
+# Ingesta por WebSocket: el agente se autentica una vez y envía muestras
+# en stream (protocolo en utils/ingest_stream.py)
+@router.websocket("/ws")
+async def receive_metrics_stream(websocket: WebSocket):
+    await IngestStream(websocket).run()
+
+
+# ----------------------------------------------------------------------
+# Diccionario zstd para que los agentes compriman su plaintext
+@router.get(
+    "/zstd-dictionary",
+    status_code=status.HTTP_200_OK,
+)
+def get_zstd_dictionary(
+    current_client: OAuthClient = Depends(get_current_client),
+):
+    """Descarga el diccionario zstd entrenado (si está configurado)"""
+    if ZSTD_DICT is None:
         raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Replay attack detected",
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No hay diccionario zstd configurado",
         )
+    return Response(
+        content=ZSTD_DICT.as_bytes(),
+        media_type="application/octet-stream",
+        headers={"X-Zstd-Dict-Id": str(ZSTD_DICT.dict_id())},
+    )
 
-    # 🔓 Descifrar
-    decrypted_data = decrypt_payload(encrypted_payload)
 
-    # Aquí puedes validar estructura mínima
-    if "system" not in decrypted_data:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid metrics format",
+# ----------------------------------------------------------------------
+# Muestras de un cliente con el documento completo (solo admin)
+@router.get(
+    "/clients/{client_id}",
+    response_model=list[MetricSampleResponse],
+    status_code=status.HTTP_200_OK,
+)
+def get_client_samples(
+    client_id: int,
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+    start: datetime | None = None,
+    end: datetime | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    query = select(ServerMetrics).where(ServerMetrics.client_id == client_id)
+    if start is not None:
+        query = query.where(ServerMetrics.server_timestamp >= start)
+    if end is not None:
+        query = query.where(ServerMetrics.server_timestamp < end)
+    query = query.order_by(ServerMetrics.server_timestamp.desc())
+
+    # Particiones del rango, de la más reciente a la más antigua
+    rows = []
+    for partition in read_partitions(db, start, end, newest_first=True):
+        rows += db.execute(
+            query.limit(limit - len(rows)),
+            execution_options=routed(db, partition),
+        ).scalars().all()
+        if len(rows) >= limit:
+            break
+
+    # raw_payload se reconstruye aunque esté guardado en modo compacto
+    samples = [
+        MetricSampleResponse(
+            id=row.id,
+            client_id=row.client_id,
+            hostname=row.hostname,
+            server_timestamp=row.server_timestamp,
+            cpu_percent=row.cpu_percent,
+            memory_percent=row.memory_percent,
+            disk_percent=row.disk_percent,
+            raw_payload=payload,
+            created_at=row.created_at,
         )
-    
-    try:
-        hostname = decrypted_data["system"]["hostname"]
-        server_timestamp = isoparse(decrypted_data["system"]["timestamp"])
+        for row, payload in zip(rows, expand_payloads(db, rows))
+    ]
+    return model_response(samples, list[MetricSampleResponse])
+
+
+# ----------------------------------------------------------------------
+# Estado actual de la flota: última muestra de cada cliente (solo admin)
+@router.get(
+    "/latest",
+    response_model=list[ClientLatestResponse],
+    status_code=status.HTTP_200_OK,
+)
+def get_fleet_latest(
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+    stale_after: int | None = Query(default=None, ge=1),
+    stale: bool | None = None,
+):
+    """Una fila por cliente activo; `stale` filtra por clientes sin reportar"""
+    if stale_after is None:
+        stale_after = get_config().fleet_stale.total_seconds()
+    now = datetime.now(UTC)
+    rows = db.execute(
+        select(OAuthClient.id, OAuthClient.name, ClientLatest)
+        .outerjoin(ClientLatest, ClientLatest.client_id == OAuthClient.id)
+        .where(OAuthClient.is_active == True)
+        .order_by(OAuthClient.id)
+    ).all()
 
-        cpu_percent = decrypted_data["cpu"]["cpu_percent"]
-        memory_percent = decrypted_data["memory"]["percent"]
-        disk_percent = decrypted_data["disk"]["percent"]
+    fleet = []
+    for client_id, name, latest in rows:
+        if latest is None:
+            # Nunca reportó: se considera stale
+            if stale is not False:
+                fleet.append(ClientLatestResponse(client_id=client_id, name=name, stale=True))
+            continue
 
-    except KeyError:
+        received_at = latest.received_at
+        if received_at.tzinfo is None:
+            # SQLite no guarda la zona horaria: se guardó en UTC
+            received_at = received_at.replace(tzinfo=UTC)
+        age_seconds = (now - received_at).total_seconds()
+        is_stale = age_seconds > stale_after
+        if stale is not None and is_stale != stale:
+            continue
+        fleet.append(
+            ClientLatestResponse(
+                client_id=client_id,
+                name=name,
+                metrics_id=latest.metrics_id,
+                hostname=latest.hostname,
+                server_timestamp=latest.server_timestamp,
+                cpu_percent=latest.cpu_percent,
+                memory_percent=latest.memory_percent,
+                disk_percent=latest.disk_percent,
+                received_at=received_at,
+                age_seconds=round(age_seconds, 3),
+                stale=is_stale,
+            )
+        )
+    return model_response(fleet, list[ClientLatestResponse])
+
+
+# ----------------------------------------------------------------------
+# Percentiles de un rango desde los sketches por bucket (solo admin)
+@router.get(
+    "/percentiles",
+    response_model=PercentileResponse,
+    status_code=status.HTTP_200_OK,
+)
+def get_percentiles(
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+    client_id: int | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    q: Annotated[list[float], Query()] = [50, 90, 95, 99],
+):
+    """Percentiles de cpu, memoria y disco; sin client_id, de toda la flota"""
+    if not q or any(not 0 <= value <= 100 for value in q):
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid metrics structure",
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail="q debe estar entre 0 y 100",
         )
 
-    # 💾 Guardar en DB
-    new_metrics = ServerMetrics(
-        client_id=current_client.id,
-        hostname=hostname,
-        server_timestamp=server_timestamp,
-        cpu_percent=cpu_percent,
-        memory_percent=memory_percent,
-        disk_percent=disk_percent,
-        raw_payload=decrypted_data,
+    histograms, covered_start, covered_end = merge_sketches(db, client_id, start, end)
+    labels = [f"p{value:g}" for value in q]
+    result = {
+        metric: dict(zip(labels, histogram.quantiles(q)))
+        for metric, histogram in histograms.items()
+    }
+    return model_response(
+        PercentileResponse(
+            client_id=client_id,
+            start=covered_start,
+            end=covered_end,
+            samples=histograms["cpu_percent"].count,
+            **result,
+        )
     )
 
-    db.add(new_metrics)
-    db.commit()
-    db.refresh(new_metrics)
 
-    return {
-        "message": "Metrics stored successfully",
-        "client": current_client.client_id,
+# ----------------------------------------------------------------------
+# Analítica de flota vectorizada (solo admin)
+FleetMetric = Literal["cpu_percent", "memory_percent", "disk_percent"]
+
+
+def _with_names(db: Session, rows: list[dict]) -> list[dict]:
+    """Agrega nombre del cliente y último hostname (una sola consulta)"""
+    names = {
+        client_id: (name, hostname)
+        for client_id, name, hostname in db.execute(
+            select(OAuthClient.id, OAuthClient.name, ClientLatest.hostname)
+            .outerjoin(ClientLatest, ClientLatest.client_id == OAuthClient.id)
+            .where(OAuthClient.id.in_([row["client_id"] for row in rows]))
+        )
     }
+    for row in rows:
+        row["name"], row["hostname"] = names.get(row["client_id"], (None, None))
+    return rows
+
+
+@router.get(
+    "/fleet/stats",
+    response_model=list[FleetStatsResponse],
+    status_code=status.HTTP_200_OK,
+)
+def get_fleet_stats(
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+    metric: FleetMetric = "cpu_percent",
+    hours: int = Query(default=24, ge=1, le=24 * 90),
+):
+    """Promedio, mínimo, máximo y último valor por cliente en las últimas `hours`"""
+    rows = fleet_stats(db, metric, timedelta(hours=hours))
+    return model_response(_with_names(db, rows), list[FleetStatsResponse])
+
+
+@router.get(
+    "/fleet/growth",
+    response_model=list[FleetGrowthResponse],
+    status_code=status.HTTP_200_OK,
+)
+def get_fleet_growth(
+    db: Annotated[Session, Depends(get_db)],
+    admin_user: Annotated[User, Depends(get_current_admin)],
+    metric: FleetMetric = "disk_percent",
+    hours: int = Query(default=24 * 7, ge=1, le=24 * 90),
+    limit: int = Query(default=10, ge=1, le=1000),
+):
+    """Clientes cuya métrica más creció (última - primera muestra) en las últimas `hours`"""
+    rows = fleet_growth(db, metric, timedelta(hours=hours), limit)
+    return model_response(_with_names(db, rows), list[FleetGrowthResponse])
+
+
+# ----------------------------------------------------------------------
+# Admin con una sesión propia: el stream no retiene una conexión a la DB
+def get_stream_admin(token: Annotated[str, Depends(oauth2_user_scheme)]) -> User:
+    with SessionLocal() as db:
+        return get_current_admin(get_current_user(token, db))
+
+
+# ----------------------------------------------------------------------
+# Muestras en vivo (SSE) de un cliente o de toda la flota (solo admin)
+@router.get(
+    "/live",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def stream_live_metrics(
+    admin_user: Annotated[User, Depends(get_stream_admin)],
+    client_id: int | None = None,
+    history: int = Query(default=LIVE_HISTORY_SIZE, ge=0, le=LIVE_HISTORY_SIZE),
+):
+    """Eventos `sample` (historial reciente y luego en vivo) y `dropped` si el consumidor se atrasa"""
+    subscriber, initial = await live_hub.subscribe(client_id, history)
+
+    async def events():
+        sent = {sample.id for sample in initial}
+        try:
+            if initial:
+                yield b"".join(sample.frame for sample in initial)
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.wakeup.wait(), LIVE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                samples, dropped = subscriber.drain()
+                chunk = [b"event: dropped\ndata: %d\n\n" % dropped] if dropped else []
+                chunk.extend(sample.frame for sample in samples if sample.id not in sent)
+                sent.clear()
+                if chunk:
+                    yield b"".join(chunk)
+        finally:
+            live_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
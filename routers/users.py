@@ -1,19 +1,21 @@
-from datetime import timedelta
 from typing import Annotated
 
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from anyio import to_thread
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from models.users import User, ApprovedUsers
 from utils.database import get_db
 from utils.auth import (
-    generate_verification_token,
+    confirmation_context,
     send_email_confirmation,
+    send_email_confirmations,
     confirm_verification_token,
 )
 from schemas.user import (
     ApprovedUsersResponse,
+    BulkImportResponse,
     TokenResponse,
     UserCreate,
     UserResponsePrivate,
@@ -25,28 +27,34 @@ from schemas.user import (
 from utils.auth import (
     CurrentUser,
     create_access_token,
+    get_cached_user,
     hash_password,
+    invalidate_user,
     verify_password,
 )
-from utils.config import settings
+from utils.audit import audit_log, client_ip
+from utils.conditional import bump_version, user_etag, user_response
+from utils.config import get_config
+from utils.fastjson import model_response
+from utils.loadshed import concurrency_group
+from utils.onboarding import BulkImport, RowReader, import_approved_chunk, import_users_chunk
+from utils.server_timing import TimedRoute
 
 # Instancia de las rutas
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 # ----------------------------------------------------------------------
 # Muestra mi usuario
 @router.get("/me", response_model=UserResponsePrivate)
-def get_current_user(current_user: CurrentUser):
-    """Obtiene el usuario actual autenticado."""
-    return current_user
+def get_current_user(request: Request, current_user: CurrentUser):
+    """Obtiene el usuario actual autenticado (304 si If-None-Match coincide)."""
+    return user_response(request, current_user)
 
 
 # ----------------------------------------------------------------------
 # Verifica si el usuario es admin
-def get_current_admin(
-    current_user: User = Depends(get_current_user),
-):
+def get_current_admin(current_user: CurrentUser):
     # Verificamos el campo role
     if current_user.role != "admin":
         raise HTTPException(
@@ -71,7 +79,7 @@ def get_users(
     users = result.scalars().all()
 
     if users:
-        return users
+        return model_response(users, list[UserResponsePrivate])
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="No hay usuarios que mostrar",
@@ -93,7 +101,7 @@ def get_approved_users(
     users = result.scalars().all()
 
     if users:
-        return users
+        return model_response(users, list[ApprovedUsersResponse])
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="No hay usuarios que mostrar",
@@ -140,8 +148,18 @@ def create_approved_user(
     db.add(new_approved)
     db.commit()
     db.refresh(new_approved)
+    audit_log.record(
+        "user_approve",
+        user_admin.username,
+        target=f"approved:{new_approved.id}",
+        detail={"email": new_approved.email},
+    )
 
-    return new_approved
+    return model_response(
+        new_approved,
+        ApprovedUsersResponse,
+        status_code=status.HTTP_201_CREATED,
+    )
 
 
 # ----------------------------------------------------------------------
@@ -204,20 +222,65 @@ def create_user(
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    audit_log.record(
+        "user_create",
+        user_admin.username,
+        target=f"user:{new_user.id}",
+        detail={"email": new_user.email},
+    )
 
     # --- Logica de confirmación de Email ---
-    # 1. Generar token
-    token = generate_verification_token(new_user.email)
-    # 2. Crear link (ajustar dominio en .env)
-    DOMINIO = settings.DOMINIO.get_secret_value()
-    verify_url = (
-        f"http://{DOMINIO}/api/v1/users/verify/{token}"
-    )
-    context = {"user": user.username, "email": user.email, "url": verify_url}
-    # 3. Enviar email en segundo plano sin bloquear el return
+    # Token + link (ajustar dominio en .env); se envía en segundo plano
+    context = confirmation_context(user.username, new_user.email)
     background_tasks.add_task(send_email_confirmation, context)
 
-    return new_user
+    return model_response(
+        new_user,
+        UserResponsePrivate,
+        status_code=status.HTTP_201_CREATED,
+    )
+
+
+# ----------------------------------------------------------------------
+# Altas masivas: upload CSV (con encabezado) o NDJSON, procesado por bloques
+@router.post(
+    "/bulk/approved",
+    response_model=BulkImportResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def bulk_create_approved_users(
+    request: Request,
+    db: Annotated[Session, Depends(get_db)],
+    user_admin: Annotated[User, Depends(get_current_admin)],
+):
+    """Columna/campo: email"""
+    reader = RowReader(request)
+    state = BulkImport(user_admin.username)
+    async for rows in reader.chunks():
+        await to_thread.run_sync(import_approved_chunk, db, rows, state)
+    return model_response(state.report(reader.truncated), BulkImportResponse)
+
+
+@router.post(
+    "/bulk/create",
+    response_model=BulkImportResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def bulk_create_users(
+    request: Request,
+    db: Annotated[Session, Depends(get_db)],
+    user_admin: Annotated[User, Depends(get_current_admin)],
+    background_tasks: BackgroundTasks,
+):
+    """Columnas/campos: username, email, password (solo emails aprobados)"""
+    reader = RowReader(request)
+    state = BulkImport(user_admin.username)
+    async for rows in reader.chunks():
+        contexts = await to_thread.run_sync(import_users_chunk, db, rows, state)
+        # Un lote de correos (una conexión SMTP) por bloque
+        if contexts:
+            background_tasks.add_task(send_email_confirmations, contexts)
+    return model_response(state.report(reader.truncated), BulkImportResponse)
 
 
 # ----------------------------------------------------------------------
@@ -227,7 +290,9 @@ def create_user(
     response_model=TokenResponse,
     status_code=status.HTTP_200_OK,
 )
+@concurrency_group("auth")
 def login_for_access_token(
+    request: Request,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     db: Annotated[Session, Depends(get_db)],
 ):  
@@ -241,6 +306,12 @@ def login_for_access_token(
 
     # Verifica si el user exists y el password es correcto
     if not user or not verify_password(form_data.password, user.password_hash):
+        audit_log.record(
+            "login_failed",
+            form_data.username,
+            ip=client_ip(request),
+            detail={"reason": "credentials"},
+        )
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuario o Password incorrecto",
@@ -249,6 +320,12 @@ def login_for_access_token(
 
     # Verifiac si el usuario está activo
     if not user.is_active:
+        audit_log.record(
+            "login_failed",
+            user.username,
+            ip=client_ip(request),
+            detail={"reason": "inactive"},
+        )
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Error: Usuario inactivo, por favor confirme su correo.",
@@ -256,9 +333,7 @@ def login_for_access_token(
         )
 
     # Crea access token con email, username, id
-    access_token_expires = timedelta(
-        minutes=int(settings.ACCESS_TOKEN_EXPIRE_MINUTES.get_secret_value())
-    )
+    access_token_expires = get_config().access_token_expire
 
     # Crear JWT
     access_token = create_access_token(
@@ -270,12 +345,14 @@ def login_for_access_token(
         },
         expires_delta=access_token_expires,
     )
+    audit_log.record("login", user.username, target=f"user:{user.id}", ip=client_ip(request))
     # For Debug
     # print(access_token)
-    return TokenResponse(        
-        access_token=access_token,
-        token_type="bearer",
-        expires_in=access_token_expires,
+    return model_response(
+        TokenResponse(
+            access_token=access_token,
+            token_type="bearer",
+        )
     )
 
 
@@ -304,8 +381,11 @@ def verify_user_email(token: str, db: Annotated[Session, Depends(get_db)]):
     if not user.is_active:
         # Activar usuario
         user.is_active = True
+        bump_version(user)
         db.commit()
         db.refresh(user)
+        invalidate_user(user.username, user.id)
+        audit_log.record("user_verify", user.username, target=f"user:{user.id}")
 
     return {"message": "Cuenta verificada exitosamente."}
 
@@ -318,15 +398,16 @@ def verify_user_email(token: str, db: Annotated[Session, Depends(get_db)]):
     status_code=status.HTTP_200_OK,
 )
 def get_user(
+        request: Request,
         user_id: int, 
         user_admin: Annotated[User, Depends(get_current_admin)],
         db: Annotated[Session, Depends(get_db)],
     ):
-    result = db.execute(select(User).where(User.id == user_id))
-    exists_user = result.scalars().first()
+    # Desde el cache de filas; 304 si If-None-Match coincide
+    exists_user = get_cached_user(db, user_id)
 
     if exists_user:
-        return exists_user
+        return user_response(request, exists_user)
 
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND, detail="Este usuario no existe"
@@ -383,14 +464,23 @@ def update_user_partial(
             )
 
     # Establecemos cada campo editado dinamicamente, dejamos los otros iguales
+    previous_username = user.username
     update_data = user_data.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(user, field, value)
+    bump_version(user)
 
     db.commit()
     db.refresh(user)
+    invalidate_user(previous_username, user.id)
+    audit_log.record(
+        "user_update",
+        current_user.username,
+        target=f"user:{user.id}",
+        detail={"fields": sorted(update_data)},
+    )
 
-    return user
+    return model_response(user, UserResponsePrivate, headers={"ETag": user_etag(user)})
 
 
 # ----------------------------------------------------------------------
@@ -412,3 +502,11 @@ def delete_user(
 
     db.delete(user)
     db.commit()
+    # Sin la fila cacheada por id, GET /users/{id} responde 404 (nunca 304)
+    invalidate_user(user.username, user_id)
+    audit_log.record(
+        "user_delete",
+        current_admin.username,
+        target=f"user:{user_id}",
+        detail={"username": user.username},
+    )
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Response
+
+from utils.jwt_keys import jwt_keys
+from utils.server_timing import TimedRoute
+
+router = APIRouter(route_class=TimedRoute)
+
+# ----------------------------------------------------------------------
+# JWKS público: llaves de verificación de los JWT (EdDSA/ES256) por kid
+@router.get("/jwks.json", name="jwks")
+def get_jwks():
+    """Llaves públicas de firma (vacío con HS256); el documento ya está serializado"""
+    return Response(
+        content=jwt_keys().jwks,
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=300"},
+    )
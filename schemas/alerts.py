@@ -0,0 +1,63 @@
+"""Schemas de las reglas de alertas, su estado y el outbox"""
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from datetime import datetime
+from typing import Literal
+
+
+class AlertRuleCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+    metric: Literal["cpu_percent", "memory_percent", "disk_percent"]
+    kind: Literal["threshold", "rate", "anomaly"]
+    # Se compara el valor (threshold), la variación (rate) o el z-score (anomaly)
+    operator: Literal[">", "<"] = ">"
+    threshold: float
+    window_seconds: int = Field(default=0, ge=0, le=7 * 24 * 3600)
+    alpha: float = Field(default=0.1, gt=0, le=1)
+    min_samples: int = Field(default=10, ge=1)
+    # None = todos los clientes
+    client_id: int | None = None
+
+    @model_validator(mode="after")
+    def check_window(self):
+        if self.kind == "rate" and self.window_seconds <= 0:
+            raise ValueError("window_seconds es obligatorio para reglas rate")
+        return self
+
+
+class AlertRuleResponse(AlertRuleCreate):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    is_active: bool
+    created_at: datetime
+
+
+class AlertStateResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    rule_id: int
+    rule_name: str
+    client_id: int
+    client_name: str
+    metric: str
+    status: str
+    since: datetime | None
+    value: float | None
+    last_timestamp: datetime
+
+
+class AlertNotificationResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    rule_id: int
+    rule_name: str
+    client_id: int
+    metric: str
+    status: str
+    value: float
+    observed_at: datetime
+    created_at: datetime
+    delivered_at: datetime | None
+    attempts: int
+    last_error: str | None
@@ -0,0 +1,15 @@
+"""Schemas del registro de auditoría"""
+from pydantic import BaseModel, ConfigDict
+from datetime import datetime
+
+
+class AuditEventResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    created_at: datetime
+    actor: str
+    action: str
+    target: str | None
+    ip: str | None
+    detail: dict | None
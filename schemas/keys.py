@@ -0,0 +1,35 @@
+"""Schemas de la administración de llaves AES (rotación y provisión)"""
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import datetime
+
+
+class KeyRotateRequest(BaseModel):
+    # Segundos que la llave anterior sigue descifrando (None = AES_KEY_ROTATION_GRACE_SECONDS)
+    grace_seconds: int | None = Field(default=None, ge=0, le=90 * 24 * 3600)
+
+
+class KeyProvisionRequest(KeyRotateRequest):
+    client_ids: list[int] = Field(min_length=1, max_length=1000)
+
+
+class AESKeyResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    key_id: str
+    client_id: int | None
+    is_active: bool
+    created_at: datetime
+    retired_at: datetime | None
+    decrypt_until: datetime | None
+
+
+class IssuedKeyResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    key_id: str
+    client_id: int | None
+    # Material de la llave (base64): solo se entrega en esta respuesta
+    key: str
+    created_at: datetime
+    retired: list[str]
+    decrypt_until: datetime | None
@@ -0,0 +1,126 @@
+"""Schemas de las métricas enviadas por los agentes"""
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+from datetime import datetime
+from typing import Literal
+
+
+# ----------------------------------------------------------------------
+# Documento descifrado del agente. Se valida en una sola pasada desde los
+# bytes del plaintext (model_validate_json); las secciones y campos extra se
+# aceptan. raw_payload guarda el plaintext tal como llegó (source_json()), no
+# el modelo re-serializado (que normaliza timestamps, enteros y formato).
+class AgentSystem(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    hostname: str = Field(min_length=1, max_length=150)
+    # Parseo ISO 8601 nativo de pydantic
+    timestamp: datetime
+
+
+class AgentCPU(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    cpu_percent: float
+
+
+class AgentMemory(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    percent: float
+
+
+class AgentDisk(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    percent: float
+
+
+class AgentDocument(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    # Los agentes actuales no lo envían: se asume la versión 1. Una versión
+    # nueva será otro modelo en una unión discriminada por este campo.
+    schema_version: Literal[1] = 1
+    system: AgentSystem
+    cpu: AgentCPU
+    memory: AgentMemory
+    disk: AgentDisk
+
+    # Plaintext JSON validado (lo asigna decode_document)
+    _source_json: bytes | None = PrivateAttr(default=None)
+
+    def source_json(self) -> bytes | None:
+        """Bytes JSON enviados por el agente (None si llegó en MessagePack)"""
+        return self._source_json
+
+
+# Respuesta de una muestra con su documento completo
+class MetricSampleResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    client_id: int
+    hostname: str
+    server_timestamp: datetime
+    cpu_percent: float
+    memory_percent: float
+    disk_percent: float
+    raw_payload: dict | None
+    created_at: datetime
+
+
+# Estado actual de un cliente de la flota (tabla client_latest)
+class ClientLatestResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    client_id: int
+    name: str
+    # Vacíos si el cliente nunca reportó
+    metrics_id: int | None = None
+    hostname: str | None = None
+    server_timestamp: datetime | None = None
+    cpu_percent: float | None = None
+    memory_percent: float | None = None
+    disk_percent: float | None = None
+    received_at: datetime | None = None
+    age_seconds: float | None = None
+    # Sin muestras recibidas en los últimos `stale_after` segundos
+    stale: bool
+
+
+# ----------------------------------------------------------------------
+# Percentiles de un rango ({"p95": valor}); start/end es el rango cubierto
+# por los buckets (alineado a SKETCH_BUCKET_SECONDS)
+class PercentileResponse(BaseModel):
+    client_id: int | None
+    start: datetime | None
+    end: datetime | None
+    samples: int
+    cpu_percent: dict[str, float | None]
+    memory_percent: dict[str, float | None]
+    disk_percent: dict[str, float | None]
+
+
+# ----------------------------------------------------------------------
+# Analítica de flota: estadísticas por cliente y crecimiento en la ventana
+class FleetStatsResponse(BaseModel):
+    client_id: int
+    name: str | None
+    hostname: str | None
+    samples: int
+    mean: float
+    min: float
+    max: float
+    last: float
+    last_at: datetime
+
+
+class FleetGrowthResponse(BaseModel):
+    client_id: int
+    name: str | None
+    hostname: str | None
+    growth: float
+    first: float
+    first_at: datetime
+    last: float
+    last_at: datetime
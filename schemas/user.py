@@ -44,4 +44,22 @@ class ApprovedUsers(BaseModel):
     email: EmailStr = Field(max_length=120)
     
 class ApprovedUsersResponse(BaseModel):
-    email: EmailStr 
\ No newline at end of file
+    email: EmailStr
+
+
+# Altas masivas (CSV / NDJSON): fila de aprobados y resultado por fila
+class BulkApprovedRow(BaseModel):
+    email: EmailStr = Field(max_length=120)
+
+class BulkRowResult(BaseModel):
+    line: int
+    status: str
+    email: str | None = None
+    id: int | None = None
+    detail: str | None = None
+
+class BulkImportResponse(BaseModel):
+    total: int
+    summary: dict[str, int]
+    truncated: bool
+    results: list[BulkRowResult]
@@ -0,0 +1,304 @@
+""" Alertas evaluadas en la ingesta, de forma incremental
+
+- Cada regla se evalúa sobre cada muestra nueva con un estado pequeño por
+  (regla, cliente) guardado en alert_states; nunca se re-consulta metrics.
+    * threshold: el valor cumple la condición durante window_seconds
+      (0 = de inmediato). Estado: inicio de la racha actual.
+    * rate: variación del valor respecto de la muestra más antigua dentro
+      de window_seconds (ej: disco sube más de 5 puntos en 3600 s). Estado:
+      a lo sumo RATE_WINDOW_POINTS puntos de la ventana.
+    * anomaly: z-score del valor contra la media y varianza EWMA (alpha),
+      después de min_samples muestras. Estado: n, media y varianza.
+- El estado se lee y escribe en la misma transacción que la muestra (después
+  del flush, con el lock de escritura de SQLite ya tomado): si la muestra se
+  rechaza, la ventana no avanza. Las muestras atrasadas se ignoran.
+- Cada cambio de estado (ok -> firing -> ok) agrega una fila al outbox
+  alert_notifications en esa misma transacción; el dispatcher del scheduler
+  las entrega por webhook (ALERT_WEBHOOK_URL) en lotes y con reintentos.
+"""
+from __future__ import annotations
+
+import math
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+
+import httpx
+import msgpack
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from models.alerts import AlertNotification, AlertRule, AlertState
+from models.metrics import ServerMetrics
+from .cache import cache
+from .config import get_config
+from .database import SessionLocal
+from .fastjson import dumps
+from .stats import stage_timer
+
+ALERT_DISPATCH_INTERVAL = get_config().alert_dispatch_interval
+
+RULES_CACHE_KEY = "alert_rules"
+# Puntos máximos guardados por ventana de una regla rate
+RATE_WINDOW_POINTS = 64
+# Notificaciones por POST al webhook y reintentos antes de abandonarlas
+ALERT_DISPATCH_BATCH = 100
+ALERT_MAX_ATTEMPTS = 10
+# Reserva de un lote por un worker (evita entregas dobles entre workers)
+ALERT_CLAIM_SECONDS = 60
+ALERT_WEBHOOK_TIMEOUT = 5.0
+
+RULE_FIELDS = (
+    AlertRule.id,
+    AlertRule.name,
+    AlertRule.metric,
+    AlertRule.kind,
+    AlertRule.operator,
+    AlertRule.threshold,
+    AlertRule.window_seconds,
+    AlertRule.alpha,
+    AlertRule.min_samples,
+    AlertRule.client_id,
+)
+
+
+# ----------------------------------------------------------------------
+# Regla activa (copia inmutable, cacheada entre requests)
+@dataclass(frozen=True, slots=True)
+class Rule:
+    id: int
+    name: str
+    metric: str
+    kind: str
+    operator: str
+    threshold: float
+    window_seconds: int
+    alpha: float
+    min_samples: int
+    client_id: int | None
+
+    def matches(self, value: float) -> bool:
+        if self.operator == "<":
+            return value < self.threshold
+        return value > self.threshold
+
+
+def _load_rules(db: Session) -> list[dict]:
+    rows = db.execute(
+        select(*RULE_FIELDS).where(AlertRule.is_active == True).order_by(AlertRule.id)
+    ).mappings()
+    return [dict(row) for row in rows]
+
+
+def active_rules(db: Session) -> list[Rule]:
+    return [Rule(**row) for row in cache.get_or_set(RULES_CACHE_KEY, lambda: _load_rules(db))]
+
+
+def invalidate_rules():
+    cache.invalidate(RULES_CACHE_KEY)
+
+
+# ----------------------------------------------------------------------
+# Un paso de cada tipo de regla: actualiza la ventana con la muestra y
+# retorna (valor evaluado, condición cumplida) o None si aún no se evalúa
+def _step_threshold(rule: Rule, window: dict, ts: float, value: float):
+    if not rule.matches(value):
+        window.pop("since", None)
+        return value, False
+    since = window.setdefault("since", ts)
+    return value, ts - since >= rule.window_seconds
+
+
+def _step_rate(rule: Rule, window: dict, ts: float, value: float):
+    points = window.setdefault("points", [])
+    start = ts - rule.window_seconds
+    while points and points[0][0] < start:
+        points.pop(0)
+
+    result = None
+    if points:
+        delta = value - points[0][1]
+        result = delta, rule.matches(delta)
+
+    # Un punto cada window_seconds / RATE_WINDOW_POINTS como máximo
+    if not points or ts - points[-1][0] >= rule.window_seconds / RATE_WINDOW_POINTS:
+        points.append([ts, value])
+    return result
+
+
+def _step_anomaly(rule: Rule, window: dict, ts: float, value: float):
+    n = window.get("n", 0)
+    mean = window.get("mean", value)
+    var = window.get("var", 0.0)
+
+    result = None
+    if n >= rule.min_samples and var > 0:
+        z = (value - mean) / math.sqrt(var)
+        result = z, rule.matches(z)
+
+    # Media y varianza EWMA incrementales (el valor actual entra después)
+    diff = value - mean
+    increment = rule.alpha * diff
+    window.update(n=n + 1, mean=mean + increment, var=(1 - rule.alpha) * (var + diff * increment))
+    return result
+
+
+STEPS = {
+    "threshold": _step_threshold,
+    "rate": _step_rate,
+    "anomaly": _step_anomaly,
+}
+
+
+def _epoch(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return value.timestamp()
+
+
+# ----------------------------------------------------------------------
+# Evalúa las reglas del cliente sobre muestras recién insertadas (después
+# del flush y antes del commit de la transacción de ingesta)
+def evaluate_alerts(db: Session, client_id: int, samples: Iterable[ServerMetrics]):
+    rules = [rule for rule in active_rules(db) if rule.client_id in (None, client_id)]
+    if not rules:
+        return
+
+    with stage_timer("alert_eval"):
+        states = {
+            state.rule_id: state
+            for state in db.scalars(
+                select(AlertState).where(
+                    AlertState.client_id == client_id,
+                    AlertState.rule_id.in_([rule.id for rule in rules]),
+                )
+            )
+        }
+        ordered = sorted(samples, key=lambda sample: _epoch(sample.server_timestamp))
+
+        for rule in rules:
+            state = states.get(rule.id)
+            window = msgpack.unpackb(state.window) if state is not None else {}
+            status = state.status if state is not None else "ok"
+            evaluated = False
+
+            for sample in ordered:
+                ts = _epoch(sample.server_timestamp)
+                if ts <= window.get("t", -math.inf):
+                    continue
+                window["t"] = ts
+                evaluated = True
+
+                result = STEPS[rule.kind](rule, window, ts, getattr(sample, rule.metric))
+                if result is None:
+                    continue
+                value, firing = result
+
+                if state is None:
+                    state = AlertState(rule_id=rule.id, client_id=client_id, status="ok")
+                    db.add(state)
+                state.value = value
+                state.last_timestamp = sample.server_timestamp
+
+                if firing != (status == "firing"):
+                    status = "firing" if firing else "ok"
+                    state.since = sample.server_timestamp
+                    db.add(
+                        AlertNotification(
+                            rule_id=rule.id,
+                            client_id=client_id,
+                            status="firing" if firing else "resolved",
+                            rule_name=rule.name,
+                            metric=rule.metric,
+                            value=value,
+                            observed_at=sample.server_timestamp,
+                        )
+                    )
+
+            if not evaluated:
+                continue
+            if state is None:
+                # Ventana en formación (ej: rate sin punto de referencia)
+                state = AlertState(rule_id=rule.id, client_id=client_id, status="ok")
+                db.add(state)
+            state.status = status
+            state.last_timestamp = ordered[-1].server_timestamp
+            state.window = msgpack.packb(window)
+
+
+# ----------------------------------------------------------------------
+# Dispatcher del outbox (job del scheduler, en cada worker): reserva un
+# lote pendiente, lo envía en un solo POST y lo marca como entregado
+def dispatch_notifications():
+    # Se lee en cada ejecución: configurar el webhook no requiere reiniciar
+    webhook_url = get_config().alert_webhook_url
+    if not webhook_url:
+        return
+    now = datetime.now(UTC)
+
+    with SessionLocal() as db:
+        pending = (
+            select(AlertNotification.id)
+            .where(
+                AlertNotification.delivered_at.is_(None),
+                AlertNotification.attempts < ALERT_MAX_ATTEMPTS,
+                or_(
+                    AlertNotification.claimed_until.is_(None),
+                    AlertNotification.claimed_until < now,
+                ),
+            )
+            .order_by(AlertNotification.id)
+            .limit(ALERT_DISPATCH_BATCH)
+        )
+        claimed = db.scalars(
+            update(AlertNotification)
+            .where(AlertNotification.id.in_(pending))
+            .values(claimed_until=now + timedelta(seconds=ALERT_CLAIM_SECONDS))
+            .returning(AlertNotification.id)
+        ).all()
+        db.commit()
+        if not claimed:
+            return
+
+        notifications = db.scalars(
+            select(AlertNotification)
+            .where(AlertNotification.id.in_(claimed))
+            .order_by(AlertNotification.id)
+        ).all()
+        body = dumps({
+            "alerts": [
+                {
+                    "id": notification.id,
+                    "rule_id": notification.rule_id,
+                    "rule_name": notification.rule_name,
+                    "client_id": notification.client_id,
+                    "metric": notification.metric,
+                    "status": notification.status,
+                    "value": notification.value,
+                    "observed_at": notification.observed_at,
+                }
+                for notification in notifications
+            ]
+        })
+
+        error = None
+        try:
+            response = httpx.post(
+                webhook_url,
+                content=body,
+                headers={"Content-Type": "application/json"},
+                timeout=ALERT_WEBHOOK_TIMEOUT,
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as exc:
+            error = str(exc)[:500] or type(exc).__name__
+
+        delivered_at = datetime.now(UTC)
+        for notification in notifications:
+            notification.attempts += 1
+            notification.claimed_until = None
+            if error is None:
+                notification.delivered_at = delivered_at
+            else:
+                notification.last_error = error
+        db.commit()
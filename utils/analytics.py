@@ -0,0 +1,233 @@
+""" Analítica de flota vectorizada (NumPy) con cache por bucket de tiempo
+
+- Las columnas necesarias (client_id, timestamp, métrica) se leen de metrics
+  en bloque y se convierten directo a arrays; nunca se crean objetos ORM.
+  El timestamp se lee como texto y NumPy lo pasa a microsegundos enteros
+  (julianday() de SQLite redondea a milisegundos).
+- Por cada (métrica, bucket de SKETCH_BUCKET_SECONDS) se calcula un parcial
+  por cliente con reducciones agrupadas: conteo, suma, mínimo, máximo y
+  primera/última muestra. Los parciales se combinan entre sí, así que
+  "promedio y máximo en 24 h" y "crecimiento en la semana" salen de los
+  mismos buckets.
+- Los parciales de buckets completos se cachean por worker. Su huella es el
+  conteo por bucket de metric_sketches (se actualiza en la misma transacción
+  que la muestra): solo se recalculan los buckets que recibieron datos.
+- El bucket parcial del inicio del rango se calcula sin cache, para que el
+  rango sea exacto.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import String, func, select, type_coerce
+from sqlalchemy.orm import Session
+
+from models.metrics import MetricSketch, ServerMetrics
+from .cache import MemoryCache
+from .partitions import read_partitions, routed
+from .sketches import SKETCH_BUCKET_SECONDS, SKETCH_METRICS, bucket_start
+from .stats import stage_timer
+
+# Parciales cacheados por worker (métrica x bucket); los históricos no cambian
+ANALYTICS_CACHE_ENTRIES = 4096
+ANALYTICS_CACHE_TTL = 7 * 24 * 3600
+
+_partials = MemoryCache(maxsize=ANALYTICS_CACHE_ENTRIES, ttl=ANALYTICS_CACHE_TTL)
+
+# Texto guardado por SQLite ("YYYY-MM-DD HH:MM:SS.ffffff"): sin datetimes de Python
+_TIMESTAMP_TEXT = type_coerce(ServerMetrics.server_timestamp, String)
+_UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+
+# ----------------------------------------------------------------------
+# Parcial por cliente (arrays alineados, ordenados por client_id).
+# first_ts / last_ts: microsegundos desde epoch (int64)
+@dataclass(frozen=True, slots=True)
+class Partial:
+    client_id: np.ndarray
+    count: np.ndarray
+    total: np.ndarray
+    minimum: np.ndarray
+    maximum: np.ndarray
+    first_ts: np.ndarray
+    first: np.ndarray
+    last_ts: np.ndarray
+    last: np.ndarray
+
+    @classmethod
+    def empty(cls) -> Partial:
+        return cls(*(np.empty(0) for _ in range(9)))
+
+    @classmethod
+    def from_samples(cls, client_id: np.ndarray, ts: np.ndarray, value: np.ndarray) -> Partial:
+        if not len(client_id):
+            return cls.empty()
+        order = np.lexsort((ts, client_id))
+        client_id, ts, value = client_id[order], ts[order], value[order]
+        ids, starts = np.unique(client_id, return_index=True)
+        ends = np.append(starts[1:], len(client_id)) - 1
+        return cls(
+            client_id=ids,
+            count=np.diff(np.append(starts, len(client_id))).astype(np.float64),
+            total=np.add.reduceat(value, starts),
+            minimum=np.minimum.reduceat(value, starts),
+            maximum=np.maximum.reduceat(value, starts),
+            first_ts=ts[starts],
+            first=value[starts],
+            last_ts=ts[ends],
+            last=value[ends],
+        )
+
+    @classmethod
+    def merge(cls, partials: list[Partial]) -> Partial:
+        partials = [partial for partial in partials if len(partial.client_id)]
+        if not partials:
+            return cls.empty()
+        if len(partials) == 1:
+            return partials[0]
+
+        def cat(name):
+            return np.concatenate([getattr(partial, name) for partial in partials])
+
+        ids, group = np.unique(cat("client_id"), return_inverse=True)
+        size = len(ids)
+        minimum = np.full(size, np.inf)
+        maximum = np.full(size, -np.inf)
+        np.minimum.at(minimum, group, cat("minimum"))
+        np.maximum.at(maximum, group, cat("maximum"))
+
+        # Primera muestra: la de menor first_ts del grupo; última: mayor last_ts
+        first_ts, last_ts = cat("first_ts"), cat("last_ts")
+        first_order = np.lexsort((first_ts, group))
+        last_order = np.lexsort((last_ts, group))
+        starts = np.searchsorted(group[first_order], np.arange(size))
+        ends = np.searchsorted(group[last_order], np.arange(size), side="right") - 1
+        first_index, last_index = first_order[starts], last_order[ends]
+
+        return cls(
+            client_id=ids,
+            count=np.bincount(group, weights=cat("count"), minlength=size),
+            total=np.bincount(group, weights=cat("total"), minlength=size),
+            minimum=minimum,
+            maximum=maximum,
+            first_ts=first_ts[first_index],
+            first=cat("first")[first_index],
+            last_ts=last_ts[last_index],
+            last=cat("last")[last_index],
+        )
+
+
+# ----------------------------------------------------------------------
+# Lectura en bloque de [start, end) como arrays
+def _fetch(db: Session, metric: str, start: datetime, end: datetime) -> Partial:
+    query = select(
+        ServerMetrics.client_id, _TIMESTAMP_TEXT, getattr(ServerMetrics, metric)
+    ).where(
+        ServerMetrics.server_timestamp >= start,
+        ServerMetrics.server_timestamp < end,
+    )
+    with stage_timer("analytics_fetch"):
+        rows = []
+        for partition in read_partitions(db, start, end):
+            rows += db.execute(query, execution_options=routed(db, partition)).tuples().all()
+        count = len(rows)
+        client_id = np.fromiter((row[0] for row in rows), dtype=np.int64, count=count)
+        ts = np.array([row[1] for row in rows], dtype="datetime64[us]").astype(np.int64)
+        value = np.fromiter((row[2] for row in rows), dtype=np.float64, count=count)
+    with stage_timer("analytics_reduce"):
+        return Partial.from_samples(client_id, ts, value)
+
+
+def _fingerprints(db: Session, first_bucket: datetime) -> dict[float, tuple[int, int]]:
+    """Huella por bucket desde metric_sketches: (muestras, clientes)"""
+    rows = db.execute(
+        select(
+            MetricSketch.bucket_start,
+            func.sum(MetricSketch.count),
+            func.count(),
+        )
+        .where(MetricSketch.bucket_start >= first_bucket)
+        .group_by(MetricSketch.bucket_start)
+    ).all()
+    return {
+        bucket.replace(tzinfo=UTC).timestamp(): (int(samples), int(clients))
+        for bucket, samples, clients in rows
+    }
+
+
+# ----------------------------------------------------------------------
+# Parcial combinado de la flota para [now - window, now)
+def fleet_partial(db: Session, metric: str, window: timedelta) -> Partial:
+    if metric not in SKETCH_METRICS:
+        raise ValueError(f"Métrica desconocida: {metric}")
+
+    now = datetime.now(UTC)
+    start = now - window
+    width = timedelta(seconds=SKETCH_BUCKET_SECONDS)
+    first_full = bucket_start(start)
+    if first_full < start:
+        first_full += width
+
+    # Bucket parcial del inicio: exacto y sin cache
+    partials = [_fetch(db, metric, start, first_full)] if first_full > start else []
+
+    fingerprints = _fingerprints(db, first_full)
+    bucket = first_full
+    while bucket < now:
+        fingerprint = fingerprints.get(bucket.timestamp())
+        if fingerprint is not None:
+            key = f"{metric}:{bucket.timestamp():.0f}"
+            cached = _partials.get(key)
+            if cached is not None and cached[0] == fingerprint:
+                partials.append(cached[1])
+            else:
+                partial = _fetch(db, metric, bucket, bucket + width)
+                _partials.set(key, (fingerprint, partial))
+                partials.append(partial)
+        bucket += width
+
+    with stage_timer("analytics_reduce"):
+        return Partial.merge(partials)
+
+
+def _datetime(micros: int) -> datetime:
+    return _UNIX_EPOCH + timedelta(microseconds=int(micros))
+
+
+# ----------------------------------------------------------------------
+# Consultas: estadísticas por cliente y mayor crecimiento
+def fleet_stats(db: Session, metric: str, window: timedelta) -> list[dict]:
+    partial = fleet_partial(db, metric, window)
+    mean = partial.total / np.maximum(partial.count, 1)
+    return [
+        {
+            "client_id": int(partial.client_id[i]),
+            "samples": int(partial.count[i]),
+            "mean": round(float(mean[i]), 3),
+            "min": float(partial.minimum[i]),
+            "max": float(partial.maximum[i]),
+            "last": float(partial.last[i]),
+            "last_at": _datetime(partial.last_ts[i]),
+        }
+        for i in range(len(partial.client_id))
+    ]
+
+
+def fleet_growth(db: Session, metric: str, window: timedelta, limit: int) -> list[dict]:
+    partial = fleet_partial(db, metric, window)
+    growth = partial.last - partial.first
+    # Mayor crecimiento primero (orden estable por client_id)
+    top = np.argsort(-growth, kind="stable")[:limit]
+    return [
+        {
+            "client_id": int(partial.client_id[i]),
+            "growth": round(float(growth[i]), 3),
+            "first": float(partial.first[i]),
+            "first_at": _datetime(partial.first_ts[i]),
+            "last": float(partial.last[i]),
+            "last_at": _datetime(partial.last_ts[i]),
+        }
+        for i in top
+    ]
@@ -0,0 +1,178 @@
+""" Registro de auditoría por lotes (tabla audit_events, solo inserción)
+
+- record() solo agrega el evento a un buffer en memoria: el handler no abre
+  transacciones ni suma commits por auditar.
+- Un hilo por worker escribe el buffer en lotes (un INSERT por lote) cada
+  AUDIT_FLUSH_MS, o antes si se juntan AUDIT_BATCH_SIZE eventos.
+- Buffer acotado (AUDIT_BUFFER_SIZE): si la DB no da abasto se descartan los
+  eventos nuevos y se cuentan (gauge audit_log); nunca bloquea un request.
+- Un lote que falla (ej: DB bloqueada) vuelve al buffer y se reintenta.
+- close() en el shutdown (y con atexit) detiene el hilo y escribe lo pendiente.
+"""
+from __future__ import annotations
+
+import atexit
+import sys
+import threading
+from collections import deque
+from datetime import UTC, datetime
+
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from starlette.requests import HTTPConnection
+
+from models.audit import AuditEvent
+from .config import get_config
+from .database import engine
+from .stats import register_gauge, stage_timer
+
+AUDIT_BATCH_SIZE = 500
+
+
+def client_ip(connection: HTTPConnection) -> str | None:
+    return connection.client.host if connection.client is not None else None
+
+
+# ----------------------------------------------------------------------
+# Buffer acotado + hilo de escritura por lotes
+class AuditLog:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer: deque[dict] = deque()
+        self._lock = threading.Lock()
+        # Un solo flush a la vez (hilo, consulta y shutdown)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+    def record(
+        self,
+        action: str,
+        actor: str,
+        target: str | None = None,
+        ip: str | None = None,
+        detail: dict | None = None,
+    ):
+        """Encola un evento (no toca la DB)"""
+        event = {
+            "created_at": datetime.now(UTC),
+            "actor": actor[:120],
+            "action": action,
+            "target": target,
+            "ip": ip,
+            "detail": detail,
+        }
+        with self._lock:
+            if len(self._buffer) >= self.capacity:
+                self.dropped += 1
+                return
+            self._buffer.append(event)
+            pending = len(self._buffer)
+        if pending >= AUDIT_BATCH_SIZE:
+            self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(get_config().audit_flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Escribe todo lo pendiente; retorna la cantidad de eventos escritos"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    count = min(AUDIT_BATCH_SIZE, len(self._buffer))
+                    batch = [self._buffer.popleft() for _ in range(count)]
+                if not batch:
+                    return written
+                try:
+                    with stage_timer("audit_flush"), engine.begin() as connection:
+                        connection.execute(insert(AuditEvent), batch)
+                except SQLAlchemyError as exc:
+                    # Vuelve al inicio del buffer, en orden; se reintenta en el próximo ciclo
+                    with self._lock:
+                        self._buffer.extendleft(reversed(batch))
+                    self.failed_batches += 1
+                    print(f"Error escribiendo {len(batch)} eventos de auditoría: {exc}", file=sys.stderr)
+                    return written
+                written += len(batch)
+                self.written += len(batch)
+
+    def close(self):
+        """Detiene el hilo y escribe lo pendiente (idempotente)"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+
+audit_log = AuditLog(get_config().audit_buffer_size)
+# Respaldo si el proceso termina sin el evento de shutdown (ej: scripts)
+atexit.register(audit_log.close)
+
+register_gauge(
+    "audit_log",
+    "Eventos de auditoría pendientes, escritos, descartados y lotes fallidos",
+    lambda: {
+        "pending": audit_log.pending,
+        "written": audit_log.written,
+        "dropped": audit_log.dropped,
+        "failed_batches": audit_log.failed_batches,
+    },
+)
+
+
+# ----------------------------------------------------------------------
+# Consulta por actor, acción y rango [start, end); más recientes primero
+def query_events(
+    db: Session,
+    actor: str | None = None,
+    action: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    before_id: int | None = None,
+    limit: int = 100,
+) -> list[AuditEvent]:
+    # Incluye lo que este worker todavía tiene en memoria
+    audit_log.flush()
+    query = select(AuditEvent)
+    if actor is not None:
+        query = query.where(AuditEvent.actor == actor)
+    if action is not None:
+        query = query.where(AuditEvent.action == action)
+    if start is not None:
+        query = query.where(AuditEvent.created_at >= start)
+    if end is not None and before_id is not None:
+        # Página siguiente: end = created_at y before_id = id del último evento recibido
+        query = query.where(
+            or_(
+                AuditEvent.created_at < end,
+                and_(AuditEvent.created_at == end, AuditEvent.id < before_id),
+            )
+        )
+    elif end is not None:
+        query = query.where(AuditEvent.created_at < end)
+    elif before_id is not None:
+        query = query.where(AuditEvent.id < before_id)
+    query = query.order_by(AuditEvent.created_at.desc(), AuditEvent.id.desc()).limit(limit)
+    return db.scalars(query).all()
@@ -11,8 +11,11 @@ from argon2.exceptions import VerifyMismatchError
 from fastapi.security import OAuth2PasswordBearer
 from itsdangerous import URLSafeTimedSerializer
 
-from .config import settings
+from .config import Config, get_config
+from .cache import cache
 from .database import get_db
+from .jwt_keys import jwt_keys
+from .stats import stage_timer
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from models.users import User
@@ -51,24 +54,18 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 # Crea el token de acceso
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     """Genera un JWT firmado"""
+    config = get_config()
     payload = data.copy()
     if expires_delta:
         expire = datetime.now(UTC) + expires_delta
     else:
-        expire = datetime.now(UTC) + timedelta(
-            minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES.get_secret_value(),
-        )
+        expire = datetime.now(UTC) + config.access_token_expire
 
     # Authlib requiere claims estándar: 'exp' (expiration) y 'iat' (issued at)
     payload.update({"exp": expire, "iat": datetime.now(UTC)})
 
-    # Codificación y firma
-    token = jwt.encode(
-        payload,
-        settings.SECRET_KEY.get_secret_value(),
-        algorithm=settings.ALGORITHM.get_secret_value(),
-    )
-    return token
+    # Codificación y firma (HS256, o EdDSA/ES256 con kid)
+    return jwt_keys().encode(payload)
 
 
 # ----------------------------------------------------------------------
@@ -81,20 +78,64 @@ def verify_access_token(token: str) -> str | None:
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(
+        payload = jwt_keys().decode(
             token,
-            settings.SECRET_KEY.get_secret_value(),
-            algorithms=[settings.ALGORITHM.get_secret_value()],
             options={"require": ["sub", "exp", "iat"]},
         )
-    except (
-        jwt.InvalidTokenError | jwt.ExpiredSignatureError | jwt.InvalidAlgorithmError
-    ):
-        return credentials_exception
+    except jwt.InvalidTokenError:
+        raise credentials_exception
     else:
         return payload.get("sub")
 
 
+# ----------------------------------------------------------------------
+# Cache de usuarios y clientes autenticados (sin hashes de password)
+USER_CACHE_FIELDS = (
+    "id", "username", "email", "role", "is_active", "image_file", "create_at", "version", "updated_at",
+)
+CLIENT_CACHE_FIELDS = ("id", "client_id", "name", "role", "scopes", "is_active", "created_at")
+
+
+def user_cache_key(username: str) -> str:
+    return f"user:{username}"
+
+
+def user_id_cache_key(user_id: int) -> str:
+    return f"user_id:{user_id}"
+
+
+def client_cache_key(client_id: str) -> str:
+    return f"client:{client_id}"
+
+
+def invalidate_user(username: str, user_id: int | None = None):
+    """Descarta el usuario cacheado (en todos los workers)"""
+    cache.invalidate(user_cache_key(username))
+    if user_id is not None:
+        cache.invalidate(user_id_cache_key(user_id))
+
+
+def _load_user_row(db: Session, condition) -> dict | None:
+    result = db.execute(select(User).where(condition))
+    user = result.scalars().first()
+    if user is None:
+        return None
+    # Valida si user_id es un entero (Defensa contra JWT manipulados)
+    try:
+        int(user.id)
+    except (TypeError, ValueError):
+        return None
+    return {field: getattr(user, field) for field in USER_CACHE_FIELDS}
+
+
+def _load_client_row(db: Session, client_id: str) -> dict | None:
+    result = db.execute(select(OAuthClient).where(OAuthClient.client_id == client_id))
+    client = result.scalars().first()
+    if client is None:
+        return None
+    return {field: getattr(client, field) for field in CLIENT_CACHE_FIELDS}
+
+
 # ----------------------------------------------------------------------
 # Obtiene el usuario actual
 def get_current_user(
@@ -102,36 +143,36 @@ def get_current_user(
     db: Annotated[Session, Depends(get_db)],
 ) -> User:
     """Obtiene el usuario actual autenticado."""
-    username = verify_access_token(token)
-    result = db.execute(select(User).where(User.username == username))
-    user = result.scalars().first()
-    if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token Invalido o Expirado.",
-            headers={"WWW-Authenticate": "Bearer"},
+    with stage_timer("user_jwt_decode"):
+        username = verify_access_token(token)
+    with stage_timer("user_lookup"):
+        row = cache.get_or_set(
+            user_cache_key(username),
+            lambda: _load_user_row(db, User.username == username),
         )
-
-    # Valida si user_id es un entero (Defensa contra JWT manipulados)
-    try:
-        user_id_int = int(user.id)
-    except (TypeError, ValueError):
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token Invalido o Expirado.",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    result = db.execute(select(User).where(User.id == user_id_int))
-    user = result.scalars().first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Usuario no encontrado.",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    # Instancia desacoplada de la sesión (solo lectura en los endpoints)
+    return User(**row)
 
-    return user
+
+# ----------------------------------------------------------------------
+# Usuario por id desde el cache de filas (ej: GET /users/{id})
+def get_cached_user(db: Session, user_id: int) -> User | None:
+    with stage_timer("user_lookup"):
+        row = cache.get_or_set(
+            user_id_cache_key(user_id),
+            lambda: _load_user_row(db, User.id == user_id),
+        )
+    if row is None:
+        return None
+    # Instancia desacoplada de la sesión (solo lectura)
+    return User(**row)
 
 
 # ----------------------------------------------------------------------
@@ -140,41 +181,51 @@ CurrentUser = Annotated[User, Depends(get_current_user)]
 
 
 # ----------------------------------------------------------------------
-# Obtiene el cliente actual
-def get_current_client(
-    token: str = Depends(oauth2_client_scheme),
-    db: Session = Depends(get_db),
-):
-    credentials_exception = HTTPException(
+# Decodifica un token de cliente (lo usan HTTP y el canal WebSocket)
+def _client_credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Credenciales de autenticación inválidas.",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+
+def decode_client_token(token: str) -> dict:
+    """Valida firma y expiración; retorna los claims del cliente"""
     try:
-        payload = jwt.decode(
-            token,
-            settings.SECRET_KEY.get_secret_value(),
-            algorithms=[settings.ALGORITHM],
-        )
+        with stage_timer("client_jwt_decode"):
+            payload = jwt_keys().decode(token)
+    except jwt.InvalidTokenError:
+        raise _client_credentials_exception()
 
-        token_type = payload.get("type")
-        client_id = payload.get("sub")
+    if payload.get("type") != "client" or payload.get("sub") is None:
+        raise _client_credentials_exception()
+    return payload
 
-        if token_type != "client" or client_id is None:
-            raise credentials_exception
 
-    except (
-        jwt.InvalidTokenError | jwt.ExpiredSignatureError | jwt.InvalidAlgorithmError
-    ):
-        raise credentials_exception
+# ----------------------------------------------------------------------
+# Busca el cliente activo (cache y luego DB)
+def lookup_client(db: Session, client_id: str) -> OAuthClient | None:
+    with stage_timer("client_lookup"):
+        row = cache.get_or_set(
+            client_cache_key(client_id),
+            lambda: _load_client_row(db, client_id),
+        )
+    if row is None or not row["is_active"]:
+        return None
+    return OAuthClient(**row)
 
-    # Buscar cliente en DB
-    result = db.execute(select(OAuthClient).where(OAuthClient.client_id == client_id))
-    client = result.scalars().first()
 
-    if client is None or not client.is_active:
-        raise credentials_exception
+# ----------------------------------------------------------------------
+# Obtiene el cliente actual
+def get_current_client(
+    token: str = Depends(oauth2_client_scheme),
+    db: Session = Depends(get_db),
+):
+    payload = decode_client_token(token)
+    client = lookup_client(db, payload["sub"])
+    if client is None:
+        raise _client_credentials_exception()
 
     return client
 
@@ -188,25 +239,21 @@ CurrentClient = Annotated[OAuthClient, Depends(get_current_user)]
 # Crea el token de confirmación de correo
 def generate_verification_token(email: str):
     """Genera un token para la verificación del correo"""
-    serializer = URLSafeTimedSerializer(
-        settings.SECRET_KEY_CHECK_MAIL.get_secret_value()
-    )
-    return serializer.dumps(
-        email, salt=settings.SECURITY_PASSWD_SALT.get_secret_value()
-    )
+    config = get_config()
+    serializer = URLSafeTimedSerializer(config.secret_key_check_mail)
+    return serializer.dumps(email, salt=config.security_passwd_salt)
 
 
 # ----------------------------------------------------------------------
 # Verifica el token de confirmación de correo
 def confirm_verification_token(token: str, expiration=3600):
     """Verifica un token de confirmación de correo"""
-    serializer = URLSafeTimedSerializer(
-        settings.SECRET_KEY_CHECK_MAIL.get_secret_value()
-    )
+    config = get_config()
+    serializer = URLSafeTimedSerializer(config.secret_key_check_mail)
     try:
         email = serializer.loads(
             token,
-            salt=settings.SECURITY_PASSWD_SALT.get_secret_value(),
+            salt=config.security_passwd_salt,
             max_age=expiration,  # Token expira en 1 hora
         )
     except Exception:
@@ -215,36 +262,47 @@ def confirm_verification_token(token: str, expiration=3600):
 
 
 # ----------------------------------------------------------------------
-# Envia el email de confirmación
-def send_email_confirmation(context: dict):
-    """Envia un correo de confirmación de email"""
-    email_destinatario = context.get("email")
-    DOMINIO = settings.DOMINIO.get_secret_value()
-    EMAIL_SERVER = settings.EMAIL_SERVER.get_secret_value()
-    EMAIL_PORT = int(settings.EMAIL_PORT.get_secret_value())
-    EMAIL_USER = settings.EMAIL_USER.get_secret_value()
-    EMAIL_PASSWD = settings.EMAIL_PASSWD.get_secret_value()
-
-    # 1. Obtener y Renderizar la Plantilla
-    # Buscamos el archivo y le pasamos el diccionario de contexto completo
+# Contexto del correo de confirmación (link con el token de verificación)
+def confirmation_context(username: str, email: str) -> dict:
+    token = generate_verification_token(email)
+    verify_url = f"http://{get_config().dominio}/api/v1/users/verify/{token}"
+    return {"user": username, "email": email, "url": verify_url}
+
+
+def _confirmation_message(context: dict, config: Config) -> MIMEMultipart:
+    # Buscamos la plantilla y le pasamos el diccionario de contexto completo
     template = templates.get_template("confirmation_tpl.html")
     html_content = template.render(context)
 
-    # 2. Crear el objeto Mensaje (MIMEMultipart es mejor para evitar errores de formato)
+    # MIMEMultipart es mejor para evitar errores de formato
     message = MIMEMultipart("alternative")
-    message["Subject"] = f"{DOMINIO} - Confirme su correo"
-    message["From"] = EMAIL_USER
-    message["To"] = email_destinatario
+    message["Subject"] = f"{config.dominio} - Confirme su correo"
+    message["From"] = config.email_user
+    message["To"] = context.get("email")
+    message.attach(MIMEText(html_content, "html"))
+    return message
+
+
+# ----------------------------------------------------------------------
+# Envia el email de confirmación
+def send_email_confirmation(context: dict):
+    """Envia un correo de confirmación de email"""
+    send_email_confirmations([context])
 
-    # 3. Adjuntar el contenido HTML renderizado
-    part_html = MIMEText(html_content, "html")
-    message.attach(part_html)
 
-    # 4. Enviar
+def send_email_confirmations(contexts: list[dict]):
+    """Envia un lote de correos de confirmación con una sola conexión SMTP"""
+    config = get_config()
     try:
-        with smtplib.SMTP_SSL(EMAIL_SERVER, EMAIL_PORT) as server:
-            server.login(EMAIL_USER, EMAIL_PASSWD)
-            server.sendmail(EMAIL_USER, email_destinatario, message.as_string())
-        print(f"¡Mensaje enviado a {email_destinatario}!")
+        with smtplib.SMTP_SSL(config.email_server, config.email_port) as server:
+            server.login(config.email_user, config.email_passwd)
+            for context in contexts:
+                email_destinatario = context.get("email")
+                message = _confirmation_message(context, config)
+                try:
+                    server.sendmail(config.email_user, email_destinatario, message.as_string())
+                    print(f"¡Mensaje enviado a {email_destinatario}!")
+                except smtplib.SMTPException as e:
+                    print(f"Error enviando email a {email_destinatario}: {e}")
     except Exception as e:
         print(f"Error enviando email: {e}")
@@ -0,0 +1,64 @@
+""" Reconstruye los sketches de percentiles desde la tabla metrics
+
+La ingesta los mantiene al día; esto solo hace falta para el historial previo
+(o después de cambiar SKETCH_BUCKET_SECONDS). Detener la ingesta mientras corre.
+
+Uso (desde la raíz del repo):
+    python -m utils.backfill_sketches [--chunk N]
+"""
+import argparse
+
+from sqlalchemy import delete, select
+
+from models.clients import OAuthClient  # noqa: F401 (tabla referenciada por la FK)
+from models.metrics import MetricSketch, ServerMetrics
+from utils.database import SessionLocal
+from utils.partitions import read_partitions, routed
+from utils.sketches import update_sketches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye metric_sketches")
+    parser.add_argument("--chunk", type=int, default=10000)
+    args = parser.parse_args()
+
+    columns = (
+        ServerMetrics.id,
+        ServerMetrics.client_id,
+        ServerMetrics.server_timestamp,
+        ServerMetrics.cpu_percent,
+        ServerMetrics.memory_percent,
+        ServerMetrics.disk_percent,
+    )
+    total = 0
+    with SessionLocal() as db:
+        db.execute(delete(MetricSketch))
+        db.commit()
+        # Una transacción por partición: ATTACH no se permite dentro de una
+        for partition in read_partitions(db):
+            execution_options = routed(db, partition)
+            cursor = 0
+            while True:
+                rows = db.execute(
+                    select(*columns)
+                    .where(ServerMetrics.id > cursor)
+                    .order_by(ServerMetrics.id)
+                    .limit(args.chunk),
+                    execution_options=execution_options,
+                ).all()
+                if not rows:
+                    break
+                by_client: dict[int, list] = {}
+                for row in rows:
+                    by_client.setdefault(row.client_id, []).append(row)
+                for client_id, samples in by_client.items():
+                    update_sketches(db, client_id, samples)
+                db.flush()
+                cursor = rows[-1].id
+                total += len(rows)
+            db.commit()
+    print(f"{total} muestras procesadas")
+
+
+if __name__ == "__main__":
+    main()
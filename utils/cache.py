@@ -0,0 +1,497 @@
+""" Cache en dos niveles: LRU en proceso + SQLite compartido entre workers
+
+- MemoryCache: LRU acotado con TTL por entrada (por proceso).
+- SQLiteCache: archivo compartido por todos los workers de uvicorn; los
+  valores se serializan con MessagePack y se descartan por TTL o, al pasar
+  el máximo de entradas, por antigüedad.
+- TieredCache: consulta primero el nivel local y luego el compartido. Las
+  invalidaciones se publican en el archivo compartido y cada worker las
+  aplica a su nivel local (a lo sumo cada INVALIDATION_POLL_SECONDS); los
+  hooks registrados con on_invalidate() se llaman una vez por cada llave
+  invalidada, sea en este worker o en otro.
+- Lecturas y escrituras del nivel compartido esperan el lock a lo sumo
+  SHARED_TIMEOUT_SECONDS y, si fallan, cuentan como miss. Las invalidaciones
+  no: usan su propia conexión con INVALIDATION_TIMEOUT_SECONDS, reintentan y,
+  si igual fallan, se informan y quedan pendientes hasta publicarse (job
+  retry_invalidations del scheduler). Un usuario desactivado no puede seguir
+  autenticando en otro worker porque se perdió el aviso.
+- get_or_set() toma la secuencia de invalidaciones antes de llamar al loader:
+  si la llave se invalida mientras carga (en este worker o en otro), el valor
+  leído se retorna pero no se guarda. En el nivel compartido el chequeo y la
+  escritura son una sola sentencia.
+
+CACHE_BACKEND=memory desactiva el nivel compartido (un solo worker).
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import datetime
+from typing import Any
+
+import msgpack
+
+from .config import get_config
+from .stats import register_gauge
+
+CACHE_BACKEND = get_config().cache_backend
+CACHE_DB_PATH = get_config().cache_db_path
+CACHE_MAX_ENTRIES = get_config().cache_max_entries
+CACHE_TTL_SECONDS = get_config().cache_ttl
+
+# Cada cuánto un worker revisa las invalidaciones publicadas por los demás
+INVALIDATION_POLL_SECONDS = 1.0
+# Espera máxima por el lock del archivo compartido (hot path: get / set)
+SHARED_TIMEOUT_SECONDS = 0.05
+# Invalidaciones: espera por el lock e intentos antes de dejarla pendiente
+INVALIDATION_TIMEOUT_SECONDS = 2.0
+INVALIDATION_ATTEMPTS = 3
+# Cada cuántos set() el nivel compartido purga expirados y excedentes
+SHARED_TRIM_EVERY = 256
+# Las invalidaciones más viejas que esto ya no le sirven a ningún worker
+INVALIDATION_LOG_SECONDS = 3600
+
+_DATETIME_EXT = 1
+
+
+# ----------------------------------------------------------------------
+# Codec MessagePack (con datetimes) para el nivel compartido
+def _default(value):
+    if isinstance(value, datetime):
+        return msgpack.ExtType(_DATETIME_EXT, value.isoformat().encode())
+    raise TypeError(f"Tipo no serializable en cache: {type(value).__name__}")
+
+
+def _ext_hook(code: int, data: bytes):
+    if code == _DATETIME_EXT:
+        return datetime.fromisoformat(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def encode(value) -> bytes:
+    return msgpack.packb(value, default=_default, use_bin_type=True)
+
+
+def decode(data: bytes):
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False)
+
+
+# ----------------------------------------------------------------------
+# Nivel local: LRU acotado y thread-safe con TTL por entrada
+class MemoryCache:
+    def __init__(self, maxsize: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float | None = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# ----------------------------------------------------------------------
+# Nivel compartido: archivo SQLite (WAL) + log de invalidaciones
+class SQLiteCache:
+    def __init__(
+        self,
+        path: str = CACHE_DB_PATH,
+        maxsize: int = CACHE_MAX_ENTRIES,
+        ttl: float = CACHE_TTL_SECONDS,
+    ):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+        # Conexión aparte para invalidar: espera el lock sin frenar los get/set
+        self._invalidation_connection: sqlite3.Connection | None = None
+        self._invalidation_pid: int | None = None
+        self._invalidation_lock = threading.Lock()
+        self._sets = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una conexión por proceso: se abre después del fork de cada worker
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = self._open(SHARED_TIMEOUT_SECONDS)
+            self._pid = os.getpid()
+        return self._connection
+
+    def _connect_invalidations(self) -> sqlite3.Connection:
+        if self._invalidation_connection is None or self._invalidation_pid != os.getpid():
+            self._invalidation_connection = self._open(INVALIDATION_TIMEOUT_SECONDS)
+            self._invalidation_pid = os.getpid()
+        return self._invalidation_connection
+
+    def _open(self, timeout: float) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.path,
+            timeout=timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        # Es un cache: perder escrituras ante un corte de luz no importa
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " stored_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_cache_entries_stored_at"
+            " ON cache_entries (stored_at)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_invalidations ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " key TEXT NOT NULL,"
+            " created_at REAL NOT NULL"
+            ")"
+        )
+        return connection
+
+    def _execute(self, sql: str, params=()) -> list:
+        # Un cache que falla no debe tumbar el request: se trata como miss
+        try:
+            with self._lock:
+                return self._connect().execute(sql, params).fetchall()
+        except sqlite3.Error:
+            return []
+
+    def get(self, key: str, default=None):
+        rows = self._execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        )
+        return decode(rows[0][0]) if rows else default
+
+    def set(self, key: str, value, ttl: float | None = None):
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, stored_at)"
+            " VALUES (?, ?, ?, ?)",
+            (key, encode(value), now + (self.ttl if ttl is None else ttl), now),
+        )
+        self._count_set()
+
+    def set_if_fresh(self, key: str, value, seq: int, ttl: float | None = None) -> bool:
+        """Guarda solo si la llave no se invalidó después de `seq`
+
+        publish_invalidation borra el valor y registra la invalidación en una
+        transacción: antes de este insert lo descarta, después lo borra.
+        """
+        now = time.time()
+        rows = self._execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, stored_at)"
+            " SELECT ?, ?, ?, ? WHERE NOT EXISTS ("
+            "  SELECT 1 FROM cache_invalidations WHERE seq > ? AND key = ?)"
+            " RETURNING key",
+            (key, encode(value), now + (self.ttl if ttl is None else ttl), now, seq, key),
+        )
+        self._count_set()
+        return bool(rows)
+
+    def _count_set(self):
+        self._sets += 1
+        if self._sets % SHARED_TRIM_EVERY == 0:
+            self.trim()
+
+    def delete(self, key: str):
+        self._execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def clear(self):
+        self._execute("DELETE FROM cache_entries")
+
+    def trim(self):
+        """Purga expirados y, si sobran entradas, las más antiguas"""
+        now = time.time()
+        self._execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+        self._execute(
+            "DELETE FROM cache_entries WHERE key IN ("
+            " SELECT key FROM cache_entries ORDER BY stored_at"
+            " LIMIT max(0, (SELECT count(*) FROM cache_entries) - ?))",
+            (self.maxsize,),
+        )
+        self._execute(
+            "DELETE FROM cache_invalidations WHERE created_at < ?",
+            (now - INVALIDATION_LOG_SECONDS,),
+        )
+
+    # Log de invalidaciones (broadcast entre workers)
+    def publish_invalidation(self, key: str, delete_value: bool = True) -> int:
+        """Borra el valor compartido y publica la invalidación (una transacción)
+
+        Espera el lock y reintenta; sqlite3.Error si no lo logra.
+        """
+        for attempt in range(INVALIDATION_ATTEMPTS):
+            try:
+                with self._invalidation_lock:
+                    connection = self._connect_invalidations()
+                    connection.execute("BEGIN IMMEDIATE")
+                    try:
+                        if delete_value:
+                            connection.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                        seq = connection.execute(
+                            "INSERT INTO cache_invalidations (key, created_at) VALUES (?, ?) RETURNING seq",
+                            (key, time.time()),
+                        ).fetchone()[0]
+                        connection.execute("COMMIT")
+                    except BaseException:
+                        if connection.in_transaction:
+                            connection.execute("ROLLBACK")
+                        raise
+                return seq
+            except sqlite3.Error:
+                if attempt == INVALIDATION_ATTEMPTS - 1:
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+
+    def invalidations_since(self, seq: int) -> list[tuple[int, str]]:
+        return self._execute(
+            "SELECT seq, key FROM cache_invalidations WHERE seq > ? ORDER BY seq",
+            (seq,),
+        )
+
+    def invalidated_since(self, key: str, seq: int) -> bool:
+        """True si la llave se invalidó después de `seq` (o no se pudo consultar)"""
+        rows = self._execute(
+            "SELECT count(*) FROM cache_invalidations WHERE seq > ? AND key = ?",
+            (seq, key),
+        )
+        return not rows or rows[0][0] > 0
+
+    def last_invalidation(self) -> int | None:
+        """Última secuencia publicada; None si no se pudo consultar"""
+        rows = self._execute("SELECT coalesce(max(seq), 0) FROM cache_invalidations")
+        return rows[0][0] if rows else None
+
+
+# ----------------------------------------------------------------------
+# Cache de dos niveles. Con share_values=False los valores quedan solo en el
+# nivel local (ej: material de llaves), pero las invalidaciones se propagan
+class TieredCache:
+    def __init__(
+        self,
+        local: MemoryCache,
+        shared: SQLiteCache | None = None,
+        share_values: bool = True,
+    ):
+        self.local = local
+        self.shared = shared
+        self.share_values = share_values and shared is not None
+        self._seq = (shared.last_invalidation() or 0) if shared else 0
+        # Invalidaciones propias ya aplicadas (no se repiten al leer el log)
+        self._published: set[int] = set()
+        # Invalidaciones que no se pudieron publicar (se reintentan)
+        self._pending: set[str] = set()
+        self._pending_lock = threading.Lock()
+        self.failed_publishes = 0
+        self._next_poll = 0.0
+        self._poll_lock = threading.Lock()
+        self._hooks: list[Callable[[str], None]] = []
+        # Cargas en curso de get_or_set por llave (las invalidaciones las marcan)
+        self._loads: dict[str, list[_Load]] = {}
+        self._loads_lock = threading.Lock()
+        self.stale_loads = 0
+
+    def on_invalidate(self, hook: Callable[[str], None]) -> Callable[[str], None]:
+        """Registra un hook de invalidación (usable como decorador)"""
+        self._hooks.append(hook)
+        return hook
+
+    def get(self, key: str, default=None):
+        self._poll_invalidations()
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.share_values:
+            value = self.shared.get(key, _MISSING)
+            if value is not _MISSING:
+                self.local.set(key, value)
+                return value
+        return default
+
+    def set(self, key: str, value, ttl: float | None = None):
+        self.local.set(key, value, ttl)
+        if self.share_values:
+            self.shared.set(key, value, ttl)
+
+    def get_or_set(self, key: str, loader: Callable[[], Any], ttl: float | None = None):
+        """Retorna el valor cacheado o lo carga (None no se cachea)
+
+        Si la llave se invalida durante el loader, el valor no se guarda.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        # Secuencia antes de leer la DB: una invalidación posterior gana
+        load = _Load(self.shared.last_invalidation() if self.shared else 0)
+        with self._loads_lock:
+            self._loads.setdefault(key, []).append(load)
+        try:
+            value = loader()
+            if value is not None:
+                self._store_loaded(key, value, ttl, load)
+        finally:
+            with self._loads_lock:
+                loads = self._loads[key]
+                loads.remove(load)
+                if not loads:
+                    del self._loads[key]
+        return value
+
+    def _store_loaded(self, key: str, value, ttl: float | None, load: _Load):
+        fresh = not load.stale and load.seq is not None
+        if fresh and self.shared is not None:
+            if self.share_values:
+                fresh = self.shared.set_if_fresh(key, value, load.seq, ttl)
+            else:
+                fresh = not self.shared.invalidated_since(key, load.seq)
+        with self._loads_lock:
+            # Invalidaciones de este worker (incluso si no se pudieron publicar)
+            if fresh and not load.stale:
+                self.local.set(key, value, ttl)
+                return
+            self.stale_loads += 1
+
+    def _mark_stale(self, key: str):
+        with self._loads_lock:
+            for load in self._loads.get(key, ()):
+                load.stale = True
+
+    def invalidate(self, key: str):
+        """Elimina la llave en todos los niveles y avisa a los demás workers"""
+        self._mark_stale(key)
+        self.local.delete(key)
+        if self.shared is not None:
+            self._publish(key)
+        self._run_hooks(key)
+
+    def _publish(self, key: str) -> bool:
+        try:
+            seq = self.shared.publish_invalidation(key, delete_value=self.share_values)
+        except sqlite3.Error as exc:
+            # Los demás workers todavía tienen el valor: queda pendiente y se informa
+            with self._pending_lock:
+                self._pending.add(key)
+                self.failed_publishes += 1
+            print(f"Error publicando la invalidación de {key!r} (se reintenta): {exc}", file=sys.stderr)
+            return False
+        self._published.add(seq)
+        return True
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def retry_pending(self):
+        """Publica las invalidaciones pendientes (job del scheduler)"""
+        with self._pending_lock:
+            keys, self._pending = self._pending, set()
+        for key in keys:
+            self._publish(key)
+
+    def clear(self):
+        self.local.clear()
+        if self.share_values:
+            self.shared.clear()
+
+    def _poll_invalidations(self):
+        if self.shared is None or time.monotonic() < self._next_poll:
+            return
+        # Solo un thread consulta el log; los demás siguen sin esperar
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_poll = time.monotonic() + INVALIDATION_POLL_SECONDS
+            for seq, key in self.shared.invalidations_since(self._seq):
+                self._seq = seq
+                if seq in self._published:
+                    self._published.discard(seq)
+                    continue
+                self._mark_stale(key)
+                self.local.delete(key)
+                self._run_hooks(key)
+        finally:
+            self._poll_lock.release()
+
+    def _run_hooks(self, key: str):
+        for hook in self._hooks:
+            hook(key)
+
+
+_MISSING = object()
+
+
+# Carga en curso de get_or_set
+class _Load:
+    __slots__ = ("seq", "stale")
+
+    def __init__(self, seq: int | None):
+        self.seq = seq
+        self.stale = False
+
+
+def _build_shared() -> SQLiteCache | None:
+    if CACHE_BACKEND == "memory":
+        return None
+    return SQLiteCache(CACHE_DB_PATH)
+
+
+_shared = _build_shared()
+
+# Cache general (ej: usuarios y clientes autenticados)
+cache = TieredCache(MemoryCache(), _shared)
+# Material sensible (llaves AES): nunca se escribe en el archivo compartido
+local_cache = TieredCache(MemoryCache(), _shared, share_values=False)
+
+
+def retry_pending_invalidations():
+    cache.retry_pending()
+    local_cache.retry_pending()
+
+
+register_gauge(
+    "cache_invalidations",
+    "Invalidaciones pendientes de publicar, publicaciones fallidas y cargas descartadas",
+    lambda: {
+        "pending": cache.pending + local_cache.pending,
+        "failed": cache.failed_publishes + local_cache.failed_publishes,
+        "stale_loads": cache.stale_loads + local_cache.stale_loads,
+    },
+)
@@ -0,0 +1,294 @@
+""" Compresión gzip/zstd de requests y responses (con límite anti-bombas) """
+from __future__ import annotations
+
+import io
+import zlib
+from pathlib import Path
+
+import zstandard
+from fastapi import HTTPException, status
+from starlette.datastructures import Headers, MutableHeaders
+
+from .config import Config, get_config, on_reload
+from .fastjson import FastJSONResponse
+
+ZSTD_DICT_PATH = get_config().zstd_dict_path
+
+# gzip: miembros concatenados admitidos y entrada por llamada a zlib
+GZIP_MAX_MEMBERS = 64
+GZIP_INPUT_CHUNK = 64 * 1024
+
+# Tipos de contenido que vale la pena comprimir
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/xml", "application/javascript")
+
+
+# ----------------------------------------------------------------------
+# Diccionario zstd entrenado (ver utils/train_zstd_dict.py)
+def _load_dictionary() -> zstandard.ZstdCompressionDict | None:
+    if not ZSTD_DICT_PATH or not Path(ZSTD_DICT_PATH).is_file():
+        return None
+    return zstandard.ZstdCompressionDict(Path(ZSTD_DICT_PATH).read_bytes())
+
+
+ZSTD_DICT = _load_dictionary()
+_zstd_compressor = zstandard.ZstdCompressor(level=get_config().zstd_level)
+_zstd_decompressor = zstandard.ZstdDecompressor()
+_zstd_dict_decompressor = (
+    zstandard.ZstdDecompressor(dict_data=ZSTD_DICT) if ZSTD_DICT else None
+)
+
+
+@on_reload
+def _reload_compressor(previous: Config, config: Config):
+    global _zstd_compressor
+    if config.zstd_level != previous.zstd_level:
+        _zstd_compressor = zstandard.ZstdCompressor(level=config.zstd_level)
+
+
+# ----------------------------------------------------------------------
+# Descomprime con tope de tamaño; nunca materializa más de `limit` bytes.
+# Todos los miembros gzip / frames zstd concatenados cuentan contra el tope;
+# datos sobrantes que no forman un miembro o frame válido son un 400.
+def decompress(data: bytes, encoding: str, limit: int | None = None) -> bytes:
+    if limit is None:
+        limit = get_config().max_decompressed_bytes
+    too_large = HTTPException(
+        status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+        detail="El contenido descomprimido excede el máximo permitido",
+    )
+    invalid = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Contenido comprimido inválido",
+    )
+
+    if encoding == "gzip":
+        # Entrada en trozos acotados desde un offset: zlib copia a unused_data
+        # lo que sobra al cerrar cada miembro (con todo el body sería cuadrático)
+        view = memoryview(data)
+        offset = 0
+        chunks = []
+        size = 0
+        for _ in range(GZIP_MAX_MEMBERS):
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            while not decompressor.eof:
+                if offset >= len(view):
+                    # Miembro truncado
+                    raise invalid
+                piece = view[offset:offset + GZIP_INPUT_CHUNK]
+                offset += len(piece)
+                try:
+                    # +1: distingue "justo en el tope" de "excede el tope"
+                    chunk = decompressor.decompress(piece, limit - size + 1)
+                except zlib.error:
+                    raise invalid
+                size += len(chunk)
+                if size > limit or decompressor.unconsumed_tail:
+                    raise too_large
+                chunks.append(chunk)
+            offset -= len(decompressor.unused_data)
+            if offset >= len(view):
+                return b"".join(chunks)
+        # Demasiados miembros (ej: miles de miembros vacíos)
+        raise invalid
+
+    if encoding == "zstd":
+        # El lector de zstd no avisa si el último frame quedó cortado
+        dict_ids = _zstd_frame_dict_ids(data)
+        if not dict_ids:
+            raise invalid
+        dict_id = max(dict_ids)
+        if dict_id and (ZSTD_DICT is None or set(dict_ids) - {0, ZSTD_DICT.dict_id()}):
+            raise invalid
+        decompressor = _zstd_dict_decompressor if dict_id else _zstd_decompressor
+        chunks = []
+        size = 0
+        try:
+            with decompressor.stream_reader(io.BytesIO(data), read_across_frames=True) as reader:
+                while chunk := reader.read(limit - size + 1):
+                    size += len(chunk)
+                    if size > limit:
+                        raise too_large
+                    chunks.append(chunk)
+        except zstandard.ZstdError:
+            raise invalid
+        return b"".join(chunks)
+
+    raise HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail="Content-Encoding no soportado",
+    )
+
+
+# Frames zstd (RFC 8878): recorre solo los headers de frames y bloques
+ZSTD_SKIPPABLE_MAGIC = range(0x184D2A50, 0x184D2A60)
+
+
+def _zstd_frame_dict_ids(data: bytes) -> list[int] | None:
+    """dict_id de cada frame; None si un frame está truncado o sobran bytes"""
+    view = memoryview(data)
+    dict_ids = []
+    offset = 0
+    while offset < len(view):
+        if int.from_bytes(view[offset:offset + 4], "little") in ZSTD_SKIPPABLE_MAGIC:
+            if offset + 8 > len(view):
+                return None
+            offset += 8 + int.from_bytes(view[offset + 4:offset + 8], "little")
+            continue
+        try:
+            params = zstandard.get_frame_parameters(view[offset:])
+            offset += zstandard.frame_header_size(view[offset:])
+        except zstandard.ZstdError:
+            return None
+        while True:
+            if offset + 3 > len(view):
+                return None
+            header = int.from_bytes(view[offset:offset + 3], "little")
+            block_type, block_size = (header >> 1) & 3, header >> 3
+            if block_type == 3:
+                return None
+            # Bloque RLE: un solo byte repetido block_size veces
+            offset += 3 + (1 if block_type == 1 else block_size)
+            if header & 1:
+                break
+        if params.has_checksum:
+            offset += 4
+        dict_ids.append(params.dict_id)
+    return dict_ids if offset == len(view) else None
+
+
+# ----------------------------------------------------------------------
+# Elige la codificación según Accept-Encoding (zstd > gzip, respeta q=0)
+def choose_encoding(accept_encoding: str) -> str | None:
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ("zstd", "gzip"):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return _zstd_compressor.compress(data)
+    return zlib.compress(data, get_config().gzip_level, wbits=16 + zlib.MAX_WBITS)
+
+
+# ----------------------------------------------------------------------
+# Middleware ASGI: descomprime requests y comprime responses grandes
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int | None = None):
+        self.app = app
+        # None = COMPRESSION_MIN_SIZE vigente (recargable)
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", "").strip().lower()
+        if content_encoding and content_encoding != "identity":
+            try:
+                body = await self._read_body(receive)
+                body = decompress(body, content_encoding)
+            except HTTPException as exc:
+                response = FastJSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+                await response(scope, receive, send)
+                return
+            scope = dict(scope)
+            scope["headers"] = [
+                (name, value)
+                for name, value in scope["headers"]
+                if name not in (b"content-encoding", b"content-length")
+            ] + [(b"content-length", str(len(body)).encode())]
+            receive = self._replay(body, receive)
+
+        encoding = choose_encoding(headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, self._compressing_send(send, encoding))
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            # El cuerpo comprimido tampoco puede exceder el máximo
+            if size > get_config().max_decompressed_bytes:
+                raise HTTPException(
+                    status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                    detail="El contenido excede el máximo permitido",
+                )
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    def _replay(body: bytes, receive):
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if sent:
+                # Tras el cuerpo solo quedan eventos como http.disconnect
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return replay
+
+    def _compressing_send(self, send, encoding: str):
+        start_message = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if "content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            passthrough = True
+            body = message.get("body", b"")
+            # Respuestas en streaming (ej: SSE) o pequeñas se envían tal cual
+            if self.minimum_size is None:
+                minimum_size = get_config().compression_min_size
+            else:
+                minimum_size = self.minimum_size
+            if message.get("more_body", False) or len(body) < minimum_size:
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers = MutableHeaders(scope=start_message)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        return compressing_send
@@ -0,0 +1,107 @@
+""" GET condicional (ETag / Last-Modified) y cache de respuestas de usuarios
+
+- users.version sube con cada cambio del registro (bump_version). ETag:
+  "<id>.<alta en ms>.<versión>"; el alta distingue un id que SQLite reutiliza
+  después de un delete. Last-Modified: updated_at (o create_at).
+- GET /users/me y /users/{id} obtienen el usuario del cache de filas; si
+  If-None-Match (o, sin él, If-Modified-Since) coincide responden 304 sin
+  serializar ni tocar la DB.
+- El JSON de UserResponsePrivate se guarda en un LRU por worker indexado por
+  ETag: una versión nueva tiene otro ETag y nunca lee bytes viejos, así que no
+  hace falta invalidarlo entre workers.
+"""
+from __future__ import annotations
+
+import threading
+from datetime import UTC, datetime
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Response, status
+from starlette.requests import HTTPConnection
+
+from models.users import User
+from schemas.user import UserResponsePrivate
+from .cache import MemoryCache
+from .fastjson import model_response
+from .stats import register_gauge, stage_timer
+
+USER_RESPONSE_CACHE_SIZE = 512
+USER_RESPONSE_TTL_SECONDS = 3600
+
+_responses = MemoryCache(maxsize=USER_RESPONSE_CACHE_SIZE, ttl=USER_RESPONSE_TTL_SECONDS)
+_stats = {"not_modified": 0, "hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+register_gauge(
+    "user_responses",
+    "GET de usuarios: 304, respuestas desde cache y serializadas",
+    lambda: _stats.copy(),
+)
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def bump_version(user: User):
+    """Marca el registro como modificado (se aplica en el próximo commit)"""
+    user.version = User.version + 1
+    user.updated_at = datetime.now(UTC)
+
+
+def _aware(value: datetime) -> datetime:
+    # SQLite devuelve los datetimes sin zona (se guardan en UTC)
+    return value if value.tzinfo is not None else value.replace(tzinfo=UTC)
+
+
+def user_etag(user: User) -> str:
+    created = int(_aware(user.create_at).timestamp() * 1000)
+    return f'"{user.id}.{created}.{user.version}"'
+
+
+def last_modified(user: User) -> datetime:
+    # Los headers HTTP tienen resolución de segundos
+    return _aware(user.updated_at or user.create_at).replace(microsecond=0)
+
+
+def _not_modified(connection: HTTPConnection, etag: str, modified: datetime) -> bool:
+    if_none_match = connection.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Comparación débil (RFC 9110): W/"x" equivale a "x"
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if_modified_since = connection.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = _aware(parsedate_to_datetime(if_modified_since))
+        except (TypeError, ValueError):
+            return False
+        return modified <= since
+    return False
+
+
+# ----------------------------------------------------------------------
+# Respuesta de UserResponsePrivate con validadores (200 o 304)
+def user_response(connection: HTTPConnection, user: User) -> Response:
+    etag = user_etag(user)
+    modified = last_modified(user)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(modified, usegmt=True),
+        # Datos del usuario autenticado: solo caches privados y revalidando siempre
+        "Cache-Control": "private, no-cache",
+    }
+    if _not_modified(connection, etag, modified):
+        _count("not_modified")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    body = _responses.get(etag)
+    if body is None:
+        _count("misses")
+        with stage_timer("user_serialize"):
+            body = model_response(user, UserResponsePrivate).body
+        _responses.set(etag, body)
+    else:
+        _count("hits")
+    return Response(content=body, headers=headers, media_type="application/json")
@@ -1,4 +1,36 @@
-from pydantic import SecretStr
+""" Configuración: variables de entorno (.env) y snapshot tipado recargable
+
+- Settings lee los valores crudos (SecretStr) del entorno y del .env.
+- Config es un snapshot inmutable y tipado con los valores derivados ya
+  calculados (timedelta, llave AES decodificada, PEM de los JWT, IPs). Cada uso
+  lee get_config(): una lectura de variable, sin parseo por request.
+- reload_config() arma un snapshot nuevo y lo publica de una sola vez (SIGHUP
+  o cambio del .env). Si la configuración nueva es inválida se conserva la
+  vigente. Los campos de RESTART_FIELDS (paths, stores, tamaños de buffers ya
+  creados) mantienen el valor del arranque hasta reiniciar. SIGHUP también
+  relee los archivos PEM de JWT_KEYS.
+- on_reload() registra callbacks para lo que se deriva del snapshot (límites
+  de rate limiting, compresor zstd, llaves de los JWT).
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import os
+import signal
+import sys
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass, fields, replace
+from datetime import timedelta
+from pathlib import Path
+
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key,
+    load_pem_public_key,
+)
+from pydantic import SecretStr, ValidationError
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -12,6 +44,8 @@ class Settings(BaseSettings):
     NAME: SecretStr
     SECRET_KEY: SecretStr
     ALGORITHM: SecretStr
+    # EdDSA / ES256: archivos PEM separados por coma (la primera privada firma)
+    JWT_KEYS: SecretStr = SecretStr("")
     ACCESS_TOKEN_EXPIRE_MINUTES: SecretStr
     SECRET_KEY_CHECK_MAIL: SecretStr
     SECURITY_PASSWD_SALT: SecretStr
@@ -22,6 +56,340 @@ class Settings(BaseSettings):
     EMAIL_PASSWD: SecretStr
     AES_SECRET_KEY: SecretStr
     NONCE_TTL_MINUTES: SecretStr
+    # Rotación de llaves AES: la llave anterior descifra durante este margen
+    AES_KEY_ROTATION_GRACE_SECONDS: SecretStr = SecretStr("86400")
+    # IPs (CSV) con acceso a /api/v1/internal (ej: Prometheus local)
+    INTERNAL_ALLOWED_IPS: SecretStr = SecretStr("127.0.0.1,::1")
+    # Fracción de requests perfilados (0 desactiva el muestreo)
+    PROFILE_SAMPLE_RATE: SecretStr = SecretStr("0")
+    PROFILE_INTERVAL_MS: SecretStr = SecretStr("5")
+    PROFILE_DIR: SecretStr = SecretStr("utils/profiles")
+    PROFILE_MAX_FILES: SecretStr = SecretStr("200")
+    # Compresión de requests/responses
+    COMPRESSION_MIN_SIZE: SecretStr = SecretStr("1024")
+    MAX_DECOMPRESSED_BYTES: SecretStr = SecretStr("1048576")
+    GZIP_LEVEL: SecretStr = SecretStr("6")
+    ZSTD_LEVEL: SecretStr = SecretStr("3")
+    ZSTD_DICT_PATH: SecretStr = SecretStr("")
+    # Almacenamiento de raw_payload: "full" o "compact" (deduplicado)
+    RAW_PAYLOAD_STORAGE: SecretStr = SecretStr("full")
+    # Rate limiting (vacío lo desactiva): "ip=1200/60,role:agent=600/60"
+    RATE_LIMITS: SecretStr = SecretStr("")
+    # "sqlite" (compartido entre workers) o "memory" (un solo worker)
+    RATE_LIMIT_STORE: SecretStr = SecretStr("sqlite")
+    RATE_LIMIT_DB_PATH: SecretStr = SecretStr("utils/ratelimit.db")
+    # Cache: "tiered" (LRU local + SQLite compartido) o "memory" (solo local)
+    CACHE_BACKEND: SecretStr = SecretStr("tiered")
+    CACHE_DB_PATH: SecretStr = SecretStr("utils/cache.db")
+    CACHE_MAX_ENTRIES: SecretStr = SecretStr("10000")
+    CACHE_TTL_SECONDS: SecretStr = SecretStr("60")
+    # Canal WebSocket de ingesta: tamaño del lote y espera máxima del ack
+    WS_ACK_BATCH_SIZE: SecretStr = SecretStr("50")
+    WS_ACK_INTERVAL_MS: SecretStr = SecretStr("200")
+    WS_AUTH_TIMEOUT_SECONDS: SecretStr = SecretStr("10")
+    # Fan-out en vivo (SSE): historial por cliente, buffer por suscriptor y
+    # sondeo de las muestras de otros workers (0 lo desactiva)
+    LIVE_HISTORY_SIZE: SecretStr = SecretStr("100")
+    LIVE_SUBSCRIBER_BUFFER: SecretStr = SecretStr("1000")
+    LIVE_POLL_INTERVAL_MS: SecretStr = SecretStr("1000")
+    # Segundos sin muestras para marcar un cliente como "stale"
+    FLEET_STALE_SECONDS: SecretStr = SecretStr("300")
+    # Alertas: webhook que recibe los cambios de estado (vacío = solo outbox)
+    ALERT_WEBHOOK_URL: SecretStr = SecretStr("")
+    ALERT_DISPATCH_INTERVAL_SECONDS: SecretStr = SecretStr("10")
+    # Ancho de los buckets de percentiles (no cambiar con datos existentes)
+    SKETCH_BUCKET_SECONDS: SecretStr = SecretStr("3600")
+    # Particiones mensuales de metrics y meses retenidos (0 = sin retención)
+    METRICS_PARTITION_DIR: SecretStr = SecretStr("utils/partitions")
+    METRICS_RETENTION_MONTHS: SecretStr = SecretStr("0")
+    # Auditoría: eventos en memoria por worker y espera máxima de cada lote
+    AUDIT_BUFFER_SIZE: SecretStr = SecretStr("10000")
+    AUDIT_FLUSH_MS: SecretStr = SecretStr("1000")
+    # Concurrencia por grupo de rutas y descarte (utils/loadshed.py)
+    THREADPOOL_SIZE: SecretStr = SecretStr("40")
+    CONCURRENCY_LIMITS: SecretStr = SecretStr("auth=8:64:1000,ingest=24:512,default=8:256")
+    LOAD_SHED_TARGET_MS: SecretStr = SecretStr("100")
+    LOAD_SHED_INTERVAL_MS: SecretStr = SecretStr("1000")
 
 # Carga de variables de entorno
 settings = Settings()
+
+
+# ----------------------------------------------------------------------
+# Snapshot tipado (inmutable); los handlers lo leen con get_config()
+@dataclass(frozen=True, slots=True)
+class Config:
+    version: int
+    # Usuario principal
+    admin: str
+    name: str
+    # JWT y tokens de correo
+    secret_key: str
+    algorithm: str
+    jwt_keys: tuple[bytes, ...]
+    access_token_expire: timedelta
+    secret_key_check_mail: str
+    security_passwd_salt: str
+    nonce_ttl: timedelta
+    aes_secret_key: bytes
+    aes_key_rotation_grace: timedelta
+    # Correo
+    dominio: str
+    email_server: str
+    email_port: int
+    email_user: str
+    email_passwd: str
+    # Endpoints internos y perfilado
+    internal_allowed_ips: frozenset[str]
+    profile_sample_rate: float
+    profile_interval: float
+    profile_dir: Path
+    profile_max_files: int
+    # Compresión y almacenamiento de payloads
+    compression_min_size: int
+    max_decompressed_bytes: int
+    gzip_level: int
+    zstd_level: int
+    zstd_dict_path: str
+    raw_payload_storage: str
+    # Rate limiting y cache
+    rate_limits: str
+    rate_limit_store: str
+    rate_limit_db_path: str
+    cache_backend: str
+    cache_db_path: str
+    cache_max_entries: int
+    cache_ttl: float
+    # Ingesta WebSocket y fan-out en vivo
+    ws_ack_batch_size: int
+    ws_ack_interval: float
+    ws_auth_timeout: float
+    live_history_size: int
+    live_subscriber_buffer: int
+    live_poll_interval: float
+    # Flota, alertas, percentiles y particiones
+    fleet_stale: timedelta
+    alert_webhook_url: str
+    alert_dispatch_interval: int
+    sketch_bucket_seconds: int
+    metrics_partition_dir: str
+    metrics_retention_months: int
+    # Auditoría
+    audit_buffer_size: int
+    audit_flush_interval: float
+    # Concurrencia y descarte
+    threadpool_size: int
+    concurrency_limits: str
+    load_shed_target: float
+    load_shed_interval: float
+
+    @classmethod
+    def from_settings(cls, source: Settings, version: int = 1) -> Config:
+        """Valida y convierte los valores crudos; ValueError si alguno es inválido"""
+
+        def raw(name: str) -> str:
+            return getattr(source, name).get_secret_value()
+
+        def number(name: str, kind=int):
+            try:
+                return kind(raw(name))
+            except ValueError:
+                raise ValueError(f"{name} inválido: {raw(name)!r}") from None
+
+        try:
+            aes_secret_key = base64.b64decode(raw("AES_SECRET_KEY"), validate=True)
+        except binascii.Error:
+            raise ValueError("AES_SECRET_KEY must be base64") from None
+        if not aes_secret_key:
+            raise ValueError("AES_SECRET_KEY not configured")
+        if len(aes_secret_key) != 32:
+            raise ValueError("AES_SECRET_KEY must be 32 bytes")
+
+        algorithm = raw("ALGORITHM")
+        if algorithm not in ("HS256", "EdDSA", "ES256"):
+            raise ValueError(f"ALGORITHM no soportado: {algorithm!r}")
+        jwt_keys = []
+        if algorithm != "HS256":
+            paths = [path.strip() for path in raw("JWT_KEYS").split(",") if path.strip()]
+            if not paths:
+                raise ValueError(f"JWT_KEYS es obligatorio con ALGORITHM={algorithm}")
+            for path in paths:
+                try:
+                    jwt_keys.append(Path(path).read_bytes())
+                except OSError as exc:
+                    raise ValueError(f"JWT_KEYS: no se pudo leer {path}: {exc}") from None
+                _check_jwt_key(path, jwt_keys[-1], algorithm)
+            if not any(b"PRIVATE KEY" in pem for pem in jwt_keys):
+                raise ValueError("JWT_KEYS no incluye una llave privada para firmar")
+
+        threadpool_size = number("THREADPOOL_SIZE")
+        if threadpool_size < 1:
+            raise ValueError(f"THREADPOOL_SIZE inválido: {threadpool_size}")
+
+        return cls(
+            version=version,
+            admin=raw("ADMIN"),
+            name=raw("NAME"),
+            secret_key=raw("SECRET_KEY"),
+            algorithm=algorithm,
+            jwt_keys=tuple(jwt_keys),
+            access_token_expire=timedelta(minutes=number("ACCESS_TOKEN_EXPIRE_MINUTES")),
+            secret_key_check_mail=raw("SECRET_KEY_CHECK_MAIL"),
+            security_passwd_salt=raw("SECURITY_PASSWD_SALT"),
+            nonce_ttl=timedelta(minutes=number("NONCE_TTL_MINUTES")),
+            aes_secret_key=aes_secret_key,
+            aes_key_rotation_grace=timedelta(seconds=number("AES_KEY_ROTATION_GRACE_SECONDS")),
+            dominio=raw("DOMINIO"),
+            email_server=raw("EMAIL_SERVER"),
+            email_port=number("EMAIL_PORT"),
+            email_user=raw("EMAIL_USER"),
+            email_passwd=raw("EMAIL_PASSWD"),
+            internal_allowed_ips=frozenset(
+                ip.strip() for ip in raw("INTERNAL_ALLOWED_IPS").split(",") if ip.strip()
+            ),
+            profile_sample_rate=number("PROFILE_SAMPLE_RATE", float),
+            profile_interval=number("PROFILE_INTERVAL_MS", float) / 1000,
+            profile_dir=Path(raw("PROFILE_DIR")),
+            profile_max_files=number("PROFILE_MAX_FILES"),
+            compression_min_size=number("COMPRESSION_MIN_SIZE"),
+            max_decompressed_bytes=number("MAX_DECOMPRESSED_BYTES"),
+            gzip_level=number("GZIP_LEVEL"),
+            zstd_level=number("ZSTD_LEVEL"),
+            zstd_dict_path=raw("ZSTD_DICT_PATH"),
+            raw_payload_storage=raw("RAW_PAYLOAD_STORAGE").lower(),
+            rate_limits=raw("RATE_LIMITS"),
+            rate_limit_store=raw("RATE_LIMIT_STORE").lower(),
+            rate_limit_db_path=raw("RATE_LIMIT_DB_PATH"),
+            cache_backend=raw("CACHE_BACKEND").lower(),
+            cache_db_path=raw("CACHE_DB_PATH"),
+            cache_max_entries=number("CACHE_MAX_ENTRIES"),
+            cache_ttl=number("CACHE_TTL_SECONDS", float),
+            ws_ack_batch_size=number("WS_ACK_BATCH_SIZE"),
+            ws_ack_interval=number("WS_ACK_INTERVAL_MS") / 1000,
+            ws_auth_timeout=number("WS_AUTH_TIMEOUT_SECONDS", float),
+            live_history_size=number("LIVE_HISTORY_SIZE"),
+            live_subscriber_buffer=number("LIVE_SUBSCRIBER_BUFFER"),
+            live_poll_interval=number("LIVE_POLL_INTERVAL_MS") / 1000,
+            fleet_stale=timedelta(seconds=number("FLEET_STALE_SECONDS")),
+            alert_webhook_url=raw("ALERT_WEBHOOK_URL"),
+            alert_dispatch_interval=number("ALERT_DISPATCH_INTERVAL_SECONDS"),
+            sketch_bucket_seconds=number("SKETCH_BUCKET_SECONDS"),
+            metrics_partition_dir=raw("METRICS_PARTITION_DIR"),
+            metrics_retention_months=number("METRICS_RETENTION_MONTHS"),
+            audit_buffer_size=number("AUDIT_BUFFER_SIZE"),
+            audit_flush_interval=number("AUDIT_FLUSH_MS") / 1000,
+            threadpool_size=threadpool_size,
+            concurrency_limits=raw("CONCURRENCY_LIMITS"),
+            load_shed_target=number("LOAD_SHED_TARGET_MS") / 1000,
+            load_shed_interval=number("LOAD_SHED_INTERVAL_MS") / 1000,
+        )
+
+
+def _check_jwt_key(path: str, pem: bytes, algorithm: str):
+    """ValueError si el PEM no es una llave Ed25519 (EdDSA) o P-256 (ES256)"""
+    try:
+        if b"PRIVATE KEY" in pem:
+            public = load_pem_private_key(pem, password=None).public_key()
+        else:
+            public = load_pem_public_key(pem)
+    except (ValueError, TypeError) as exc:
+        raise ValueError(f"JWT_KEYS: {path} no es una llave PEM válida: {exc}") from None
+    if algorithm == "EdDSA":
+        valid = isinstance(public, ed25519.Ed25519PublicKey)
+    else:
+        valid = isinstance(public, ec.EllipticCurvePublicKey) and isinstance(public.curve, ec.SECP256R1)
+    if not valid:
+        raise ValueError(f"JWT_KEYS: {path} no es compatible con {algorithm}")
+
+
+# Se fijan al arrancar: stores, paths y estructuras ya creadas con ese tamaño
+RESTART_FIELDS = (
+    "admin", "name", "aes_secret_key", "profile_dir", "zstd_dict_path",
+    "raw_payload_storage", "rate_limit_store", "rate_limit_db_path",
+    "cache_backend", "cache_db_path", "cache_max_entries", "cache_ttl",
+    "live_history_size", "alert_dispatch_interval", "sketch_bucket_seconds",
+    "metrics_partition_dir", "audit_buffer_size", "threadpool_size",
+)
+
+# Cada cuánto el scheduler revisa si cambió el .env
+CONFIG_WATCH_SECONDS = 5
+
+_config = Config.from_settings(settings)
+_reload_lock = threading.Lock()
+_listeners: list[Callable[[Config, Config], None]] = []
+
+
+def get_config() -> Config:
+    """Snapshot vigente (leerlo una vez por operación y usar sus campos)"""
+    return _config
+
+
+def on_reload(callback: Callable[[Config, Config], None]):
+    """Registra callback(anterior, nuevo); se llama después de publicar el snapshot"""
+    _listeners.append(callback)
+    return callback
+
+
+# ----------------------------------------------------------------------
+# Recarga atómica: se arma el snapshot completo y se publica de una vez
+def reload_config() -> bool:
+    """Relee entorno y .env; retorna True si el snapshot cambió"""
+    global _config
+    with _reload_lock:
+        current = _config
+        try:
+            fresh = Config.from_settings(Settings(), current.version + 1)
+        except (ValidationError, ValueError) as exc:
+            print(f"Configuración inválida, se conserva la vigente: {exc}", file=sys.stderr)
+            return False
+
+        pending = [name for name in RESTART_FIELDS if getattr(fresh, name) != getattr(current, name)]
+        if pending:
+            print(f"Se aplican al reiniciar: {', '.join(pending)}", file=sys.stderr)
+        fresh = replace(fresh, **{name: getattr(current, name) for name in RESTART_FIELDS})
+
+        if all(
+            getattr(fresh, field.name) == getattr(current, field.name)
+            for field in fields(Config)
+            if field.name != "version"
+        ):
+            return False
+        _config = fresh
+
+    for callback in _listeners:
+        try:
+            callback(current, fresh)
+        except Exception as exc:
+            print(f"Error aplicando la configuración: {exc}", file=sys.stderr)
+    return True
+
+
+# ----------------------------------------------------------------------
+# Disparadores: SIGHUP y cambios del .env (job del scheduler)
+def _env_file_mtime() -> float:
+    try:
+        return os.stat(Settings.model_config["env_file"]).st_mtime
+    except (FileNotFoundError, TypeError):
+        return 0.0
+
+
+_env_mtime = _env_file_mtime()
+
+
+def watch_config_file():
+    """Recarga si el .env cambió desde la última revisión"""
+    global _env_mtime
+    mtime = _env_file_mtime()
+    if mtime != _env_mtime:
+        _env_mtime = mtime
+        reload_config()
+
+
+def install_reload_signal():
+    """SIGHUP recarga la configuración (en un hilo: el handler no debe bloquear)"""
+    if not hasattr(signal, "SIGHUP") or threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(
+        signal.SIGHUP,
+        lambda signum, frame: threading.Thread(target=reload_config, daemon=True).start(),
+    )
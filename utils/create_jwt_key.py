@@ -0,0 +1,47 @@
+""" Genera una llave de firma de JWT (PEM) para ALGORITHM=EdDSA o ES256
+
+Escribe la llave privada (0600) y su pública; agregar la privada a JWT_KEYS.
+Para rotar: poner la nueva primera y dejar la anterior (o solo su pública)
+mientras vivan los tokens que firmó.
+
+Uso (desde la raíz del repo):
+    python -m utils.create_jwt_key --algorithm EdDSA --out jwt_ed25519.pem
+"""
+import argparse
+import os
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera una llave PEM para firmar JWT")
+    parser.add_argument("--algorithm", choices=("EdDSA", "ES256"), default="EdDSA")
+    parser.add_argument("--out", required=True, help="Archivo de la llave privada")
+    args = parser.parse_args()
+
+    if args.algorithm == "EdDSA":
+        private = ed25519.Ed25519PrivateKey.generate()
+    else:
+        private = ec.generate_private_key(ec.SECP256R1())
+
+    private_pem = private.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public_pem = private.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    fd = os.open(args.out, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(private_pem)
+    public_path = f"{os.path.splitext(args.out)[0]}.pub.pem"
+    with open(public_path, "wb") as file:
+        file.write(public_pem)
+    print(f"Privada: {args.out}\nPública: {public_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,121 @@
 import os
 import base64
-import json
+import time
+from dataclasses import dataclass
+from datetime import UTC
 
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from fastapi import Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import Annotated
 
-from .config import settings
+from .cache import local_cache
+from .config import get_config
 from .database import get_db
+from .envelope import Envelope, decode_document
+from .stats import stage_timer
 from models.security import AESKey
+from schemas.metrics import AgentDocument
 
-AES_SECRET_KEY = settings.AES_SECRET_KEY.get_secret_value()
+# Llave maestra: decodificada y validada (32 bytes) al cargar la configuración.
+# Envuelve las llaves AES guardadas en aes_keys (AES-GCM, AAD = key_id)
+AES_SECRET_KEY = get_config().aes_secret_key
+_master = AESGCM(AES_SECRET_KEY)
 
-if not AES_SECRET_KEY:
-    raise RuntimeError("AES_SECRET_KEY not configured")
+WRAPPED_PREFIX = "w1:"
 
-AES_SECRET_KEY = base64.b64decode(AES_SECRET_KEY)
 
-if len(AES_SECRET_KEY) != 32:
-    raise RuntimeError("AES_SECRET_KEY must be 32 bytes")
+# ----------------------------------------------------------------------
+# Envoltura de llaves con la llave maestra
+def wrap_key(key_id: str, key: bytes) -> str:
+    """Cifra la llave para guardarla en AESKey.key_value"""
+    nonce = os.urandom(12)
+    wrapped = _master.encrypt(nonce, key, key_id.encode())
+    return WRAPPED_PREFIX + base64.b64encode(nonce + wrapped).decode()
+
+
+def unwrap_key(key_id: str, key_value: str) -> bytes:
+    """Descifra AESKey.key_value (acepta base64 plano de las filas legacy)"""
+    if not key_value.startswith(WRAPPED_PREFIX):
+        return base64.b64decode(key_value)
+    data = base64.b64decode(key_value[len(WRAPPED_PREFIX):])
+    return _master.decrypt(data[:12], data[12:], key_id.encode())
+
+
+# ----------------------------------------------------------------------
+# Llaves AES activas, ya desenvueltas e instanciadas (solo en el cache local
+# de cada worker): la ingesta no descifra la llave en cada request
+@dataclass(frozen=True, slots=True)
+class LoadedKey:
+    aesgcm: AESGCM
+    client_id: int | None
+    # Epoch de corte para descifrar (llave rotada); None = sin corte
+    decrypt_until: float | None
+
+    def usable_by(self, client_id: int | None) -> bool:
+        if self.client_id is not None and self.client_id != client_id:
+            return False
+        return self.decrypt_until is None or time.time() < self.decrypt_until
+
+
+def aes_key_cache_key(key_id: str) -> str:
+    return f"aes_key:{key_id}"
+
+
+def invalidate_aes_key(key_id: str):
+    """Descarta la llave cacheada (en todos los workers)"""
+    local_cache.invalidate(aes_key_cache_key(key_id))
+
+
+def _load_aes_key(db: Session, key_id: str) -> LoadedKey | None:
+    aes_key = db.query(AESKey).filter(
+        AESKey.key_id == key_id,
+        AESKey.is_active == True,
+    ).first()
+    if aes_key is None:
+        return None
+    decrypt_until = aes_key.decrypt_until
+    if decrypt_until is not None and decrypt_until.tzinfo is None:
+        # SQLite no guarda la zona horaria: se guardó en UTC
+        decrypt_until = decrypt_until.replace(tzinfo=UTC)
+    return LoadedKey(
+        aesgcm=AESGCM(unwrap_key(aes_key.key_id, aes_key.key_value)),
+        client_id=aes_key.client_id,
+        decrypt_until=decrypt_until.timestamp() if decrypt_until else None,
+    )
+
 
 def decrypt_payload(
-        encrypted_payload: dict,
+        envelope: Envelope,
         db: Annotated[Session, Depends(get_db)],
-    ) -> dict:
+        client_id: int | None = None,
+    ) -> AgentDocument:
+    """Descifra con la llave del sobre; las llaves por cliente solo valen para su cliente"""
     try:
-        key_id = encrypted_payload["key_id"]
-
-        aes_key = db.query(AESKey).filter(
-            AESKey.key_id == key_id,
-            AESKey.is_active == True,
-        ).first()
+        with stage_timer("aes_key_lookup"):
+            key = local_cache.get_or_set(
+                aes_key_cache_key(envelope.key_id),
+                lambda: _load_aes_key(db, envelope.key_id),
+            )
 
-        if not aes_key:
+        if key is None or not key.usable_by(client_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid key_id",
             )
 
-        secret_key = base64.b64decode(aes_key.key_value)
-
-        nonce = base64.b64decode(encrypted_payload["nonce"])
-        ciphertext = base64.b64decode(encrypted_payload["ciphertext"])
-
-        aesgcm = AESGCM(secret_key)
-
-        plaintext = aesgcm.decrypt(
-            nonce,
-            ciphertext,
-            None,  # associated_data opcional
-        )
+        with stage_timer("aes_decrypt"):
+            plaintext = key.aesgcm.decrypt(
+                envelope.nonce,
+                envelope.ciphertext,
+                None,  # associated_data opcional
+            )
 
-        return json.loads(plaintext.decode("utf-8"))
+        with stage_timer("document_validate"):
+            return decode_document(envelope, plaintext)
 
+    except HTTPException:
+        raise
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
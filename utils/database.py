@@ -1,12 +1,23 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import DeclarativeBase, sessionmaker
+import threading
+from time import perf_counter
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
+from starlette.requests import HTTPConnection
+
+from .stats import register_gauge, stage_histogram
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///utils/template.db"
 
+# Esquema placeholder de la tabla metrics particionada (utils/partitions.py).
+# Por defecto se traduce a la tabla original de main.
+PARTITION_SCHEMA = "metrics_partition"
+
 # Engine Connection
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
+    execution_options={"schema_translate_map": {PARTITION_SCHEMA: None}},
 )
 
 # Sesiones de acceso a la DB
@@ -17,9 +28,106 @@ class Base(DeclarativeBase):
     pass
 
 
-def get_db():
-    with SessionLocal() as db:
-        try:
-            yield db
-        finally:
-            db.close()
\ No newline at end of file
+# ----------------------------------------------------------------------
+# Sesión perezosa por request
+# - La Session se crea recién al primer uso: requests resueltos desde cache o
+#   rechazados en la validación no la crean ni tocan el pool.
+# - TimedRoute la libera (close: la conexión vuelve al pool) apenas el
+#   handler arma la respuesta, antes de enviarla. Si algo la usa después
+#   (ej: un StreamingResponse), vuelve a tomar una conexión.
+# - Cuenta las queries ejecutadas con sus conexiones (gauge db_sessions) y el
+#   tiempo que retuvo cada conexión (stage db_connection_hold).
+_session_stats = {"requests": 0, "opened": 0, "queries": 0, "max_queries": 0}
+_stats_lock = threading.Lock()
+_connection_hold = stage_histogram("db_connection_hold")
+
+
+class LazySession:
+    """Proxy de Session (mismos métodos); se crea al primer atributo usado"""
+
+    __slots__ = ("_session", "queries", "checked_out_at")
+
+    def __init__(self):
+        self._session = None
+        self.queries = 0
+        self.checked_out_at = None
+
+    @property
+    def session(self) -> Session:
+        if self._session is None:
+            self._session = SessionLocal(info={"lazy": self})
+        return self._session
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def release(self):
+        """Devuelve la conexión al pool (descarta lo no confirmado, como close())"""
+        if self._session is None:
+            return
+        self._session.close()
+
+
+@event.listens_for(Session, "after_begin")
+def _lazy_after_begin(session, transaction, connection):
+    lazy = session.info.get("lazy")
+    if lazy is not None:
+        connection.info["lazy_session"] = lazy
+        lazy.checked_out_at = perf_counter()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _lazy_after_transaction_end(session, transaction):
+    # Fin de la transacción raíz (commit, rollback o close): la conexión volvió al pool
+    lazy = session.info.get("lazy")
+    if lazy is not None and transaction.parent is None and lazy.checked_out_at is not None:
+        _connection_hold.observe(perf_counter() - lazy.checked_out_at)
+        lazy.checked_out_at = None
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    lazy = conn.info.get("lazy_session")
+    if lazy is not None:
+        lazy.queries += 1
+
+
+@event.listens_for(engine.pool, "checkin")
+def _forget_lazy_session(dbapi_connection, connection_record):
+    # info vive con la conexión del pool: no atribuir queries al request anterior
+    connection_record.info.pop("lazy_session", None)
+
+
+register_gauge(
+    "db_sessions",
+    "Requests con dependencia de DB, sesiones abiertas y queries (max: por request)",
+    lambda: _session_stats.copy(),
+)
+
+
+def get_db(connection: HTTPConnection):
+    db = LazySession()
+    # TimedRoute la libera al terminar el handler
+    connection.state.db = db
+    try:
+        yield db
+    finally:
+        db.release()
+        with _stats_lock:
+            _session_stats["requests"] += 1
+            if db.opened:
+                _session_stats["opened"] += 1
+                _session_stats["queries"] += db.queries
+                if db.queries > _session_stats["max_queries"]:
+                    _session_stats["max_queries"] = db.queries
+
+
+def release_request_db(connection: HTTPConnection):
+    """Libera la sesión del request (si get_db se resolvió y llegó a usarse)"""
+    db = getattr(connection.state, "db", None)
+    if db is not None:
+        db.release()
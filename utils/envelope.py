@@ -0,0 +1,139 @@
+""" Sobres cifrados de los agentes: JSON+base64 (legacy) o MessagePack binario """
+from __future__ import annotations
+
+import base64
+import binascii
+from dataclasses import dataclass
+
+import msgpack
+from fastapi import HTTPException, Request, status
+from pydantic import ValidationError
+
+from schemas.metrics import AgentDocument
+
+from .compression import decompress
+from .fastjson import loads
+from .stats import stage_timer
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = {
+    "application/msgpack",
+    "application/x-msgpack",
+    "application/vnd.msgpack",
+}
+
+
+# ----------------------------------------------------------------------
+# Sobre ya decodificado: nonce y ciphertext siempre como bytes crudos
+@dataclass(slots=True)
+class Envelope:
+    key_id: str
+    nonce: bytes
+    ciphertext: bytes
+    # Formato del documento cifrado: "json" o "msgpack"
+    plaintext_format: str = "json"
+    # Compresión del plaintext antes de cifrar: None, "gzip" o "zstd"
+    compression: str | None = None
+
+    @property
+    def nonce_key(self) -> str:
+        """Forma canónica (base64) del nonce para la tabla used_nonces"""
+        return base64.b64encode(self.nonce).decode()
+
+
+def _invalid(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+# ----------------------------------------------------------------------
+# Parsea el cuerpo según Content-Type (sin header se asume JSON)
+def parse_envelope(body: bytes, content_type: str | None) -> Envelope:
+    media_type = (content_type or JSON_MEDIA_TYPE).split(";", 1)[0].strip().lower()
+
+    if media_type in MSGPACK_MEDIA_TYPES:
+        try:
+            data = msgpack.unpackb(body, raw=False)
+        except (ValueError, msgpack.UnpackException):
+            raise _invalid("Invalid encrypted payload")
+        is_binary = True
+    elif media_type == JSON_MEDIA_TYPE or media_type.endswith("+json"):
+        try:
+            data = loads(body)
+        except ValueError:
+            raise _invalid("Invalid encrypted payload")
+        is_binary = False
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Content-Type no soportado",
+        )
+
+    return envelope_from_dict(data, is_binary)
+
+
+# ----------------------------------------------------------------------
+# Valida los campos del sobre ya decodificado (HTTP y frames WebSocket)
+def envelope_from_dict(data, is_binary: bool) -> Envelope:
+    if not isinstance(data, dict):
+        raise _invalid("Invalid encrypted payload")
+    if not data.get("nonce"):
+        raise _invalid("Nonce missing")
+
+    key_id = data.get("key_id")
+    nonce = data.get("nonce")
+    ciphertext = data.get("ciphertext")
+    if not isinstance(key_id, str) or not ciphertext:
+        raise _invalid("Invalid encrypted payload")
+    # Comprimir el plaintext (antes de cifrar) es lo que reduce el tamaño:
+    # el ciphertext ya no es comprimible
+    compression = data.get("compression")
+    if compression not in (None, "gzip", "zstd"):
+        raise _invalid("Invalid encrypted payload")
+
+    if is_binary:
+        # Formato binario: bytes crudos, sin base64
+        if not isinstance(nonce, bytes) or not isinstance(ciphertext, bytes):
+            raise _invalid("Invalid encrypted payload")
+        # El plaintext es MessagePack salvo que el agente indique JSON
+        plaintext_format = data.get("format", "msgpack")
+        if plaintext_format not in ("json", "msgpack"):
+            raise _invalid("Invalid encrypted payload")
+        return Envelope(key_id, nonce, ciphertext, plaintext_format, compression)
+
+    # Decodificación permisiva como en el formato legacy: los agentes pueden
+    # enviar base64 con saltos de línea o espacios (se descartan)
+    try:
+        return Envelope(
+            key_id,
+            base64.b64decode(nonce),
+            base64.b64decode(ciphertext),
+            compression=compression,
+        )
+    except (TypeError, binascii.Error):
+        raise _invalid("Invalid encrypted payload")
+
+
+# ----------------------------------------------------------------------
+# Dependencia: lee el cuerpo crudo y negocia el formato del sobre
+async def read_envelope(request: Request) -> Envelope:
+    body = await request.body()
+    with stage_timer("envelope_parse"):
+        return parse_envelope(body, request.headers.get("content-type"))
+
+
+# ----------------------------------------------------------------------
+# Decodifica y valida el documento descifrado en una sola pasada
+def decode_document(envelope: Envelope, plaintext: bytes) -> AgentDocument:
+    if envelope.compression is not None:
+        # zstd admite el diccionario entrenado para payloads por host
+        plaintext = decompress(plaintext, envelope.compression)
+    try:
+        if envelope.plaintext_format == "msgpack":
+            return AgentDocument.model_validate(msgpack.unpackb(plaintext, raw=False))
+        # JSON: pydantic parsea y valida los bytes directamente (sin dict
+        # intermedio); los bytes quedan para raw_payload
+        document = AgentDocument.model_validate_json(plaintext)
+        document._source_json = plaintext
+        return document
+    except ValidationError:
+        raise _invalid("Invalid metrics structure")
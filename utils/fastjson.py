@@ -0,0 +1,72 @@
+""" Capa de JSON rápido (orjson) para respuestas, payloads y columnas """
+from __future__ import annotations
+
+from functools import cache
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy.types import Text, TypeDecorator
+
+# Decodifica bytes o str directamente (valida UTF-8 sin un .decode() previo)
+loads = orjson.loads
+# JSON ya serializado que dumps() copia tal cual (ej: plaintext del agente)
+raw_json = orjson.Fragment
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+
+# ----------------------------------------------------------------------
+# Respuesta por defecto de la app: orjson en vez de json.dumps
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.__pydantic_serializer__.to_json(content)
+        return dumps(content)
+
+
+# ----------------------------------------------------------------------
+# Modelos Pydantic -> bytes, sin pasar por un dict intermedio
+@cache
+def _adapter(annotation) -> TypeAdapter:
+    return TypeAdapter(annotation)
+
+
+def model_response(
+    value: Any,
+    annotation: Any = None,
+    status_code: int = 200,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """Serializa `value` (modelo, ORM o lista) según `annotation` a bytes JSON"""
+    if annotation is None and isinstance(value, BaseModel):
+        body = value.__pydantic_serializer__.to_json(value)
+    else:
+        adapter = _adapter(annotation)
+        body = adapter.dump_json(adapter.validate_python(value, from_attributes=True))
+    return Response(
+        content=body,
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json",
+    )
+
+
+# ----------------------------------------------------------------------
+# Columna JSON serializada con orjson (compatible con filas JSON previas)
+class FastJSON(TypeDecorator):
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return dumps(value).decode("utf-8")
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return loads(value)
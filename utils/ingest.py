@@ -0,0 +1,212 @@
+""" Persistencia de muestras de los agentes (HTTP y canal WebSocket) """
+from __future__ import annotations
+
+import sys
+from datetime import UTC, datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.metrics import ClientLatest, ServerMetrics
+from models.security import UsedNonce
+from schemas.metrics import AgentDocument
+from .alerts import evaluate_alerts
+from .audit import audit_log
+from .crypto import decrypt_payload
+from .database import SessionLocal
+from .envelope import Envelope
+from .live import LiveSample, live_hub
+from .partitions import insert_samples, is_retained, prepare
+from .payload_store import store_payload
+from .sketches import update_sketches
+from .stats import stage_timer
+
+
+def replay_error(client_id: int, nonce: str) -> HTTPException:
+    """Registra el rechazo en la auditoría y retorna el 409"""
+    audit_log.record("replay_rejected", f"client:{client_id}", detail={"nonce": nonce})
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Replay attack detected",
+    )
+
+
+def duplicate_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Duplicate metrics timestamp",
+    )
+
+
+def expired_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Metrics timestamp outside retention period",
+    )
+
+
+# Columnas de uq_client_srvtime (SQLite informa columnas, no el nombre)
+DUPLICATE_SAMPLE_COLUMNS = {"client_id", "server_timestamp"}
+
+
+def is_duplicate_sample(exc: IntegrityError) -> bool:
+    """True solo si el conflicto es la muestra repetida (client_id, server_timestamp)"""
+    orig = exc.orig
+    if getattr(orig, "sqlite_errorname", None) != "SQLITE_CONSTRAINT_UNIQUE":
+        return False
+    _, _, failed = str(orig).partition("UNIQUE constraint failed:")
+    # "metrics.client_id, metrics.server_timestamp"
+    columns = {column.strip().rpartition(".")[2] for column in failed.split(",")}
+    return columns == DUPLICATE_SAMPLE_COLUMNS
+
+
+def commit_error(client_id: int, exc: IntegrityError) -> HTTPException:
+    """409 para el timestamp repetido; cualquier otro conflicto es un error del servidor"""
+    if is_duplicate_sample(exc):
+        return duplicate_error()
+    # Ej: id repetido en la partición (secuencia o archivo de partición desfasados)
+    print(f"Error guardando métricas del cliente {client_id}: {exc.orig}", file=sys.stderr)
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail="Error storing metrics",
+    )
+
+
+# ----------------------------------------------------------------------
+# Fila de ServerMetrics a partir del documento ya validado (se inserta con
+# insert_samples(): sin flush del ORM no se aplican los defaults)
+def build_sample(db: Session, client_id: int, document: AgentDocument) -> ServerMetrics:
+    system = document.system
+    return ServerMetrics(
+        client_id=client_id,
+        hostname=system.hostname,
+        server_timestamp=system.timestamp,
+        cpu_percent=document.cpu.cpu_percent,
+        memory_percent=document.memory.percent,
+        disk_percent=document.disk.percent,
+        raw_payload=store_payload(db, client_id, document),
+        created_at=datetime.now(UTC),
+    )
+
+
+# ----------------------------------------------------------------------
+# Upsert de la última muestra del cliente (después del insert: usa el id).
+# Una muestra atrasada (timestamp anterior al guardado) no la reemplaza.
+def upsert_latest(db: Session, sample: ServerMetrics):
+    values = {
+        "client_id": sample.client_id,
+        "metrics_id": sample.id,
+        "hostname": sample.hostname,
+        "server_timestamp": sample.server_timestamp,
+        "cpu_percent": sample.cpu_percent,
+        "memory_percent": sample.memory_percent,
+        "disk_percent": sample.disk_percent,
+        "received_at": sample.created_at,
+    }
+    statement = insert(ClientLatest).values(values)
+    with stage_timer("latest_upsert"):
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[ClientLatest.client_id],
+                set_={
+                    column: statement.excluded[column]
+                    for column in values
+                    if column != "client_id"
+                },
+                where=ClientLatest.server_timestamp <= statement.excluded.server_timestamp,
+            )
+        )
+
+
+# ----------------------------------------------------------------------
+# Inserta muestras ya construidas con todo lo que depende de ellas y confirma.
+# La IntegrityError del commit queda para el caller (commit_error / reintento).
+def store_samples(db: Session, client_id: int, samples: list[ServerMetrics]):
+    with stage_timer("metrics_commit"):
+        insert_samples(db, samples)
+        live_samples = [LiveSample.from_model(sample) for sample in samples]
+        # Un solo upsert por lote: la muestra más reciente
+        upsert_latest(db, max(samples, key=lambda sample: sample.server_timestamp))
+        evaluate_alerts(db, client_id, samples)
+        update_sketches(db, client_id, samples)
+        db.commit()
+    # 📡 Fan-out en vivo después del commit (no bloquea: solo encola)
+    live_hub.publish(live_samples)
+
+
+# ----------------------------------------------------------------------
+# Guarda un lote de sobres de un cliente en una sola transacción.
+# Retorna, por sobre, None si se guardó o la HTTPException que lo rechazó.
+def ingest_batch(client_id: int, envelopes: list[Envelope]) -> list[HTTPException | None]:
+    results: list[HTTPException | None] = [None] * len(envelopes)
+
+    with SessionLocal() as db:
+        # Descifrar y validar antes de consumir cualquier nonce
+        accepted: list[tuple[int, Envelope, AgentDocument]] = []
+        for index, envelope in enumerate(envelopes):
+            try:
+                document = decrypt_payload(envelope, db, client_id)
+            except HTTPException as exc:
+                results[index] = exc
+                continue
+            if not is_retained(document.system.timestamp):
+                results[index] = expired_error()
+                continue
+            accepted.append((index, envelope, document))
+
+        # Particiones del lote: se adjuntan antes de la primera escritura
+        prepare(db, [document.system.timestamp for _, _, document in accepted])
+
+        # Anti-Replay del lote completo con una sola consulta
+        nonces = [envelope.nonce_key for _, envelope, _ in accepted]
+        with stage_timer("nonce_check"):
+            used = set(db.scalars(
+                select(UsedNonce.nonce).where(
+                    UsedNonce.client_id == client_id,
+                    UsedNonce.nonce.in_(nonces),
+                )
+            )) if nonces else set()
+
+        pending = []
+        samples: list[ServerMetrics] = []
+        for index, envelope, document in accepted:
+            if envelope.nonce_key in used:
+                results[index] = replay_error(client_id, envelope.nonce_key)
+                continue
+            used.add(envelope.nonce_key)
+            pending.append((index, envelope, document))
+            db.add(UsedNonce(client_id=client_id, nonce=envelope.nonce_key))
+            samples.append(build_sample(db, client_id, document))
+
+        if not pending:
+            return results
+
+        try:
+            db.flush()
+            store_samples(db, client_id, samples)
+            return results
+        except IntegrityError:
+            db.rollback()
+
+        # Conflicto con otra conexión del mismo cliente (o timestamp repetido):
+        # se reintenta muestra por muestra para atribuir cada error
+        for index, envelope, document in pending:
+            # El rollback libera la conexión: la siguiente puede no tener la partición
+            prepare(db, [document.system.timestamp])
+            try:
+                db.add(UsedNonce(client_id=client_id, nonce=envelope.nonce_key))
+                db.flush()
+            except IntegrityError:
+                db.rollback()
+                results[index] = replay_error(client_id, envelope.nonce_key)
+                continue
+            try:
+                store_samples(db, client_id, [build_sample(db, client_id, document)])
+            except IntegrityError as exc:
+                db.rollback()
+                results[index] = commit_error(client_id, exc)
+
+    return results
@@ -0,0 +1,232 @@
+""" Canal WebSocket de ingesta (/api/v1/metrics/ws)
+
+Protocolo:
+  1. Autenticación una sola vez: header `Authorization: Bearer <token>` en el
+     handshake o, como primer frame, {"type": "auth", "token": "<token>"}.
+     El servidor responde {"type": "ready", "expires_at": <epoch>}.
+  2. Cada frame siguiente es un sobre cifrado, igual que en POST /metrics:
+     texto = JSON (base64), binario = MessagePack (bytes crudos). Los frames
+     se numeran implícitamente desde 1 (seq).
+  3. Acks por lote: {"type": "ack", "upto": N, "errors": [...]} confirma
+     todos los frames hasta N; los listados en errors ({"seq", "status",
+     "detail"}) no se guardaron. Nonces y anti-Replay igual que en HTTP.
+  4. Al expirar el token el servidor envía {"type": "reauth"} y rechaza las
+     muestras (401) hasta recibir un nuevo {"type": "auth"} del mismo cliente.
+
+Las respuestas usan el formato (JSON o MessagePack) del último frame recibido.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import msgpack
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
+from starlette.concurrency import run_in_threadpool
+
+from .auth import decode_client_token, lookup_client
+from .config import get_config
+from .database import SessionLocal
+from .envelope import Envelope, envelope_from_dict
+from .fastjson import dumps, loads
+from .ingest import ingest_batch
+from .ratelimit import rate_limiter, split_scopes
+from .stats import register_gauge, stage_timer
+
+_open_streams = 0
+register_gauge(
+    "ingest_websocket_connections",
+    "Conexiones WebSocket de ingesta abiertas",
+    lambda: _open_streams,
+)
+
+
+class _AuthError(Exception):
+    pass
+
+
+# ----------------------------------------------------------------------
+# Estado de una conexión: cliente autenticado, lote pendiente y errores
+class IngestStream:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        # Tamaños y tiempos fijos durante la conexión (las nuevas toman la recarga)
+        self.config = get_config()
+        self.client_id: str | None = None
+        self.client_pk: int | None = None
+        self.limit = None
+        self.expires_at = 0.0
+        self.reauth_sent = False
+        self.binary = False
+        self.seq = 0
+        self.acked = 0
+        self.batch: list[tuple[int, Envelope]] = []
+        self.errors: list[dict] = []
+        self.deadline: float | None = None
+
+    async def run(self):
+        global _open_streams
+        await self.websocket.accept()
+        _open_streams += 1
+        try:
+            await self._serve()
+        except WebSocketDisconnect:
+            # Lo ya recibido se guarda aunque no se pueda confirmar: el agente
+            # lo reenviará y recibirá 409 (ya existe)
+            await self._store_batch()
+        except _AuthError as exc:
+            await self.websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(exc))
+        finally:
+            _open_streams -= 1
+
+    # ------------------------------------------------------------------
+    async def _serve(self):
+        scheme, _, token = self.websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            await self._authenticate(token)
+        else:
+            try:
+                message = await asyncio.wait_for(self.websocket.receive(), self.config.ws_auth_timeout)
+            except asyncio.TimeoutError:
+                raise _AuthError("Autenticación requerida")
+            frame = self._decode(message)
+            if not isinstance(frame, dict) or frame.get("type") != "auth":
+                raise _AuthError("Autenticación requerida")
+            await self._authenticate(frame.get("token"))
+
+        while True:
+            timeout = None
+            if self.deadline is not None:
+                timeout = max(0.0, self.deadline - time.monotonic())
+            try:
+                message = await asyncio.wait_for(self.websocket.receive(), timeout)
+            except asyncio.TimeoutError:
+                await self._flush()
+                continue
+
+            frame = self._decode(message)
+            if isinstance(frame, dict) and "type" in frame:
+                await self._control(frame)
+                continue
+
+            self.seq += 1
+            await self._sample(self.seq, frame)
+            if self.deadline is None and (self.batch or self.errors):
+                self.deadline = time.monotonic() + self.config.ws_ack_interval
+            if len(self.batch) >= self.config.ws_ack_batch_size:
+                await self._flush()
+
+    def _decode(self, message: dict):
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+        data = message.get("bytes")
+        self.binary = data is not None
+        try:
+            if self.binary:
+                if len(data) > self.config.max_decompressed_bytes:
+                    return None
+                return msgpack.unpackb(data, raw=False)
+            text = message.get("text") or ""
+            if len(text) > self.config.max_decompressed_bytes:
+                return None
+            return loads(text)
+        except (ValueError, msgpack.UnpackException):
+            return None
+
+    async def _control(self, frame: dict):
+        if frame["type"] == "auth":
+            # Lo recibido con el token anterior se guarda y confirma primero
+            await self._flush()
+            await self._authenticate(frame.get("token"))
+        elif frame["type"] == "ping":
+            await self._send({"type": "pong"})
+        else:
+            await self._send({"type": "error", "detail": "Tipo de mensaje desconocido"})
+
+    # ------------------------------------------------------------------
+    # Autenticación (inicial o renovación del token)
+    async def _authenticate(self, token):
+        if not isinstance(token, str) or not token:
+            raise _AuthError("Token requerido")
+        try:
+            claims = decode_client_token(token)
+        except HTTPException as exc:
+            raise _AuthError(exc.detail)
+
+        if self.client_id is not None and claims["sub"] != self.client_id:
+            raise _AuthError("El token pertenece a otro cliente")
+
+        client = await run_in_threadpool(_lookup_client, claims["sub"])
+        if client is None:
+            raise _AuthError("Credenciales de autenticación inválidas.")
+        if client.role != "agent":
+            raise _AuthError("Permiso Denegado")
+
+        self.client_id = client.client_id
+        self.client_pk = client.id
+        self.limit = rate_limiter.client_limit(claims.get("role"), split_scopes(claims.get("scope")))
+        self.expires_at = float(claims["exp"])
+        self.reauth_sent = False
+        await self._send({"type": "ready", "expires_at": int(self.expires_at)})
+
+    # ------------------------------------------------------------------
+    # Una muestra: se valida el sobre y se agrega al lote (o a los errores)
+    async def _sample(self, seq: int, frame):
+        if time.time() >= self.expires_at:
+            self._error(seq, status.HTTP_401_UNAUTHORIZED, "Token expirado")
+            if not self.reauth_sent:
+                self.reauth_sent = True
+                await self._send({"type": "reauth"})
+            return
+
+        retry_after = rate_limiter.check(f"client:{self.client_id}", self.limit)
+        if retry_after:
+            self._error(seq, status.HTTP_429_TOO_MANY_REQUESTS, "Too Many Requests")
+            self.errors[-1]["retry_after"] = retry_after
+            return
+
+        if frame is None:
+            self._error(seq, status.HTTP_400_BAD_REQUEST, "Invalid encrypted payload")
+            return
+        try:
+            self.batch.append((seq, envelope_from_dict(frame, self.binary)))
+        except HTTPException as exc:
+            self._error(seq, exc.status_code, exc.detail)
+
+    def _error(self, seq: int, status_code: int, detail: str):
+        self.errors.append({"seq": seq, "status": status_code, "detail": detail})
+
+    # ------------------------------------------------------------------
+    # Guarda el lote pendiente y confirma todo lo recibido hasta ahora
+    async def _store_batch(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        with stage_timer("ws_batch_ingest"):
+            results = await run_in_threadpool(
+                ingest_batch, self.client_pk, [envelope for _, envelope in batch]
+            )
+        for (seq, _), exc in zip(batch, results):
+            if exc is not None:
+                self._error(seq, exc.status_code, exc.detail)
+
+    async def _flush(self):
+        self.deadline = None
+        await self._store_batch()
+        if self.seq == self.acked:
+            return
+
+        errors, self.errors = sorted(self.errors, key=lambda error: error["seq"]), []
+        self.acked = self.seq
+        await self._send({"type": "ack", "upto": self.seq, "errors": errors})
+
+    async def _send(self, message: dict):
+        if self.binary:
+            await self.websocket.send_bytes(msgpack.packb(message))
+        else:
+            await self.websocket.send_text(dumps(message).decode())
+
+
+def _lookup_client(client_id: str):
+    with SessionLocal() as db:
+        return lookup_client(db, client_id)
@@ -1,5 +1,9 @@
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex
+
 from models.users import ApprovedUsers, User
-from .database import SessionLocal
+from .database import SessionLocal, engine
 from utils.auth import hash_password
 from utils.config import settings
 import sys
@@ -91,4 +95,35 @@ def init_approved_users():
     finally:
         db.close()
 
-    
\ No newline at end of file
+
+def init_user_indexes():
+    """Índices sobre lower() en bases creadas antes de que existieran"""
+    with engine.begin() as connection:
+        for table in (User.__table__, ApprovedUsers.__table__):
+            for index in table.indexes:
+                try:
+                    connection.execute(CreateIndex(index, if_not_exists=True))
+                except OperationalError:
+                    # Otro worker lo creó al mismo tiempo
+                    pass
+
+
+# Columnas agregadas a users después de la versión inicial
+_USER_COLUMNS = (
+    ("version", "INTEGER NOT NULL DEFAULT 1"),
+    ("updated_at", "DATETIME"),
+)
+
+
+def init_user_columns():
+    """Agrega a bases existentes las columnas de versión de users"""
+    columns = {column["name"] for column in inspect(engine).get_columns("users")}
+    with engine.begin() as connection:
+        for name, ddl in _USER_COLUMNS:
+            if name in columns:
+                continue
+            try:
+                connection.exec_driver_sql(f"ALTER TABLE users ADD COLUMN {name} {ddl}")
+            except OperationalError:
+                # Otro worker la agregó al mismo tiempo
+                pass
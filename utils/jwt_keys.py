@@ -0,0 +1,109 @@
+""" Llaves de firma de los JWT (HS256 legacy, EdDSA o ES256 con `kid`)
+
+- ALGORITHM=HS256: firma y verifica con SECRET_KEY (sin `kid`).
+- ALGORITHM=EdDSA (Ed25519) o ES256 (P-256): JWT_KEYS lista archivos PEM.
+  La primera llave privada firma; todas (privadas o solo públicas) verifican
+  según el `kid` del header. El `kid` es el thumbprint RFC 7638 de la llave
+  pública: igual en todos los nodos sin coordinar nada.
+- /.well-known/jwks.json publica las llaves públicas: otros nodos o proxies
+  verifican sin conocer ningún secreto.
+- Las llaves se cargan y parsean una sola vez por snapshot de configuración
+  (se reconstruyen al recargar); firmar y verificar no parsea PEM.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+
+import jwt
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key,
+    load_pem_public_key,
+)
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm
+
+from .config import Config, get_config, on_reload
+from .fastjson import dumps
+
+ASYMMETRIC_ALGORITHMS = ("EdDSA", "ES256")
+
+
+def _thumbprint(jwk: dict) -> str:
+    # RFC 7638: miembros requeridos, en orden lexicográfico y sin espacios
+    required = {name: jwk[name] for name in ("crv", "kty", "x", "y") if name in jwk}
+    digest = hashlib.sha256(json.dumps(required, sort_keys=True, separators=(",", ":")).encode())
+    return base64.urlsafe_b64encode(digest.digest()).rstrip(b"=").decode()
+
+
+def _load(pem: bytes):
+    """Retorna (llave privada o None, llave pública)"""
+    if b"PRIVATE KEY" in pem:
+        private = load_pem_private_key(pem, password=None)
+        return private, private.public_key()
+    return None, load_pem_public_key(pem)
+
+
+# ----------------------------------------------------------------------
+# Conjunto de llaves de un snapshot: firmante + verificadores por kid
+class JWTKeys:
+    def __init__(self, config: Config):
+        self.algorithm = config.algorithm
+        self.secret = None
+        self.signing_key = None
+        self.kid = None
+        self.verifiers = {}
+        keys = []
+
+        if self.algorithm == "HS256":
+            self.secret = config.secret_key
+        elif self.algorithm in ASYMMETRIC_ALGORITHMS:
+            # Config.from_settings ya validó tipo de llave y que haya una privada
+            to_jwk = OKPAlgorithm.to_jwk if self.algorithm == "EdDSA" else ECAlgorithm.to_jwk
+            for pem in config.jwt_keys:
+                private, public = _load(pem)
+                jwk = to_jwk(public, as_dict=True)
+                kid = _thumbprint(jwk)
+                if kid in self.verifiers:
+                    continue
+                self.verifiers[kid] = public
+                keys.append({**jwk, "kid": kid, "use": "sig", "alg": self.algorithm})
+                if private is not None and self.signing_key is None:
+                    self.signing_key, self.kid = private, kid
+        else:
+            raise ValueError(f"ALGORITHM no soportado: {self.algorithm}")
+
+        # Documento JWKS serializado una sola vez
+        self.jwks = dumps({"keys": keys})
+
+    def encode(self, payload: dict) -> str:
+        if self.secret is not None:
+            return jwt.encode(payload, self.secret, algorithm="HS256")
+        return jwt.encode(payload, self.signing_key, algorithm=self.algorithm, headers={"kid": self.kid})
+
+    def decode(self, token: str, options: dict | None = None) -> dict:
+        """Verifica firma y claims; jwt.InvalidTokenError si el token no es válido"""
+        if self.secret is not None:
+            return jwt.decode(token, self.secret, algorithms=["HS256"], options=options)
+        kid = jwt.get_unverified_header(token).get("kid")
+        public = self.verifiers.get(kid)
+        if public is None:
+            raise jwt.InvalidTokenError("kid desconocido")
+        return jwt.decode(token, public, algorithms=[self.algorithm], options=options)
+
+
+_keys = JWTKeys(get_config())
+
+
+def jwt_keys() -> JWTKeys:
+    """Llaves vigentes (se reemplazan al recargar la configuración)"""
+    return _keys
+
+
+@on_reload
+def _reload_keys(previous: Config, config: Config):
+    global _keys
+    if (config.algorithm, config.secret_key, config.jwt_keys) != (
+        previous.algorithm, previous.secret_key, previous.jwt_keys,
+    ):
+        _keys = JWTKeys(config)
@@ -0,0 +1,164 @@
+""" Administración de las llaves AES de los agentes (tabla aes_keys)
+
+- Las llaves se guardan envueltas con la llave maestra AES_SECRET_KEY
+  (utils/crypto.wrap_key); el material en claro solo se retorna al crearlas.
+- Rotación escalonada: la llave nueva queda vigente y la anterior se marca
+  retirada con decrypt_until = ahora + margen. Hasta ese corte sigue
+  descifrando; el corte viaja en la llave cacheada, así que la ingesta no
+  paga nada extra después de rotar.
+- Provisión masiva: una llave nueva por cliente en un solo INSERT (las
+  vigentes de esos clientes se retiran con el mismo margen).
+- prepare_key_store() al iniciar: agrega las columnas de rotación a bases
+  existentes y envuelve las llaves legacy guardadas en base64 plano.
+"""
+from __future__ import annotations
+
+import base64
+import secrets
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import inspect, insert, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models.security import AESKey
+from .config import get_config
+from .crypto import WRAPPED_PREFIX, invalidate_aes_key, wrap_key
+from .database import SessionLocal, engine
+
+# Columnas agregadas a aes_keys después de su versión inicial
+_ROTATION_COLUMNS = (
+    ("client_id", "INTEGER REFERENCES clients(id) ON DELETE CASCADE"),
+    ("retired_at", "DATETIME"),
+    ("decrypt_until", "DATETIME"),
+)
+
+
+# ----------------------------------------------------------------------
+# Llave recién creada (único momento en que se conoce el material)
+@dataclass(frozen=True, slots=True)
+class IssuedKey:
+    key_id: str
+    client_id: int | None
+    key: str  # base64
+    created_at: datetime
+    # Llaves retiradas por esta emisión y su corte
+    retired: tuple[str, ...]
+    decrypt_until: datetime | None
+
+
+def _cutoff(now: datetime, grace: timedelta | None) -> datetime:
+    return now + (get_config().aes_key_rotation_grace if grace is None else grace)
+
+
+def _retire(db: Session, condition, now: datetime, cutoff: datetime) -> list[tuple[str, int | None]]:
+    """Retira las llaves vigentes que cumplen la condición: (key_id, client_id)"""
+    return db.execute(
+        update(AESKey)
+        .where(AESKey.is_active == True, AESKey.retired_at.is_(None), condition)
+        .values(retired_at=now, decrypt_until=cutoff)
+        .returning(AESKey.key_id, AESKey.client_id)
+    ).tuples().all()
+
+
+def _issue(db: Session, client_ids: list[int | None], now: datetime) -> list[tuple[str, int | None, bytes]]:
+    keys = [
+        (secrets.token_urlsafe(12), client_id, AESGCM.generate_key(bit_length=256))
+        for client_id in client_ids
+    ]
+    db.execute(
+        insert(AESKey),
+        [
+            {
+                "key_id": key_id,
+                "key_value": wrap_key(key_id, key),
+                "client_id": client_id,
+                "is_active": True,
+                "created_at": now,
+            }
+            for key_id, client_id, key in keys
+        ],
+    )
+    return keys
+
+
+# ----------------------------------------------------------------------
+# Provisión masiva: una llave por cliente (rota las vigentes de cada uno)
+def provision_keys(db: Session, client_ids: list[int], grace: timedelta | None = None) -> list[IssuedKey]:
+    now = datetime.now(UTC)
+    cutoff = _cutoff(now, grace)
+    retired_rows = _retire(db, AESKey.client_id.in_(client_ids), now, cutoff)
+    keys = _issue(db, client_ids, now)
+    db.commit()
+
+    retired: dict[int, list[str]] = {}
+    for key_id, client_id in retired_rows:
+        retired.setdefault(client_id, []).append(key_id)
+        invalidate_aes_key(key_id)
+    return [
+        IssuedKey(
+            key_id=key_id,
+            client_id=client_id,
+            key=base64.b64encode(key).decode(),
+            created_at=now,
+            retired=tuple(retired.get(client_id, ())),
+            decrypt_until=cutoff if client_id in retired else None,
+        )
+        for key_id, client_id, key in keys
+    ]
+
+
+# ----------------------------------------------------------------------
+# Rotación de una llave: la nueva tiene el mismo dueño (cliente o compartida)
+def rotate_key(db: Session, aes_key: AESKey, grace: timedelta | None = None) -> IssuedKey:
+    now = datetime.now(UTC)
+    cutoff = _cutoff(now, grace)
+    retired = _retire(db, AESKey.id == aes_key.id, now, cutoff)
+    [(key_id, client_id, key)] = _issue(db, [aes_key.client_id], now)
+    db.commit()
+
+    for old, _ in retired:
+        invalidate_aes_key(old)
+    return IssuedKey(
+        key_id=key_id,
+        client_id=client_id,
+        key=base64.b64encode(key).decode(),
+        created_at=now,
+        retired=tuple(old for old, _ in retired),
+        decrypt_until=cutoff,
+    )
+
+
+def revoke_key(db: Session, aes_key: AESKey):
+    """Deja de aceptar la llave de inmediato (sin margen)"""
+    aes_key.is_active = False
+    db.commit()
+    invalidate_aes_key(aes_key.key_id)
+
+
+# ----------------------------------------------------------------------
+# Al iniciar: columnas de rotación y llaves legacy envueltas
+def prepare_key_store():
+    columns = {column["name"] for column in inspect(engine).get_columns("aes_keys")}
+    with engine.begin() as connection:
+        for name, ddl in _ROTATION_COLUMNS:
+            if name in columns:
+                continue
+            try:
+                connection.exec_driver_sql(f"ALTER TABLE aes_keys ADD COLUMN {name} {ddl}")
+            except OperationalError:
+                # Otro worker la agregó al mismo tiempo
+                pass
+        connection.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_aes_keys_client_id ON aes_keys (client_id)"
+        )
+
+    with SessionLocal() as db:
+        legacy = db.scalars(
+            select(AESKey).where(AESKey.key_value.not_like(f"{WRAPPED_PREFIX}%"))
+        ).all()
+        for aes_key in legacy:
+            aes_key.key_value = wrap_key(aes_key.key_id, base64.b64decode(aes_key.key_value))
+        db.commit()
@@ -0,0 +1,240 @@
+""" Fan-out en vivo de las muestras (SSE) desde un ring buffer por cliente
+
+- Cada cliente tiene un ring buffer con sus últimas LIVE_HISTORY_SIZE
+  muestras; un suscriptor nuevo recibe primero ese historial.
+- La ingesta solo publica (deque.append + aviso al event loop): nunca espera
+  a los suscriptores.
+- Cada suscriptor tiene su propio buffer acotado; si no consume a tiempo se
+  descartan las muestras más viejas y se le informa cuántas perdió.
+- Con varios workers, un poller por worker (solo mientras hay suscriptores)
+  trae de la DB las muestras ingresadas en los otros workers.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from models.metrics import ServerMetrics
+from .config import get_config
+from .database import SessionLocal
+from .fastjson import dumps
+from .partitions import last_sample_id, modified_partitions, read_partitions, routed
+from .stats import register_gauge
+
+LIVE_HISTORY_SIZE = get_config().live_history_size
+
+LIVE_COLUMNS = (
+    ServerMetrics.id,
+    ServerMetrics.client_id,
+    ServerMetrics.hostname,
+    ServerMetrics.server_timestamp,
+    ServerMetrics.cpu_percent,
+    ServerMetrics.memory_percent,
+    ServerMetrics.disk_percent,
+)
+
+
+# ----------------------------------------------------------------------
+# Muestra ya serializada como evento SSE (una sola vez para todos)
+@dataclass(frozen=True, slots=True)
+class LiveSample:
+    id: int
+    client_id: int
+    frame: bytes
+
+    @classmethod
+    def build(cls, id, client_id, hostname, server_timestamp, cpu, memory, disk) -> LiveSample:
+        data = dumps({
+            "id": id,
+            "client_id": client_id,
+            "hostname": hostname,
+            "server_timestamp": server_timestamp,
+            "cpu_percent": cpu,
+            "memory_percent": memory,
+            "disk_percent": disk,
+        })
+        return cls(id, client_id, b"id: %d\nevent: sample\ndata: %s\n\n" % (id, data))
+
+    @classmethod
+    def from_model(cls, sample: ServerMetrics) -> LiveSample:
+        """Usar después de insert_samples (id asignado) y antes del commit"""
+        return cls.build(
+            sample.id,
+            sample.client_id,
+            sample.hostname,
+            sample.server_timestamp,
+            sample.cpu_percent,
+            sample.memory_percent,
+            sample.disk_percent,
+        )
+
+
+# ----------------------------------------------------------------------
+# Suscriptor: buffer acotado propio; descarta lo más viejo si se atrasa
+class Subscriber:
+    def __init__(self, client_id: int | None, loop: asyncio.AbstractEventLoop):
+        self.client_id = client_id
+        self.loop = loop
+        self.buffer: deque[LiveSample] = deque(maxlen=get_config().live_subscriber_buffer)
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+
+    def push(self, sample: LiveSample):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(sample)
+        # Puede llamarse desde el threadpool de los handlers sync
+        try:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+        except RuntimeError:
+            # Event loop ya cerrado: el suscriptor se está dando de baja
+            pass
+
+    def drain(self) -> tuple[list[LiveSample], int]:
+        samples = []
+        while self.buffer:
+            samples.append(self.buffer.popleft())
+        dropped, self.dropped = self.dropped, 0
+        self.wakeup.clear()
+        return samples, dropped
+
+
+# ----------------------------------------------------------------------
+# Ring buffers por cliente + suscriptores (por cliente o de toda la flota)
+class LiveHub:
+    def __init__(self):
+        self._rings: dict[int, deque[LiveSample]] = {}
+        self._seen: dict[int, set[int]] = {}
+        self._subscribers: set[Subscriber] = set()
+        self._lock = threading.Lock()
+        self._poller: asyncio.Task | None = None
+        self._cursor = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, samples: Iterable[LiveSample], notify: bool = True):
+        """Agrega las muestras a su ring buffer y avisa a los suscriptores"""
+        with self._lock:
+            subscribers = list(self._subscribers) if notify else []
+            fresh = [sample for sample in samples if self._remember(sample)]
+        for sample in fresh:
+            for subscriber in subscribers:
+                if subscriber.client_id is None or subscriber.client_id == sample.client_id:
+                    subscriber.push(sample)
+
+    def _remember(self, sample: LiveSample) -> bool:
+        # La misma muestra puede llegar por la ingesta local y por el poller
+        ring = self._rings.get(sample.client_id)
+        if ring is None:
+            ring = self._rings[sample.client_id] = deque(maxlen=LIVE_HISTORY_SIZE)
+            self._seen[sample.client_id] = set()
+        seen = self._seen[sample.client_id]
+        if sample.id in seen:
+            return False
+        if len(ring) == ring.maxlen:
+            seen.discard(ring[0].id)
+        ring.append(sample)
+        seen.add(sample.id)
+        return True
+
+    def history(self, client_id: int | None, limit: int) -> list[LiveSample]:
+        with self._lock:
+            if client_id is not None:
+                samples = list(self._rings.get(client_id, ()))
+            else:
+                samples = [sample for ring in self._rings.values() for sample in ring]
+        return sorted(samples, key=lambda sample: sample.id)[-limit:] if limit else []
+
+    # ------------------------------------------------------------------
+    async def subscribe(self, client_id: int | None, history: int) -> tuple[Subscriber, list[LiveSample]]:
+        """Registra un suscriptor y retorna su historial inicial"""
+        if client_id is not None and len(self.history(client_id, history)) < history:
+            # Ring vacío (ej: worker recién iniciado): se completa desde la DB
+            self.publish(await run_in_threadpool(_load_recent, client_id, history), notify=False)
+
+        subscriber = Subscriber(client_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+        if get_config().live_poll_interval and (self._poller is None or self._poller.done()):
+            self._poller = asyncio.create_task(self._poll())
+        return subscriber, self.history(client_id, history)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    # ------------------------------------------------------------------
+    # Muestras ingresadas por otros workers (solo con suscriptores activos)
+    async def _poll(self):
+        self._cursor = await run_in_threadpool(_max_sample_id)
+        # Solo se consultan las particiones escritas desde el sondeo anterior
+        interval = get_config().live_poll_interval
+        since = time.time() - interval
+        while self._subscribers and interval:
+            await asyncio.sleep(interval)
+            with self._lock:
+                clients = {subscriber.client_id for subscriber in self._subscribers}
+            polled_at = time.time()
+            samples = await run_in_threadpool(_load_since, self._cursor, clients, since)
+            # Margen de un intervalo por la resolución del mtime
+            since = polled_at - interval
+            interval = get_config().live_poll_interval
+            if samples:
+                self._cursor = samples[-1].id
+                self.publish(samples)
+
+
+def _max_sample_id() -> int:
+    with SessionLocal() as db:
+        return last_sample_id(db)
+
+
+def _load_since(cursor: int, clients: set[int | None], since: float) -> list[LiveSample]:
+    query = select(*LIVE_COLUMNS).where(ServerMetrics.id > cursor)
+    if None not in clients:
+        query = query.where(ServerMetrics.client_id.in_(clients))
+    query = query.order_by(ServerMetrics.id).limit(1000)
+
+    rows = []
+    with SessionLocal() as db:
+        for partition in modified_partitions(since):
+            rows += db.execute(query, execution_options=routed(db, partition)).all()
+    # Ids globales: se ordenan entre particiones y se respeta el límite
+    rows.sort(key=lambda row: row.id)
+    return [LiveSample.build(*row) for row in rows[:1000]]
+
+
+def _load_recent(client_id: int, limit: int) -> list[LiveSample]:
+    query = (
+        select(*LIVE_COLUMNS)
+        .where(ServerMetrics.client_id == client_id)
+        .order_by(ServerMetrics.id.desc())
+    )
+    rows = []
+    with SessionLocal() as db:
+        for partition in read_partitions(db, newest_first=True):
+            rows += db.execute(
+                query.limit(limit - len(rows)),
+                execution_options=routed(db, partition),
+            ).all()
+            if len(rows) >= limit:
+                break
+    rows.sort(key=lambda row: row.id)
+    return [LiveSample.build(*row) for row in rows[-limit:]]
+
+
+live_hub = LiveHub()
+register_gauge(
+    "live_subscribers",
+    "Suscriptores SSE conectados al fan-out en vivo",
+    lambda: live_hub.subscriber_count,
+)
@@ -0,0 +1,247 @@
+""" Límites de concurrencia por grupo de rutas y descarte adaptativo (503)
+
+CONCURRENCY_LIMITS define `grupo=concurrencia:cola[:objetivo_ms]`, separados
+por coma (sin objetivo se usa LOAD_SHED_TARGET_MS):
+
+    auth=8:64:1000     POST /users/token y /clients/token (Argon2: cada
+                       request ya tarda cientos de ms, el objetivo es mayor)
+    ingest=24:512      POST /metrics
+    default=8:256      el resto de las rutas HTTP
+
+- Cada endpoint se asigna a un grupo con @concurrency_group("auth"); sin
+  decorador va a default. Un grupo sin límite propio usa los valores de
+  default (con su propio cupo). CONCURRENCY_LIMITS vacío desactiva todo.
+- TimedRoute toma el cupo antes de resolver las dependencias: un request
+  rechazado no decodifica el JWT, no lee el body ni toca la DB o el threadpool.
+- Con la cola del grupo llena responde 503 (con Retry-After) de inmediato.
+- Descarte adaptativo (CoDel, RFC 8289): siempre se encola mientras haya
+  lugar; la decisión se toma al salir de la cola, con la espera del request
+  que está en la cabeza. Si la espera se mantiene sobre el objetivo durante
+  un intervalo (LOAD_SHED_INTERVAL_MS), el grupo entra en descarte y rechaza
+  requests de la cabeza espaciados por intervalo / sqrt(descartes), hasta que
+  uno salga bajo el objetivo. Una ráfaga corta (o una cola que se vacía a
+  tiempo) no descarta nada.
+- Ningún request espera más de objetivo + STALL_INTERVALS intervalos: solo
+  protege contra una cola trabada (todos los cupos tomados por requests
+  lentos y nadie sale de la cola); el descarte normal es el de CoDel.
+- Los límites son por worker. THREADPOOL_SIZE fija los hilos de anyio de los
+  handlers sync: con la suma de los grupos dentro de ese tamaño, un grupo
+  saturado no deja sin hilos a los demás.
+"""
+from __future__ import annotations
+
+import math
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from time import perf_counter
+
+from anyio import CapacityLimiter, WouldBlock, move_on_after, to_thread
+from fastapi import HTTPException, status
+
+from .config import Config, get_config, on_reload
+from .stats import register_gauge, stage_histogram
+
+DEFAULT_GROUP = "default"
+STALL_INTERVALS = 4
+
+
+# ----------------------------------------------------------------------
+# Límite de un grupo: requests en curso, en espera y objetivo de espera
+@dataclass(frozen=True, slots=True)
+class GroupLimit:
+    concurrency: int
+    queue: int
+    # Segundos; None: LOAD_SHED_TARGET_MS
+    target: float | None = None
+
+
+def parse_concurrency_limits(spec: str) -> dict[str, GroupLimit]:
+    """Parsea CONCURRENCY_LIMITS (ej: "auth=8:64:1000,default=8:256")"""
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, value = item.partition("=")
+        concurrency, _, rest = value.partition(":")
+        queue, _, target = rest.partition(":")
+        try:
+            limit = GroupLimit(
+                int(concurrency),
+                int(queue or 0),
+                float(target) / 1000 if target else None,
+            )
+        except ValueError:
+            raise RuntimeError(f"CONCURRENCY_LIMITS inválido: {item!r}")
+        if (
+            not name.strip()
+            or limit.concurrency < 1
+            or limit.queue < 0
+            or (limit.target is not None and limit.target <= 0)
+        ):
+            raise RuntimeError(f"CONCURRENCY_LIMITS inválido: {item!r}")
+        limits[name.strip()] = limit
+    return limits
+
+
+def concurrency_group(name: str):
+    """Asigna el endpoint a un grupo de CONCURRENCY_LIMITS (va debajo de @router.*)"""
+    def decorator(endpoint):
+        endpoint.__concurrency_group__ = name
+        return endpoint
+    return decorator
+
+
+# ----------------------------------------------------------------------
+# Estado de un grupo; todo corre en el event loop (sin locks)
+class RouteGroup:
+    def __init__(self, name: str):
+        self.name = name
+        self.limit: GroupLimit | None = None
+        self._limiter: CapacityLimiter | None = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        # Estado de CoDel
+        self.dropping = False
+        self._first_above: float | None = None
+        self._drop_next = 0.0
+        self._drop_count = 0
+        self._wait = stage_histogram(f"queue_wait_{name}")
+
+    def _limiter_for(self, limit: GroupLimit) -> CapacityLimiter:
+        # El limiter se crea y ajusta dentro del event loop (la recarga solo cambia el dict)
+        if self._limiter is None:
+            self._limiter = CapacityLimiter(limit.concurrency)
+        elif limit.concurrency != self._limiter.total_tokens:
+            self._limiter.total_tokens = limit.concurrency
+        self.limit = limit
+        return self._limiter
+
+    def _should_drop(self, sojourn: float, now: float, target: float, interval: float) -> bool:
+        """CoDel al salir de la cola: True si hay que descartar este request"""
+        if sojourn < target:
+            self._first_above = None
+            self.dropping = False
+            return False
+        if not self.dropping:
+            if self._first_above is None:
+                # Primera espera sobre el objetivo: se tolera durante un intervalo
+                self._first_above = now + interval
+                return False
+            if now < self._first_above:
+                return False
+            self.dropping = True
+            self._drop_count = 1
+            self._drop_next = now + interval
+            return True
+        if now < self._drop_next:
+            return False
+        # Ley de control: descartes cada vez más seguidos mientras siga la espera
+        self._drop_count += 1
+        self._drop_next = now + interval / math.sqrt(self._drop_count)
+        return True
+
+    def _reject(self, interval: float):
+        self.shed += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor saturado, reintente en unos segundos",
+            headers={"Retry-After": str(max(1, math.ceil(interval)))},
+        )
+
+    @asynccontextmanager
+    async def slot(self, limit: GroupLimit, target: float, interval: float) -> AsyncIterator[None]:
+        limiter = self._limiter_for(limit)
+        borrower = object()
+        start = perf_counter()
+        try:
+            limiter.acquire_on_behalf_of_nowait(borrower)
+        except WouldBlock:
+            if self.waiting >= limit.queue:
+                self._reject(interval)
+            self.waiting += 1
+            try:
+                with move_on_after(target + STALL_INTERVALS * interval) as scope:
+                    await limiter.acquire_on_behalf_of(borrower)
+            finally:
+                self.waiting -= 1
+            now = perf_counter()
+            if scope.cancelled_caught:
+                self._should_drop(now - start, now, target, interval)
+                self._reject(interval)
+            if self._should_drop(now - start, now, target, interval):
+                # Descarte en la cabeza: el cupo pasa al siguiente de la cola
+                limiter.release_on_behalf_of(borrower)
+                self._reject(interval)
+        else:
+            # Sin espera: la cola está vacía (sale del descarte)
+            now = perf_counter()
+            self._should_drop(0.0, now, target, interval)
+
+        self._wait.observe(now - start)
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            limiter.release_on_behalf_of(borrower)
+
+
+_groups: dict[str, RouteGroup] = {}
+_limits = parse_concurrency_limits(get_config().concurrency_limits)
+
+
+@on_reload
+def _reload_limits(previous: Config, config: Config):
+    """CONCURRENCY_LIMITS se aplica sin reiniciar (los grupos conservan su estado)"""
+    global _limits
+    if config.concurrency_limits != previous.concurrency_limits:
+        _limits = parse_concurrency_limits(config.concurrency_limits)
+
+
+def route_group(name: str) -> RouteGroup:
+    group = _groups.get(name)
+    if group is None:
+        group = _groups.setdefault(name, RouteGroup(name))
+    return group
+
+
+@asynccontextmanager
+async def admission(group: RouteGroup) -> AsyncIterator[None]:
+    """Cupo del grupo para un request (503 si se descarta)"""
+    limits = _limits
+    limit = limits.get(group.name, limits.get(DEFAULT_GROUP))
+    if limit is None:
+        yield
+        return
+    config = get_config()
+    target = limit.target if limit.target is not None else config.load_shed_target
+    async with group.slot(limit, target, config.load_shed_interval):
+        yield
+
+
+def configure_threadpool():
+    """Fija los hilos de anyio para handlers sync (se llama desde el event loop)"""
+    to_thread.current_default_thread_limiter().total_tokens = get_config().threadpool_size
+
+
+def _group_stats() -> dict[str, float]:
+    stats = {}
+    for name, group in list(_groups.items()):
+        stats[f"{name}_in_flight"] = group.in_flight
+        stats[f"{name}_waiting"] = group.waiting
+        stats[f"{name}_admitted"] = group.admitted
+        stats[f"{name}_shed"] = group.shed
+        stats[f"{name}_dropping"] = int(group.dropping)
+    return stats
+
+
+register_gauge(
+    "route_concurrency",
+    "Requests en curso, en espera, admitidos y descartados (503) por grupo de rutas",
+    _group_stats,
+)
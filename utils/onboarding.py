@@ -0,0 +1,322 @@
+""" Altas masivas de usuarios aprobados y de usuarios (CSV / NDJSON)
+
+- El upload se lee en streaming y se procesa por bloques de BULK_CHUNK_ROWS
+  filas; cada bloque se confirma en su propia transacción.
+- Deduplicación por bloque con una sola query (UNION ALL de las búsquedas
+  sin distinguir mayúsculas, con índices sobre lower()) y contra las filas
+  anteriores del mismo upload.
+- Argon2 libera el GIL: los passwords del bloque se hashean en paralelo en
+  un pool de HASH_WORKERS hilos (cada hash usa ~64 MiB, por eso el tope).
+- INSERT masivo con ON CONFLICT DO NOTHING: una fila que otro request creó
+  entre la query y el insert queda como `exists` en lugar de abortar el bloque.
+- Los correos de confirmación se envían por bloque con una sola conexión SMTP.
+- Resultado por fila: created, approved, exists, duplicate, not_approved o
+  invalid (con el detalle).
+"""
+from __future__ import annotations
+
+import csv
+import os
+from collections import Counter
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+from fastapi import HTTPException, Request, status
+from pydantic import ValidationError
+from sqlalchemy import func, literal, select, union_all
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models.users import ApprovedUsers, User
+from schemas.user import BulkApprovedRow, UserCreate
+from .audit import audit_log
+from .auth import confirmation_context, hash_password
+from .stats import stage_timer
+
+BULK_CHUNK_ROWS = 500
+BULK_MAX_ROWS = 10000
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+
+CSV_TYPES = ("text/csv",)
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+_hasher = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="argon2")
+
+# (número de línea, registro) o (número de línea, error de formato)
+Row = tuple[int, dict | str]
+
+
+# ----------------------------------------------------------------------
+# Lectura en streaming: bloques de filas desde el body del request
+class RowReader:
+    """Parte el body en bloques de hasta BULK_CHUNK_ROWS filas (máximo max_rows)"""
+
+    def __init__(self, request: Request, max_rows: int = BULK_MAX_ROWS):
+        media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        if media_type in CSV_TYPES:
+            self.parse = _CSVParser()
+        elif media_type in NDJSON_TYPES:
+            self.parse = _parse_ndjson
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail="Content-Type debe ser text/csv o application/x-ndjson",
+            )
+        self.request = request
+        self.max_rows = max_rows
+        self.count = 0
+        # True si el upload tenía más de max_rows filas (el resto no se procesa)
+        self.truncated = False
+
+    async def chunks(self) -> AsyncIterator[list[Row]]:
+        pending = b""
+        line_no = 0
+        chunk: list[Row] = []
+        async for data in self.request.stream():
+            pending += data
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                line_no += 1
+                if not self._append(chunk, line_no, line):
+                    break
+            if self.truncated:
+                break
+            if len(chunk) >= BULK_CHUNK_ROWS:
+                yield chunk
+                chunk = []
+        else:
+            if pending:
+                self._append(chunk, line_no + 1, pending)
+        if chunk:
+            yield chunk
+
+    def _append(self, chunk: list[Row], line_no: int, line: bytes) -> bool:
+        row = self.parse(line_no, line)
+        if row is None:
+            return True
+        if self.count >= self.max_rows:
+            self.truncated = True
+            return False
+        self.count += 1
+        chunk.append(row)
+        return True
+
+
+class _CSVParser:
+    """Primera línea no vacía: encabezado con los nombres de las columnas"""
+
+    def __init__(self):
+        self.header: list[str] | None = None
+
+    def __call__(self, line_no: int, line: bytes) -> Row | None:
+        try:
+            text = line.decode("utf-8-sig" if self.header is None else "utf-8").rstrip("\r")
+        except UnicodeDecodeError:
+            return line_no, "La línea no es UTF-8"
+        if not text.strip():
+            return None
+        values = next(csv.reader([text]))
+        if self.header is None:
+            self.header = [name.strip().lower() for name in values]
+            return None
+        if len(values) != len(self.header):
+            return line_no, f"Se esperaban {len(self.header)} columnas"
+        return line_no, dict(zip(self.header, values))
+
+
+def _parse_ndjson(line_no: int, line: bytes) -> Row | None:
+    if not line.strip():
+        return None
+    try:
+        record = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return line_no, "JSON inválido"
+    if not isinstance(record, dict):
+        return line_no, "Se esperaba un objeto JSON"
+    return line_no, record
+
+
+def _validation_detail(exc: ValidationError) -> str:
+    error = exc.errors()[0]
+    field = ".".join(str(part) for part in error["loc"])
+    return f"{field}: {error['msg']}" if field else error["msg"]
+
+
+# ----------------------------------------------------------------------
+# Estado de un upload: filas ya vistas y resultado por fila
+class BulkImport:
+    def __init__(self, actor: str):
+        # Admin que hace el upload (auditoría)
+        self.actor = actor
+        self.emails: set[str] = set()
+        self.usernames: set[str] = set()
+        self.results: list[dict] = []
+
+    def add(self, line: int, status: str, email: str | None = None, id: int | None = None, detail: str | None = None):
+        self.results.append({"line": line, "status": status, "email": email, "id": id, "detail": detail})
+
+    def report(self, truncated: bool) -> dict:
+        return {
+            "total": len(self.results),
+            "summary": dict(Counter(result["status"] for result in self.results)),
+            "truncated": truncated,
+            "results": sorted(self.results, key=lambda result: result["line"]),
+        }
+
+
+def _existing(db: Session, usernames: set[str], emails: set[str]) -> dict[str, set[str]]:
+    """Una sola query para el bloque: {"username" | "email" | "approved": valores en minúsculas}"""
+    queries = []
+    if usernames:
+        queries.append(
+            select(literal("username"), func.lower(User.username))
+            .where(func.lower(User.username).in_(usernames))
+        )
+    if emails:
+        queries.append(
+            select(literal("email"), func.lower(User.email))
+            .where(func.lower(User.email).in_(emails))
+        )
+        queries.append(
+            select(literal("approved"), func.lower(ApprovedUsers.email))
+            .where(func.lower(ApprovedUsers.email).in_(emails))
+        )
+    found = {"username": set(), "email": set(), "approved": set()}
+    if queries:
+        with stage_timer("bulk_dedup_query"):
+            for kind, value in db.execute(union_all(*queries)).tuples():
+                found[kind].add(value)
+    return found
+
+
+# ----------------------------------------------------------------------
+# Bloque de emails aprobados
+def import_approved_chunk(db: Session, rows: list[Row], state: BulkImport):
+    candidates: list[tuple[int, str]] = []
+    for line, record in rows:
+        if isinstance(record, str):
+            state.add(line, "invalid", detail=record)
+            continue
+        try:
+            email = BulkApprovedRow.model_validate(record).email.lower()
+        except ValidationError as exc:
+            state.add(line, "invalid", detail=_validation_detail(exc))
+            continue
+        if email in state.emails:
+            state.add(line, "duplicate", email, detail="Repetido en el archivo")
+            continue
+        state.emails.add(email)
+        candidates.append((line, email))
+
+    existing = _existing(db, set(), {email for _, email in candidates})
+    new: list[tuple[int, str]] = []
+    for line, email in candidates:
+        if email in existing["approved"]:
+            state.add(line, "exists", email, detail="Este usuario ya ha sido aprobado.")
+        elif email in existing["email"]:
+            state.add(line, "exists", email, detail="Este email ya está registrado.")
+        else:
+            new.append((line, email))
+    if not new:
+        return
+
+    with stage_timer("bulk_insert"):
+        inserted = dict(
+            db.execute(
+                insert(ApprovedUsers)
+                .on_conflict_do_nothing()
+                .returning(ApprovedUsers.email, ApprovedUsers.id),
+                [{"email": email} for _, email in new],
+            ).tuples().all()
+        )
+        db.commit()
+    for line, email in new:
+        if email in inserted:
+            state.add(line, "approved", email, id=inserted[email])
+            audit_log.record(
+                "user_approve",
+                state.actor,
+                target=f"approved:{inserted[email]}",
+                detail={"email": email, "bulk": True},
+            )
+        else:
+            state.add(line, "exists", email, detail="Este usuario ya ha sido aprobado.")
+
+
+# ----------------------------------------------------------------------
+# Bloque de usuarios: retorna los contextos de los correos de confirmación
+def import_users_chunk(db: Session, rows: list[Row], state: BulkImport) -> list[dict]:
+    candidates: list[tuple[int, UserCreate]] = []
+    for line, record in rows:
+        if isinstance(record, str):
+            state.add(line, "invalid", detail=record)
+            continue
+        try:
+            user = UserCreate.model_validate(record)
+        except ValidationError as exc:
+            state.add(line, "invalid", detail=_validation_detail(exc))
+            continue
+        email, username = user.email.lower(), user.username.lower()
+        if email in state.emails or username in state.usernames:
+            state.add(line, "duplicate", email, detail="Repetido en el archivo")
+            continue
+        state.emails.add(email)
+        state.usernames.add(username)
+        candidates.append((line, user))
+
+    existing = _existing(
+        db,
+        {user.username.lower() for _, user in candidates},
+        {user.email.lower() for _, user in candidates},
+    )
+    new: list[tuple[int, UserCreate]] = []
+    for line, user in candidates:
+        email = user.email.lower()
+        if user.username.lower() in existing["username"]:
+            state.add(line, "exists", email, detail="Este usuario ya está registrado")
+        elif email in existing["email"]:
+            state.add(line, "exists", email, detail="Este email ya está registrado")
+        elif email not in existing["approved"]:
+            state.add(line, "not_approved", email, detail="Este usuario no está aprobado.")
+        else:
+            new.append((line, user))
+    if not new:
+        return []
+
+    with stage_timer("bulk_hash"):
+        hashes = list(_hasher.map(hash_password, [user.password for _, user in new]))
+    with stage_timer("bulk_insert"):
+        inserted = dict(
+            db.execute(
+                insert(User)
+                .on_conflict_do_nothing()
+                .returning(User.email, User.id),
+                [
+                    {
+                        "username": user.username,
+                        "email": user.email.lower(),
+                        "password_hash": password_hash,
+                        "is_active": False,
+                    }
+                    for (_, user), password_hash in zip(new, hashes)
+                ],
+            ).tuples().all()
+        )
+        db.commit()
+
+    contexts = []
+    for line, user in new:
+        email = user.email.lower()
+        if email in inserted:
+            state.add(line, "created", email, id=inserted[email])
+            audit_log.record(
+                "user_create",
+                state.actor,
+                target=f"user:{inserted[email]}",
+                detail={"email": email, "bulk": True},
+            )
+            contexts.append(confirmation_context(user.username, email))
+        else:
+            state.add(line, "exists", email, detail="Este usuario ya está registrado")
+    return contexts
@@ -0,0 +1,59 @@
+""" Mueve las filas de la tabla metrics original (main) a las particiones mensuales
+
+Conserva los ids: la secuencia global (metric_sequence) se inicializa antes
+con el último id legacy. Cada mes de cada bloque se mueve en su propia
+transacción (INSERT en la partición + DELETE en main, atómico entre bases
+adjuntas). Se puede interrumpir y volver a correr; la ingesta puede seguir
+activa (las muestras nuevas ya van a las particiones).
+
+Uso (desde la raíz del repo):
+    python -m utils.partition_metrics [--chunk N]
+"""
+import argparse
+
+from sqlalchemy import delete, insert, select
+
+from models.clients import OAuthClient  # noqa: F401 (tabla referenciada por la FK)
+from models.metrics import ServerMetrics
+from utils.database import SessionLocal
+from utils.partitions import LEGACY_OPTIONS, Partition, init_sequence, prepare
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra metrics a particiones mensuales")
+    parser.add_argument("--chunk", type=int, default=10000)
+    args = parser.parse_args()
+
+    table = ServerMetrics.__table__
+    total = 0
+    with SessionLocal() as db:
+        init_sequence(db)
+        db.commit()
+
+        while True:
+            rows = db.execute(
+                select(table).order_by(table.c.id).limit(args.chunk),
+                execution_options=LEGACY_OPTIONS,
+            ).mappings().all()
+            if not rows:
+                break
+
+            groups: dict[Partition, list[dict]] = {}
+            for row in rows:
+                groups.setdefault(Partition.for_timestamp(row["server_timestamp"]), []).append(dict(row))
+            for partition, group in sorted(groups.items()):
+                # ATTACH antes de la primera escritura de la transacción
+                prepare(db, [partition.start])
+                db.execute(insert(table), group, execution_options=partition.execution_options)
+                db.execute(
+                    delete(table).where(table.c.id.in_([row["id"] for row in group])),
+                    execution_options=LEGACY_OPTIONS,
+                )
+                db.commit()
+            total += len(rows)
+            print(f"{total} muestras migradas")
+    print(f"Listo: {total} muestras migradas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+""" Particionado mensual de metrics en bases SQLite adjuntas (ATTACH)
+
+- Cada mes vive en su propio archivo (METRICS_PARTITION_DIR/metrics_AAAA_MM.db)
+  con la misma tabla e índices. ServerMetrics está mapeado a un esquema
+  placeholder (PARTITION_SCHEMA) y cada statement elige su partición con
+  schema_translate_map; sin ruta explícita apunta a la tabla original de
+  main (legacy: filas previas al particionado).
+- La partición se elige por server_timestamp (UTC). Los ids siguen siendo
+  globales y crecientes: se reservan en metric_sequence (main) dentro de la
+  transacción de ingesta.
+- Escritura: prepare() antes del primer INSERT/UPDATE de la transacción
+  (SQLite no permite ATTACH dentro de una transacción) e insert_samples().
+- Lectura: read_partitions() retorna solo las particiones que se solapan con
+  el rango pedido; routed() las adjunta a la conexión (LRU acotado por el
+  límite de ATTACH de SQLite) y retorna las opciones de ejecución.
+- Retención: drop_expired() borra los archivos de los meses vencidos; cada
+  conexión los desadjunta al salir del pool.
+"""
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import UTC, datetime
+
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models.metrics import MetricSequence, ServerMetrics
+from .config import get_config
+from .database import PARTITION_SCHEMA, engine
+from .stats import stage_timer
+
+METRICS_PARTITION_DIR = get_config().metrics_partition_dir
+
+LEGACY_OPTIONS = {"schema_translate_map": {PARTITION_SCHEMA: None}}
+
+_FILE_RE = re.compile(r"^metrics_(\d{4})_(\d{2})\.db$")
+
+
+def _utc(value: datetime) -> datetime:
+    # SQLite no guarda la zona horaria: se guardó en UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=UTC)
+    return value.astimezone(UTC)
+
+
+# ----------------------------------------------------------------------
+# Partición de un mes
+@dataclass(frozen=True, order=True, slots=True)
+class Partition:
+    year: int
+    month: int
+
+    @classmethod
+    def for_timestamp(cls, value: datetime) -> Partition:
+        value = _utc(value)
+        return cls(value.year, value.month)
+
+    @property
+    def name(self) -> str:
+        return f"metrics_{self.year:04d}_{self.month:02d}"
+
+    @property
+    def path(self) -> str:
+        return os.path.join(METRICS_PARTITION_DIR, f"{self.name}.db")
+
+    @property
+    def start(self) -> datetime:
+        return datetime(self.year, self.month, 1, tzinfo=UTC)
+
+    @property
+    def end(self) -> datetime:
+        if self.month == 12:
+            return datetime(self.year + 1, 1, 1, tzinfo=UTC)
+        return datetime(self.year, self.month + 1, 1, tzinfo=UTC)
+
+    @property
+    def execution_options(self) -> dict:
+        return {"schema_translate_map": {PARTITION_SCHEMA: self.name}}
+
+    def overlaps(self, start: datetime | None, end: datetime | None) -> bool:
+        if start is not None and self.end <= _utc(start):
+            return False
+        if end is not None and self.start >= _utc(end):
+            return False
+        return True
+
+
+def list_partitions() -> list[Partition]:
+    """Particiones existentes (del más antiguo al más reciente)"""
+    try:
+        entries = os.scandir(METRICS_PARTITION_DIR)
+    except FileNotFoundError:
+        return []
+    with entries:
+        return sorted(
+            Partition(int(match[1]), int(match[2]))
+            for entry in entries
+            if (match := _FILE_RE.match(entry.name))
+        )
+
+
+def modified_partitions(since: float) -> list[Partition]:
+    """Particiones escritas desde `since` (epoch), según el mtime del archivo"""
+    return [
+        partition
+        for partition in list_partitions()
+        if _mtime(partition.path) >= since
+    ]
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+# ----------------------------------------------------------------------
+# Retención
+def oldest_retained() -> Partition | None:
+    # Meses conservados, incluido el actual (0 = sin retención)
+    months = get_config().metrics_retention_months
+    if months <= 0:
+        return None
+    now = datetime.now(UTC)
+    index = now.year * 12 + now.month - 1 - (months - 1)
+    return Partition(index // 12, index % 12 + 1)
+
+
+def is_retained(value: datetime) -> bool:
+    oldest = oldest_retained()
+    return oldest is None or Partition.for_timestamp(value) >= oldest
+
+
+def drop_expired() -> list[Partition]:
+    """Borra los archivos de los meses fuera de la retención (job del scheduler)"""
+    oldest = oldest_retained()
+    if oldest is None:
+        return []
+    dropped = []
+    for partition in list_partitions():
+        if partition >= oldest:
+            break
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            try:
+                os.remove(partition.path + suffix)
+            except FileNotFoundError:
+                pass
+        dropped.append(partition)
+    return dropped
+
+
+# ----------------------------------------------------------------------
+# Creación (un archivo temporal por worker; el link es atómico)
+_create_lock = threading.Lock()
+
+
+def _create(partition: Partition):
+    with _create_lock:
+        if os.path.exists(partition.path):
+            return
+        os.makedirs(METRICS_PARTITION_DIR, exist_ok=True)
+        temporary = f"{partition.path}.{os.getpid()}.tmp"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+        partition_engine = create_engine(f"sqlite:///{temporary}")
+        try:
+            ServerMetrics.__table__.create(partition_engine.execution_options(**LEGACY_OPTIONS))
+        finally:
+            partition_engine.dispose()
+        try:
+            os.link(temporary, partition.path)
+        except FileExistsError:
+            # Otro worker la creó al mismo tiempo
+            pass
+        finally:
+            os.remove(temporary)
+
+
+# ----------------------------------------------------------------------
+# ATTACH por conexión (LRU: SQLite admite pocas bases adjuntas)
+def _attach(db: Session, partitions: Iterable[Partition]):
+    pooled = db.connection().connection
+    raw = pooled.dbapi_connection
+    attached: OrderedDict[str, None] = pooled.info.setdefault("partitions", OrderedDict())
+    needed = {partition.name for partition in partitions}
+
+    for partition in partitions:
+        if partition.name in attached:
+            attached.move_to_end(partition.name)
+            continue
+        if raw.in_transaction:
+            raise RuntimeError(
+                f"Partición {partition.name} no adjunta: llamar prepare() antes de escribir"
+            )
+        if not os.path.exists(partition.path):
+            _create(partition)
+
+        limit = raw.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        for victim in [name for name in attached if name not in needed][: max(0, len(attached) - limit + 1)]:
+            raw.execute(f"DETACH DATABASE {victim}")
+            del attached[victim]
+        raw.execute(f"ATTACH DATABASE ? AS {partition.name}", (partition.path,))
+        attached[partition.name] = None
+
+
+@event.listens_for(engine, "checkout")
+def _detach_dropped(dbapi_connection, connection_record, connection_proxy):
+    """Desadjunta las particiones borradas por la retención"""
+    attached = connection_record.info.get("partitions")
+    if not attached:
+        return
+    for name in list(attached):
+        if os.path.exists(os.path.join(METRICS_PARTITION_DIR, f"{name}.db")):
+            continue
+        try:
+            dbapi_connection.execute(f"DETACH DATABASE {name}")
+        except sqlite3.Error:
+            continue
+        del attached[name]
+
+
+def routed(db: Session, partition: Partition | None) -> dict:
+    """Adjunta la partición (None = tabla legacy) y retorna sus opciones de ejecución"""
+    if partition is None:
+        return LEGACY_OPTIONS
+    _attach(db, [partition])
+    return partition.execution_options
+
+
+# ----------------------------------------------------------------------
+# Lectura: particiones que se solapan con [start, end)
+_legacy_empty = False
+
+
+def _legacy_has_rows(db: Session) -> bool:
+    # Ninguna escritura nueva va a la tabla legacy: una vez vacía, queda vacía
+    global _legacy_empty
+    if not _legacy_empty:
+        found = db.execute(select(ServerMetrics.id).limit(1), execution_options=LEGACY_OPTIONS).first()
+        _legacy_empty = found is None
+    return not _legacy_empty
+
+
+def read_partitions(
+    db: Session,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    newest_first: bool = False,
+) -> list[Partition | None]:
+    """Particiones del rango; None = tabla legacy (si aún tiene filas, la más antigua)"""
+    partitions: list[Partition | None] = [
+        partition for partition in list_partitions() if partition.overlaps(start, end)
+    ]
+    if _legacy_has_rows(db):
+        partitions.insert(0, None)
+    if newest_first:
+        partitions.reverse()
+    return partitions
+
+
+# ----------------------------------------------------------------------
+# Escritura
+def prepare(db: Session, timestamps: Iterable[datetime]):
+    """Adjunta (y crea) las particiones de las muestras antes del primer INSERT"""
+    partitions = sorted({Partition.for_timestamp(value) for value in timestamps})
+    if partitions:
+        with stage_timer("partition_attach"):
+            _attach(db, partitions)
+
+
+def _allocate_ids(db: Session, count: int) -> int:
+    """Reserva `count` ids consecutivos y retorna el primero"""
+    # La primera vez la secuencia arranca después del último id legacy
+    seed = select(func.coalesce(func.max(ServerMetrics.id), 0)).scalar_subquery()
+    statement = sqlite_insert(MetricSequence).values(name="metrics", value=seed + count)
+    last = db.scalar(
+        statement.on_conflict_do_update(
+            index_elements=[MetricSequence.name],
+            set_={"value": MetricSequence.value + count},
+        ).returning(MetricSequence.value)
+    )
+    return last - count + 1
+
+
+def init_sequence(db: Session):
+    """Inicializa metric_sequence con el último id legacy (sin reservar ids)"""
+    _allocate_ids(db, 0)
+
+
+def insert_samples(db: Session, samples: list[ServerMetrics]):
+    """Inserta las muestras en su partición y les asigna el id (sin ORM flush)"""
+    if not samples:
+        return
+    first_id = _allocate_ids(db, len(samples))
+    columns = [column.name for column in ServerMetrics.__table__.columns]
+
+    groups: dict[Partition, list[dict]] = {}
+    for offset, sample in enumerate(samples):
+        sample.id = first_id + offset
+        groups.setdefault(Partition.for_timestamp(sample.server_timestamp), []).append(
+            {column: getattr(sample, column) for column in columns}
+        )
+    for partition, rows in groups.items():
+        db.execute(insert(ServerMetrics.__table__), rows, execution_options=routed(db, partition))
+
+
+def last_sample_id(db: Session) -> int:
+    """Último id reservado (o el último id legacy si aún no hay secuencia)"""
+    value = db.scalar(select(MetricSequence.value).where(MetricSequence.name == "metrics"))
+    if value is None:
+        value = db.scalar(
+            select(func.coalesce(func.max(ServerMetrics.id), 0)),
+            execution_options=LEGACY_OPTIONS,
+        )
+    return value
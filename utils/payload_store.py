@@ -0,0 +1,222 @@
+""" Almacenamiento compacto y deduplicado de ServerMetrics.raw_payload
+
+Modo "full": el plaintext JSON del agente se guarda tal cual, sin
+decodificarlo ni re-serializarlo.
+
+Modo "compact": los campos que ya tienen columna propia se reemplazan por
+null, las secciones que se repiten entre muestras de un cliente se agrupan en
+un blob guardado una sola vez en payload_blobs (por hash) y el resto se
+comprime con zstd si conviene. La fila guarda un manifiesto de pocos bytes;
+expand_payloads() reconstruye el documento original (mismos valores, tipos y
+orden de campos).
+
+- Un campo se quita solo si la columna lo devuelve idéntico: el hostname
+  siempre, los porcentajes si el agente los envió como float. El timestamp
+  queda en el manifiesto como texto original (la columna pierde el offset).
+- Si falta el blob de una fila, expand_payloads() falla (RuntimeError) en vez
+  de retornar el documento sin esas secciones.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+import zstandard
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models.metrics import PayloadBlob, ServerMetrics
+from schemas.metrics import AgentDocument
+from .config import get_config
+from .fastjson import dumps, loads, raw_json
+
+RAW_PAYLOAD_STORAGE = get_config().raw_payload_storage
+
+# (sección, campo) -> (columna de ServerMetrics que ya guarda ese valor, tipo
+# que la columna devuelve sin cambios)
+EXTRACTED_FIELDS = {
+    ("system", "hostname"): ("hostname", str),
+    ("cpu", "cpu_percent"): ("cpu_percent", float),
+    ("memory", "percent"): ("memory_percent", float),
+    ("disk", "percent"): ("disk_percent", float),
+}
+COMPACT_MARKER = "_c"
+COMPACT_VERSION = 2
+
+_compressor = zstandard.ZstdCompressor(level=9)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+# ----------------------------------------------------------------------
+# LRU acotado y thread-safe (digests conocidos y blobs ya decodificados)
+class _BoundedLRU:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+_known_blobs = _BoundedLRU(50_000)   # digest -> True (ya existe en payload_blobs)
+_blob_cache = _BoundedLRU(5_000)     # digest -> secciones decodificadas
+_last_digest = _BoundedLRU(100_000)  # (client_id, sección) -> último digest
+
+
+def _digest(encoded: bytes) -> str:
+    # 128 bits en base64url (22 caracteres): la referencia debe ser corta.
+    # Sin ordenar claves: el blob conserva el orden de campos del agente
+    return base64.urlsafe_b64encode(hashlib.sha256(encoded).digest()[:16]).rstrip(b"=").decode()
+
+
+def is_compact(raw_payload) -> bool:
+    return isinstance(raw_payload, dict) and raw_payload.get(COMPACT_MARKER) == COMPACT_VERSION
+
+
+# ----------------------------------------------------------------------
+# Convierte el documento del agente en lo que se guarda en raw_payload
+def store_payload(db: Session, client_id: int, agent_document: AgentDocument):
+    """En modo full retorna el plaintext (raw_json); en compact, el manifiesto"""
+    source = agent_document.source_json()
+    if RAW_PAYLOAD_STORAGE != "compact":
+        if source is not None:
+            return raw_json(source)
+        # MessagePack: no hay texto JSON original, se usan los valores validados
+        return agent_document.model_dump(mode="json", exclude_unset=True)
+
+    # Solo el modo compacto decodifica el plaintext a un dict
+    if source is not None:
+        document = loads(source)
+    else:
+        document = agent_document.model_dump(mode="json", exclude_unset=True)
+
+    static = {}
+    rest = {}
+    for section, value in document.items():
+        if isinstance(value, dict):
+            value = {
+                field: None if _extracted(section, field, field_value) else field_value
+                for field, field_value in value.items()
+            }
+            # Una sección igual a la de la muestra previa del cliente es estática;
+            # en rest queda null para conservar el orden de las secciones
+            digest = _digest(dumps(value))
+            if _last_digest.get((client_id, section)) == digest:
+                static[section] = value
+                rest[section] = None
+                continue
+            _last_digest.set((client_id, section), digest)
+        rest[section] = value
+
+    manifest = {COMPACT_MARKER: COMPACT_VERSION}
+    if static:
+        encoded = dumps(static)
+        digest = _digest(encoded)
+        _ensure_blob(db, digest, encoded)
+        manifest["s"] = digest
+    if rest:
+        encoded = dumps(rest)
+        compressed = base64.b64encode(_compressor.compress(encoded))
+        if len(compressed) < len(encoded):
+            manifest["z"] = compressed.decode()
+        else:
+            manifest["d"] = rest
+    return manifest
+
+
+def _extracted(section: str, field: str, value) -> bool:
+    extracted = EXTRACTED_FIELDS.get((section, field))
+    # type() exacto: un int enviado por el agente volvería como float
+    return extracted is not None and type(value) is extracted[1]
+
+
+def _ensure_blob(db: Session, digest: str, encoded: bytes):
+    """Inserta el blob una sola vez (se confirma con el commit de la métrica)"""
+    if _known_blobs.get(digest):
+        return
+    db.execute(
+        insert(PayloadBlob)
+        .values(digest=digest, data=_compressor.compress(encoded))
+        .on_conflict_do_nothing(index_elements=["digest"])
+    )
+    # Se marca como conocido solo cuando la transacción se confirma
+    db.info.setdefault("pending_blobs", set()).add(digest)
+
+
+@event.listens_for(Session, "after_commit")
+def _promote_pending_blobs(session: Session):
+    for digest in session.info.pop("pending_blobs", ()):
+        _known_blobs.set(digest, True)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_blobs(session: Session):
+    session.info.pop("pending_blobs", None)
+
+
+# ----------------------------------------------------------------------
+# Reconstruye los documentos completos de varias filas (1 query de blobs)
+def expand_payloads(db: Session, rows: list[ServerMetrics]) -> list[dict | None]:
+    missing = {
+        row.raw_payload["s"]
+        for row in rows
+        if is_compact(row.raw_payload)
+        and "s" in row.raw_payload
+        and _blob_cache.get(row.raw_payload["s"]) is None
+    }
+    if missing:
+        blobs = db.execute(
+            select(PayloadBlob.digest, PayloadBlob.data).where(PayloadBlob.digest.in_(missing))
+        ).all()
+        for digest, data in blobs:
+            _blob_cache.set(digest, loads(_decompressor.decompress(data)))
+            _known_blobs.set(digest, True)
+
+    return [_expand(row) for row in rows]
+
+
+def expand_payload(db: Session, row: ServerMetrics) -> dict | None:
+    return expand_payloads(db, [row])[0]
+
+
+def _expand(row: ServerMetrics) -> dict | None:
+    manifest = row.raw_payload
+    if not is_compact(manifest):
+        return manifest
+
+    if "z" in manifest:
+        document = loads(_decompressor.decompress(base64.b64decode(manifest["z"])))
+    else:
+        document = dict(manifest.get("d", {}))
+
+    if "s" in manifest:
+        static = _blob_cache.get(manifest["s"])
+        if static is None:
+            raise RuntimeError(
+                f"raw_payload de la muestra {row.id}: falta el blob {manifest['s']} en payload_blobs"
+            )
+        # Copia: el blob cacheado se comparte entre filas
+        for section, value in static.items():
+            document[section] = dict(value)
+
+    # null en lugar del campo: el valor está en la columna
+    for (section, field), (column, _) in EXTRACTED_FIELDS.items():
+        values = document.get(section)
+        if isinstance(values, dict) and field in values and values[field] is None:
+            values[field] = getattr(row, column)
+    return document
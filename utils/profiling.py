@@ -0,0 +1,139 @@
+""" Perfilado muestreado de stacks por request (formato collapsed/folded) """
+from __future__ import annotations
+
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import UTC, datetime
+from pathlib import Path
+
+from .config import get_config
+
+PROFILE_DIR = get_config().profile_dir
+
+# Nombres de archivo válidos para descargar (evita path traversal)
+PROFILE_NAME_RE = re.compile(r"^[\w.-]+\.folded$")
+
+
+# ----------------------------------------------------------------------
+# Perfil de un request: hilos a muestrear y stacks acumulados
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        # Solo ASCII: el nombre viaja en el header X-Profile-Id (latin-1)
+        slug = re.sub(r"[^\w]+", "-", path, flags=re.ASCII).strip("-") or "root"
+        self.name = (
+            f"{datetime.now(UTC):%Y%m%dT%H%M%S}_{method}_{slug}_{uuid.uuid4().hex[:8]}.folded"
+        )
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        # tid -> profundidad (un hilo puede registrarse de forma anidada)
+        self._threads: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def enter_thread(self):
+        tid = threading.get_ident()
+        with self._lock:
+            self._threads[tid] = self._threads.get(tid, 0) + 1
+
+    def exit_thread(self):
+        tid = threading.get_ident()
+        with self._lock:
+            depth = self._threads.get(tid, 0) - 1
+            if depth > 0:
+                self._threads[tid] = depth
+            else:
+                self._threads.pop(tid, None)
+
+    def sample(self, frames: dict):
+        with self._lock:
+            threads = list(self._threads)
+        for tid in threads:
+            frame = frames.get(tid)
+            if frame is not None:
+                self.stacks[_fold(frame)] += 1
+                self.samples += 1
+
+
+def _fold(frame) -> str:
+    """Convierte un frame en una línea 'raíz;...;hoja' (collapsed stack)"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+# ----------------------------------------------------------------------
+# Hilo muestreador único: solo trabaja mientras hay perfiles activos
+class StackSampler:
+    def __init__(self, interval: float | None = None):
+        # None = PROFILE_INTERVAL_MS vigente (recargable)
+        self.interval = interval
+        self._active: set[RequestProfile] = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, profile: RequestProfile):
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+
+    def stop(self, profile: RequestProfile):
+        with self._lock:
+            self._active.discard(profile)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._wakeup.clear()
+                    continue
+            frames = sys._current_frames()
+            for profile in active:
+                profile.sample(frames)
+            del frames
+            time.sleep(get_config().profile_interval if self.interval is None else self.interval)
+
+
+sampler = StackSampler()
+
+
+# ----------------------------------------------------------------------
+# Persistencia de perfiles en PROFILE_DIR (se conservan los más recientes)
+def save_profile(profile: RequestProfile):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    lines = (f"{stack} {count}" for stack, count in profile.stacks.most_common())
+    (PROFILE_DIR / profile.name).write_text("\n".join(lines) + "\n")
+
+    stored = sorted(PROFILE_DIR.glob("*.folded"))
+    for old in stored[: max(0, len(stored) - get_config().profile_max_files)]:
+        old.unlink(missing_ok=True)
+
+
+def list_profiles() -> list[dict]:
+    if not PROFILE_DIR.is_dir():
+        return []
+    return [
+        {"name": path.name, "size": path.stat().st_size}
+        for path in sorted(PROFILE_DIR.glob("*.folded"), reverse=True)
+    ]
+
+
+def profile_path(name: str) -> Path | None:
+    """Ruta del perfil si el nombre es válido y el archivo existe"""
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = PROFILE_DIR / name
+    return path if path.is_file() else None
@@ -0,0 +1,376 @@
+""" Rate limiting por client_id y por IP (token bucket compartido entre workers)
+
+RATE_LIMITS define los límites como `selector=capacidad/segundos`, separados
+por coma. La capacidad es la ráfaga máxima y se recarga completa en `segundos`:
+
+    ip=1200/60            cada IP (todos los endpoints)
+    client=600/60         cada OAuth client sin rol/scope con límite propio
+    role:agent=600/60     clientes con ese rol
+    scope:bulk=6000/60    clientes con ese scope (prioridad sobre el rol)
+    token=30/60           intentos de POST /clients/token por client_id
+                          (sin este selector usa el de client)
+
+Se aplica en un middleware ASGI, antes de cualquier acceso a la DB: el
+client_id, el rol y los scopes salen de los claims del JWT. El store SQLite y
+la verificación del JWT corren en hilos propios (RATE_LIMIT_THREADS), nunca en
+el event loop; una llave rechazada se recuerda en memoria hasta su
+Retry-After y no vuelve a consultar el store. POST /clients/token trae el
+client_id en el form: su bucket se consulta en el endpoint.
+
+Si el store falla se deja pasar el request, pero se cuenta (gauge rate_limit)
+y se informa por stderr.
+"""
+from __future__ import annotations
+
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+import jwt
+from anyio import CapacityLimiter, to_thread
+from fastapi import HTTPException, status
+from starlette.datastructures import Headers
+
+from .config import Config, get_config, on_reload
+from .fastjson import FastJSONResponse
+from .jwt_keys import jwt_keys
+from .stats import register_gauge, stage_timer
+
+RATE_LIMIT_STORE = get_config().rate_limit_store
+RATE_LIMIT_DB_PATH = get_config().rate_limit_db_path
+
+# Hilos para consultar el store compartido: no compiten con los handlers sync
+RATE_LIMIT_THREADS = 8
+# Un store caído se informa a lo sumo una vez por este intervalo
+STORE_ERROR_REPORT_SECONDS = 60
+
+
+# ----------------------------------------------------------------------
+# Límite de un bucket: capacidad (ráfaga) y recarga en tokens por segundo
+@dataclass(frozen=True, slots=True)
+class Limit:
+    capacity: float
+    rate: float
+
+    @property
+    def refill_seconds(self) -> float:
+        """Tiempo en que un bucket vacío vuelve a estar lleno"""
+        return self.capacity / self.rate
+
+
+def parse_limits(spec: str) -> dict[str, Limit]:
+    """Parsea RATE_LIMITS (ej: "ip=1200/60,role:agent=600/60")"""
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        selector, _, value = item.rpartition("=")
+        capacity, _, seconds = value.partition("/")
+        try:
+            limit = Limit(float(capacity), float(capacity) / float(seconds or 1))
+        except (ValueError, ZeroDivisionError):
+            raise RuntimeError(f"RATE_LIMITS inválido: {item!r}")
+        if not selector or limit.capacity < 1:
+            raise RuntimeError(f"RATE_LIMITS inválido: {item!r}")
+        limits[selector.strip()] = limit
+    return limits
+
+
+# ----------------------------------------------------------------------
+# Store en memoria: solo vale con un worker (o para pruebas)
+class MemoryBucketStore:
+    # Sin I/O: se consulta directo desde el event loop
+    blocking = False
+    errors = 0
+
+    def __init__(self):
+        self._buckets: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, now: float, cost: float = 1.0) -> float:
+        """Consume `cost` tokens; retorna 0 si se permite o los segundos a esperar"""
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (limit.capacity, now))
+            tokens = min(limit.capacity, tokens + max(0.0, now - updated_at) * limit.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = [tokens, max(updated_at, now)]
+        return 0.0 if allowed else (cost - tokens) / limit.rate
+
+    def purge(self, older_than: float):
+        with self._lock:
+            for key in [k for k, (_, updated_at) in self._buckets.items() if updated_at < older_than]:
+                del self._buckets[key]
+
+
+# ----------------------------------------------------------------------
+# Store compartido: archivo SQLite propio (WAL) visible para todos los
+# workers de uvicorn. Cada consumo es un único UPSERT atómico.
+class SQLiteBucketStore:
+    # En un UPDATE todas las expresiones ven los valores previos de la fila
+    TAKE_SQL = """
+        INSERT INTO rate_buckets (key, tokens, updated_at, allowed)
+        VALUES (:key, :capacity - :cost, :now, :capacity >= :cost)
+        ON CONFLICT(key) DO UPDATE SET
+            allowed = min(:capacity, tokens + max(0, :now - updated_at) * :rate) >= :cost,
+            tokens = min(:capacity, tokens + max(0, :now - updated_at) * :rate)
+                - CASE
+                    WHEN min(:capacity, tokens + max(0, :now - updated_at) * :rate) >= :cost
+                    THEN :cost ELSE 0
+                  END,
+            updated_at = max(updated_at, :now)
+        RETURNING allowed, tokens
+    """
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+        self.errors = 0
+        self._reported_at = float("-inf")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una conexión por proceso: se abre después del fork de cada worker
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path,
+                timeout=0.05,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Los buckets son efímeros: no vale la pena esperar al fsync
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                " key TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " allowed INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def take(self, key: str, limit: Limit, now: float, cost: float = 1.0) -> float:
+        """Consume `cost` tokens; retorna 0 si se permite o los segundos a esperar"""
+        params = {
+            "key": key,
+            "capacity": limit.capacity,
+            "rate": limit.rate,
+            "cost": cost,
+            "now": now,
+        }
+        try:
+            with self._lock:
+                allowed, tokens = self._connect().execute(self.TAKE_SQL, params).fetchone()
+        except sqlite3.Error as exc:
+            # Si el store no responde a tiempo se deja pasar el request (contado e informado)
+            self._failed(exc)
+            return 0.0
+        return 0.0 if allowed else (cost - tokens) / limit.rate
+
+    def _failed(self, exc: sqlite3.Error):
+        now = time.monotonic()
+        with self._lock:
+            self.errors += 1
+            report = now - self._reported_at >= STORE_ERROR_REPORT_SECONDS
+            if report:
+                self._reported_at = now
+        if report:
+            print(
+                f"Rate limiting: el store no respondió, se dejó pasar el request "
+                f"({self.errors} errores en total): {exc}",
+                file=sys.stderr,
+            )
+
+    def purge(self, older_than: float):
+        with self._lock:
+            self._connect().execute(
+                "DELETE FROM rate_buckets WHERE updated_at < ?", (older_than,)
+            )
+
+
+# ----------------------------------------------------------------------
+# Resuelve qué límite aplica a cada IP / cliente y consulta el store
+class RateLimiter:
+    def __init__(self, limits: dict[str, Limit], store):
+        self.store = store
+        # Llave -> momento (time.time) hasta el que se rechaza sin consultar el store
+        self._denied: dict[str, float] = {}
+        self.denied_local = 0
+        self.set_limits(limits)
+
+    def set_limits(self, limits: dict[str, Limit]):
+        # Recarga de RATE_LIMITS: los dicts se reemplazan, nunca se mutan
+        self.ip_limit = limits.get("ip")
+        self.client_limit_default = limits.get("client")
+        self.token_limit = limits.get("token", self.client_limit_default)
+        # Límites que requieren los claims del JWT (token se aplica en el endpoint)
+        self.uses_claims = bool(limits.keys() - {"ip", "token"})
+        self.limits = limits
+        self._denied = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limits)
+
+    def client_limit(self, role: str | None, scopes: list[str]) -> Limit | None:
+        """Scope con límite propio (el más generoso) > rol > límite por defecto"""
+        scoped = [self.limits[f"scope:{scope}"] for scope in scopes if f"scope:{scope}" in self.limits]
+        if scoped:
+            return max(scoped, key=lambda limit: limit.rate)
+        return self.limits.get(f"role:{role}", self.client_limit_default)
+
+    def check(self, key: str, limit: Limit | None) -> float:
+        if limit is None:
+            return 0.0
+        now = time.time()
+        until = self._denied.get(key)
+        if until is not None:
+            if until > now:
+                self.denied_local += 1
+                return until - now
+            self._denied.pop(key, None)
+        retry_after = self.store.take(key, limit, now)
+        if retry_after:
+            self._denied[key] = now + retry_after
+        return retry_after
+
+    def check_token_request(self, client_id: str):
+        """Bucket de POST /clients/token por client_id; HTTPException 429 si se agotó"""
+        retry_after = self.check(f"token:{client_id}", self.token_limit)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too Many Requests",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+
+    def purge(self):
+        """Elimina buckets inactivos (ya estarían llenos de nuevo)"""
+        now = time.time()
+        denied = self._denied
+        for key in [key for key, until in list(denied.items()) if until <= now]:
+            denied.pop(key, None)
+        if not self.enabled:
+            return
+        longest = max(limit.refill_seconds for limit in self.limits.values())
+        self.store.purge(now - longest)
+
+
+def _build_rate_limiter() -> RateLimiter:
+    limits = parse_limits(get_config().rate_limits)
+    if RATE_LIMIT_STORE == "memory":
+        return RateLimiter(limits, MemoryBucketStore())
+    return RateLimiter(limits, SQLiteBucketStore(RATE_LIMIT_DB_PATH))
+
+
+rate_limiter = _build_rate_limiter()
+
+register_gauge(
+    "rate_limit",
+    "Rechazos resueltos en memoria y errores del store (requests dejados pasar)",
+    lambda: {
+        "denied_local": rate_limiter.denied_local,
+        "store_errors": rate_limiter.store.errors,
+    },
+)
+
+_store_threads: CapacityLimiter | None = None
+
+
+def _store_limiter() -> CapacityLimiter:
+    # Se crea dentro del event loop
+    global _store_threads
+    if _store_threads is None:
+        _store_threads = CapacityLimiter(RATE_LIMIT_THREADS)
+    return _store_threads
+
+
+@on_reload
+def _reload_limits(previous: Config, config: Config):
+    """RATE_LIMITS se aplica sin reiniciar (los buckets existentes se conservan)"""
+    if config.rate_limits != previous.rate_limits:
+        rate_limiter.set_limits(parse_limits(config.rate_limits))
+
+
+def split_scopes(scopes: str | None) -> list[str]:
+    """Scopes de OAuthClient.scopes (separados por espacio o coma)"""
+    return [scope for scope in re.split(r"[\s,]+", scopes or "") if scope]
+
+
+# ----------------------------------------------------------------------
+# Claims del token de cliente (sin DB); None si no es un token de cliente
+def _client_claims(headers: Headers) -> dict | None:
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt_keys().decode(token)
+    except jwt.PyJWTError:
+        # Token inválido o expirado: el endpoint responderá 401
+        return None
+    if payload.get("type") != "client" or not payload.get("sub"):
+        return None
+    return payload
+
+
+# ----------------------------------------------------------------------
+# Middleware ASGI: 429 + Retry-After antes de llegar al endpoint
+class RateLimitMiddleware:
+    def __init__(self, app, limiter: RateLimiter | None = None):
+        self.app = app
+        self.limiter = limiter or rate_limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limiter.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        with stage_timer("rate_limit"):
+            if self.limiter.store.blocking or self.limiter.uses_claims:
+                # UPSERT en SQLite (puede esperar el lock) y verificación del JWT
+                retry_after = await to_thread.run_sync(
+                    self._retry_after, scope, limiter=_store_limiter()
+                )
+            else:
+                retry_after = self._retry_after(scope)
+
+        if retry_after > 0:
+            response = FastJSONResponse(
+                {"detail": "Too Many Requests"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    def _retry_after(self, scope) -> float:
+        limiter = self.limiter
+        retry_after = 0.0
+
+        client = scope.get("client")
+        if client and limiter.ip_limit:
+            retry_after = limiter.check(f"ip:{client[0]}", limiter.ip_limit)
+            if retry_after:
+                return retry_after
+
+        if limiter.uses_claims:
+            claims = _client_claims(Headers(scope=scope))
+            if claims is not None:
+                limit = limiter.client_limit(claims.get("role"), split_scopes(claims.get("scope")))
+                retry_after = limiter.check(f"client:{claims['sub']}", limit)
+        return retry_after
@@ -1,6 +1,13 @@
+from datetime import datetime
+
 from apscheduler.schedulers.background import BackgroundScheduler
+from .cache import INVALIDATION_POLL_SECONDS, retry_pending_invalidations
 from .database import SessionLocal
 from .security import cleanup_expired_nonces
+from .ratelimit import rate_limiter
+from .alerts import ALERT_DISPATCH_INTERVAL, dispatch_notifications
+from .config import CONFIG_WATCH_SECONDS, watch_config_file
+from .partitions import drop_expired
 
 
 def start_scheduler():
@@ -22,4 +29,50 @@ def start_scheduler():
         replace_existing=True,
     )
 
+    # Buckets de rate limiting inactivos
+    scheduler.add_job(
+        rate_limiter.purge,
+        "interval",
+        minutes=5,
+        id="rate_bucket_cleanup",
+        replace_existing=True,
+    )
+
+    # Entrega del outbox de alertas (no hace nada sin ALERT_WEBHOOK_URL)
+    scheduler.add_job(
+        dispatch_notifications,
+        "interval",
+        seconds=ALERT_DISPATCH_INTERVAL,
+        id="alert_dispatch",
+        replace_existing=True,
+    )
+
+    # Borrado de las particiones de metrics fuera de la retención (0 = nunca)
+    scheduler.add_job(
+        drop_expired,
+        "interval",
+        hours=24,
+        id="metrics_retention",
+        replace_existing=True,
+        next_run_time=datetime.now(),
+    )
+
+    # Invalidaciones de cache que no se pudieron publicar a los demás workers
+    scheduler.add_job(
+        retry_pending_invalidations,
+        "interval",
+        seconds=INVALIDATION_POLL_SECONDS,
+        id="retry_invalidations",
+        replace_existing=True,
+    )
+
+    # Recarga de la configuración si cambió el .env
+    scheduler.add_job(
+        watch_config_file,
+        "interval",
+        seconds=CONFIG_WATCH_SECONDS,
+        id="config_watch",
+        replace_existing=True,
+    )
+
     scheduler.start()
@@ -1,15 +1,13 @@
-from datetime import datetime, timedelta, UTC
+from datetime import datetime, UTC
 from sqlalchemy.orm import Session
 
 from models.security import UsedNonce
-from .config import settings
+from .config import get_config
 
 
 def cleanup_expired_nonces(db: Session):
     """ Elimina los Nounces que tengan mas de NONCE_TTL_MINUTES """
-    expiration_time = datetime.now(UTC) - timedelta(
-        minutes=int(settings.NONCE_TTL_MINUTES.get_secret_value())
-    )
+    expiration_time = datetime.now(UTC) - get_config().nonce_ttl
 
     db.query(UsedNonce).filter(
         UsedNonce.created_at < expiration_time
@@ -0,0 +1,223 @@
+""" Server-Timing por request y disparo del perfilado muestreado """
+from __future__ import annotations
+
+import functools
+import inspect
+import random
+from contextvars import ContextVar
+from time import perf_counter
+
+import jwt
+from anyio import to_thread
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.datastructures import Headers, MutableHeaders
+
+from .config import get_config
+from .database import engine, release_request_db
+from .jwt_keys import jwt_keys
+from .loadshed import DEFAULT_GROUP, admission, route_group
+from .profiling import RequestProfile, sampler, save_profile
+
+PROFILE_HEADER = "x-profile"
+
+
+# ----------------------------------------------------------------------
+# Tiempos de un request; se comparte vía ContextVar con el threadpool
+class RequestTiming:
+    __slots__ = (
+        "start", "route_start", "endpoint_start", "endpoint_end", "route_end",
+        "db_time", "db_queries", "profile",
+    )
+
+    def __init__(self, profile: RequestProfile | None = None):
+        self.start = perf_counter()
+        self.route_start = self.endpoint_start = None
+        self.endpoint_end = self.route_end = None
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.profile = profile
+
+    def header(self) -> str:
+        """Valor del header Server-Timing (duraciones en ms)"""
+        # Los headers se codifican en latin-1: las descripciones van solo en ASCII
+        metrics = []
+        if self.route_start is not None and self.endpoint_start is not None:
+            metrics.append(("deps", self.endpoint_start - self.route_start, "dependencias"))
+        if self.endpoint_start is not None and self.endpoint_end is not None:
+            metrics.append(("handler", self.endpoint_end - self.endpoint_start, "handler"))
+        if self.endpoint_end is not None and self.route_end is not None:
+            metrics.append(("serialize", self.route_end - self.endpoint_end, "serializacion"))
+        metrics.append(("db", self.db_time, f"{self.db_queries} queries"))
+        metrics.append(("total", perf_counter() - self.start, "total"))
+        return ", ".join(
+            f'{name};dur={duration * 1000:.3f};desc="{desc}"'
+            for name, duration, desc in metrics
+        )
+
+
+current_timing: ContextVar[RequestTiming | None] = ContextVar(
+    "current_timing", default=None
+)
+
+
+# ----------------------------------------------------------------------
+# Tiempo de DB: eventos del engine (corren en el hilo de la query)
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = current_timing.get()
+    if timing is not None:
+        conn.info.setdefault("query_start", []).append(perf_counter())
+        if timing.profile is not None:
+            timing.profile.enter_thread()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = current_timing.get()
+    starts = conn.info.get("query_start")
+    if timing is not None and starts:
+        timing.db_time += perf_counter() - starts.pop()
+        timing.db_queries += 1
+        if timing.profile is not None:
+            timing.profile.exit_thread()
+
+
+@event.listens_for(engine, "handle_error")
+def _handle_error(exception_context):
+    # Una query fallida (ej: IntegrityError por replay) no llega a after_cursor
+    timing = current_timing.get()
+    conn = exception_context.connection
+    starts = conn.info.get("query_start") if conn is not None else None
+    if timing is not None and starts:
+        timing.db_time += perf_counter() - starts.pop()
+        timing.db_queries += 1
+        if timing.profile is not None:
+            timing.profile.exit_thread()
+
+
+# ----------------------------------------------------------------------
+# Envuelve el endpoint para medir el handler (mantiene sync/async)
+def _timed_endpoint(endpoint):
+    # include_router vuelve a construir la ruta con el endpoint ya envuelto
+    if getattr(endpoint, "__timed__", False):
+        return endpoint
+
+    def _enter():
+        timing = current_timing.get()
+        if timing is not None:
+            timing.endpoint_start = perf_counter()
+            if timing.profile is not None:
+                timing.profile.enter_thread()
+        return timing
+
+    def _exit(timing):
+        if timing is not None:
+            timing.endpoint_end = perf_counter()
+            if timing.profile is not None:
+                timing.profile.exit_thread()
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            timing = _enter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _exit(timing)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            timing = _enter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _exit(timing)
+    wrapper.__timed__ = True
+    return wrapper
+
+
+# ----------------------------------------------------------------------
+# Ruta que separa dependencias / handler / serialización y limita la
+# concurrencia de su grupo (utils/loadshed.py)
+class TimedRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        self.concurrency_group = getattr(endpoint, "__concurrency_group__", DEFAULT_GROUP)
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        group = route_group(self.concurrency_group)
+
+        async def timed_handler(request):
+            timing = current_timing.get()
+            # Antes de las dependencias: un request descartado no usa hilos ni DB
+            async with admission(group):
+                if timing is not None:
+                    timing.route_start = perf_counter()
+                try:
+                    response = await handler(request)
+                finally:
+                    # Respuesta armada: la conexión vuelve al pool antes de enviarla
+                    release_request_db(request)
+            if timing is not None:
+                timing.route_end = perf_counter()
+            return response
+
+        return timed_handler
+
+
+# ----------------------------------------------------------------------
+# Perfil bajo demanda: header X-Profile + token de usuario admin
+def _is_admin_request(headers: Headers) -> bool:
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        payload = jwt_keys().decode(token)
+    except jwt.InvalidTokenError:
+        return False
+    return payload.get("role") == "admin" and payload.get("type") != "client"
+
+
+def _should_profile(headers: Headers) -> bool:
+    if PROFILE_HEADER in headers and _is_admin_request(headers):
+        return True
+    rate = get_config().profile_sample_rate
+    return rate > 0 and random.random() < rate
+
+
+# ----------------------------------------------------------------------
+# Middleware ASGI: agrega Server-Timing y guarda los perfiles muestreados
+class ServerTimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = None
+        if _should_profile(Headers(scope=scope)):
+            profile = RequestProfile(scope["method"], scope["path"])
+            sampler.start(profile)
+
+        timing = RequestTiming(profile)
+        token = current_timing.set(timing)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timing.header())
+                if profile is not None:
+                    headers.append("X-Profile-Id", profile.name)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timing.reset(token)
+            if profile is not None:
+                sampler.stop(profile)
+                await to_thread.run_sync(save_profile, profile)
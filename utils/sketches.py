@@ -0,0 +1,177 @@
+""" Histogramas mergeables por cliente y bucket de tiempo (percentiles)
+
+- cpu, memoria y disco son porcentajes acotados (0-100): cada sketch es un
+  histograma de bins lineales de SKETCH_RESOLUTION puntos (estilo HDR con
+  precisión fija). El error de cualquier percentil es a lo sumo media
+  resolución, sin importar cuántas muestras se junten.
+- Merge = suma de conteos: los buckets de un rango (y de varios clientes)
+  se combinan sin leer la tabla metrics.
+- Formato compacto: MessagePack de [delta_bin, conteo, delta_bin, conteo, ...]
+  solo con los bins ocupados (enteros chicos = 1 byte cada uno).
+- Se actualizan en la transacción de ingesta (después del flush), una
+  lectura y una escritura por bucket tocado.
+"""
+from __future__ import annotations
+
+import math
+from collections import Counter
+from collections.abc import Iterable
+from datetime import UTC, datetime
+
+import msgpack
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models.metrics import MetricSketch, ServerMetrics
+from .config import get_config
+from .stats import stage_timer
+
+SKETCH_BUCKET_SECONDS = get_config().sketch_bucket_seconds
+
+# Resolución de los bins (puntos porcentuales): 0.1 -> 1001 bins posibles
+SKETCH_RESOLUTION = 0.1
+SKETCH_MAX_BIN = round(100 / SKETCH_RESOLUTION)
+SKETCH_METRICS = ("cpu_percent", "memory_percent", "disk_percent")
+
+
+# ----------------------------------------------------------------------
+# Histograma disperso: bin -> conteo
+class Histogram:
+    __slots__ = ("counts",)
+
+    def __init__(self, counts: Counter | None = None):
+        self.counts = counts if counts is not None else Counter()
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, value: float):
+        self.counts[min(max(round(value / SKETCH_RESOLUTION), 0), SKETCH_MAX_BIN)] += 1
+
+    def merge(self, other: Histogram):
+        self.counts.update(other.counts)
+
+    def quantiles(self, qs: Iterable[float]) -> list[float | None]:
+        """Percentiles (0-100) por nearest-rank, en una sola pasada"""
+        total = self.count
+        if not total:
+            return [None for _ in qs]
+        ranks = sorted((max(1, math.ceil(q / 100 * total)), index) for index, q in enumerate(qs))
+        results: list[float | None] = [None] * len(ranks)
+
+        seen = 0
+        pending = iter(ranks)
+        rank, index = next(pending)
+        for bin_, count in sorted(self.counts.items()):
+            seen += count
+            while seen >= rank:
+                results[index] = round(bin_ * SKETCH_RESOLUTION, 6)
+                try:
+                    rank, index = next(pending)
+                except StopIteration:
+                    return results
+        return results
+
+    def to_bytes(self) -> bytes:
+        flat = []
+        previous = 0
+        for bin_, count in sorted(self.counts.items()):
+            flat.append(bin_ - previous)
+            flat.append(count)
+            previous = bin_
+        return msgpack.packb(flat)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Histogram:
+        flat = msgpack.unpackb(data)
+        counts = Counter()
+        bin_ = 0
+        for index in range(0, len(flat), 2):
+            bin_ += flat[index]
+            counts[bin_] = flat[index + 1]
+        return cls(counts)
+
+
+# ----------------------------------------------------------------------
+# Buckets de tiempo (alineados a la época, en UTC)
+def _utc(value: datetime) -> datetime:
+    # SQLite no guarda la zona horaria: se guardó en UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=UTC)
+    return value.astimezone(UTC)
+
+
+def bucket_start(value: datetime) -> datetime:
+    epoch = _utc(value).timestamp()
+    return datetime.fromtimestamp(epoch - epoch % SKETCH_BUCKET_SECONDS, UTC)
+
+
+# ----------------------------------------------------------------------
+# Suma muestras recién insertadas a los sketches de su bucket (después del
+# flush y antes del commit de la transacción de ingesta)
+def update_sketches(db: Session, client_id: int, samples: Iterable[ServerMetrics]):
+    buckets: dict[datetime, list[ServerMetrics]] = {}
+    for sample in samples:
+        buckets.setdefault(bucket_start(sample.server_timestamp), []).append(sample)
+    if not buckets:
+        return
+
+    with stage_timer("sketch_update"):
+        rows = {
+            _utc(row.bucket_start): row
+            for row in db.scalars(
+                select(MetricSketch).where(
+                    MetricSketch.client_id == client_id,
+                    MetricSketch.bucket_start.in_(list(buckets)),
+                )
+            )
+        }
+        for start, bucket in buckets.items():
+            row = rows.get(start)
+            if row is None:
+                row = MetricSketch(client_id=client_id, bucket_start=start, count=0)
+                db.add(row)
+            for metric in SKETCH_METRICS:
+                data = getattr(row, metric)
+                histogram = Histogram.from_bytes(data) if data else Histogram()
+                for sample in bucket:
+                    histogram.add(getattr(sample, metric))
+                setattr(row, metric, histogram.to_bytes())
+            row.count += len(bucket)
+
+
+# ----------------------------------------------------------------------
+# Merge de los buckets de un rango (de un cliente o de toda la flota)
+def merge_sketches(
+    db: Session,
+    client_id: int | None,
+    start: datetime | None,
+    end: datetime | None,
+) -> tuple[dict[str, Histogram], datetime | None, datetime | None]:
+    """Retorna los histogramas y el rango cubierto (alineado a los buckets)"""
+    query = select(
+        MetricSketch.bucket_start,
+        *(getattr(MetricSketch, metric) for metric in SKETCH_METRICS),
+    )
+    if client_id is not None:
+        query = query.where(MetricSketch.client_id == client_id)
+    # Buckets que se solapan con [start, end)
+    if start is not None:
+        query = query.where(MetricSketch.bucket_start >= bucket_start(start))
+    if end is not None:
+        query = query.where(MetricSketch.bucket_start < _utc(end))
+
+    histograms = {metric: Histogram() for metric in SKETCH_METRICS}
+    first = last = None
+    with stage_timer("sketch_merge"):
+        for row in db.execute(query):
+            for metric, data in zip(SKETCH_METRICS, row[1:]):
+                histograms[metric].merge(Histogram.from_bytes(data))
+            bucket = _utc(row.bucket_start)
+            first = bucket if first is None else min(first, bucket)
+            last = bucket if last is None else max(last, bucket)
+
+    if last is not None:
+        last = datetime.fromtimestamp(last.timestamp() + SKETCH_BUCKET_SECONDS, UTC)
+    return histograms, first, last
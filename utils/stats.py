@@ -0,0 +1,123 @@
+""" Histogramas en memoria y gauges para instrumentar el hot path """
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left
+from collections.abc import Callable
+from time import perf_counter
+
+# Límites superiores (segundos) de los buckets, estilo Prometheus
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+
+# ----------------------------------------------------------------------
+# Histograma acumulativo con lock propio (observe es O(log buckets))
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count", "_lock")
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # Un contador extra para el bucket +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self) -> tuple[list[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+
+# ----------------------------------------------------------------------
+# Timer de bajo costo para usar como `with stage_timer("nonce_insert"):`
+class StageTimer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.start)
+        return False
+
+
+_stage_histograms: dict[str, Histogram] = {}
+_stage_lock = threading.Lock()
+_gauges: dict[str, tuple[str, Callable[[], float | dict[str, float]]]] = {}
+
+
+def stage_histogram(stage: str) -> Histogram:
+    """Obtiene (o crea) el histograma de una etapa del hot path"""
+    histogram = _stage_histograms.get(stage)
+    if histogram is None:
+        with _stage_lock:
+            histogram = _stage_histograms.setdefault(stage, Histogram())
+    return histogram
+
+
+def stage_timer(stage: str) -> StageTimer:
+    """Context manager que mide la duración de una etapa"""
+    return StageTimer(stage_histogram(stage))
+
+
+# ----------------------------------------------------------------------
+# Gauges: se evalúan al momento de exportar (pool, threadpool, colas)
+def register_gauge(
+    name: str,
+    help_text: str,
+    callback: Callable[[], float | dict[str, float]],
+):
+    """Registra un gauge; el callback retorna un valor o {label: valor}"""
+    _gauges[name] = (help_text, callback)
+
+
+# ----------------------------------------------------------------------
+# Exporta histogramas y gauges en formato de texto Prometheus
+def render_prometheus() -> str:
+    lines = [
+        "# HELP hotpath_stage_duration_seconds Duración por etapa del hot path",
+        "# TYPE hotpath_stage_duration_seconds histogram",
+    ]
+    for stage, histogram in sorted(_stage_histograms.items()):
+        counts, total, count = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            lines.append(
+                f'hotpath_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(
+            f'hotpath_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}'
+        )
+        lines.append(f'hotpath_stage_duration_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'hotpath_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+
+    for name, (help_text, callback) in sorted(_gauges.items()):
+        try:
+            value = callback()
+        except Exception:
+            # Un gauge roto no debe tumbar el endpoint de stats
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        if isinstance(value, dict):
+            for label, label_value in sorted(value.items()):
+                lines.append(f'{name}{{name="{label}"}} {label_value}')
+        else:
+            lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
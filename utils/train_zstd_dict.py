@@ -0,0 +1,60 @@
+""" Entrena el diccionario zstd con los payloads recientes de los agentes
+
+Uso (desde la raíz del repo):
+    python -m utils.train_zstd_dict [salida] [--samples N] [--size BYTES] [--format json|msgpack]
+"""
+import argparse
+from pathlib import Path
+
+import msgpack
+import zstandard
+from sqlalchemy import select
+
+from models.metrics import ServerMetrics
+from utils.config import get_config
+from utils.database import SessionLocal
+from utils.partitions import read_partitions, routed
+from utils.fastjson import dumps
+from utils.payload_store import expand_payloads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entrena el diccionario zstd de ingesta")
+    parser.add_argument(
+        "output",
+        nargs="?",
+        default=get_config().zstd_dict_path or "utils/metrics.zdict",
+    )
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=16 * 1024)
+    # Debe coincidir con la serialización del plaintext en los agentes
+    parser.add_argument("--format", choices=("json", "msgpack"), default="json")
+    args = parser.parse_args()
+
+    encode = dumps if args.format == "json" else msgpack.packb
+    with SessionLocal() as db:
+        # Particiones más recientes primero, hasta juntar las muestras pedidas
+        rows = []
+        for partition in read_partitions(db, newest_first=True):
+            rows += db.execute(
+                select(ServerMetrics)
+                .where(ServerMetrics.raw_payload.is_not(None))
+                .order_by(ServerMetrics.id.desc())
+                .limit(args.samples - len(rows)),
+                execution_options=routed(db, partition),
+            ).scalars().all()
+            if len(rows) >= args.samples:
+                break
+        # Documentos completos, aunque estén guardados en modo compacto
+        payloads = expand_payloads(db, rows)
+
+    if len(payloads) < 10:
+        raise SystemExit("Se necesitan al menos 10 payloads para entrenar")
+
+    dictionary = zstandard.train_dictionary(args.size, [encode(p) for p in payloads])
+    Path(args.output).write_bytes(dictionary.as_bytes())
+    print(f"Diccionario {dictionary.dict_id()} ({len(payloads)} muestras) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()